@@ -0,0 +1,115 @@
+"""
+Benchmarks of every route of the API through the Flask test client against
+generated training logs. Requires pytest-benchmark. Run from the root folder:
+
+    pytest benchmarks/api_bench.py [--bench-sizes 1k,100k,1M]
+
+Every benchmark is compared against benchmarks/baseline.json, see
+conftest.py. To record a new baseline on the machine that runs the
+comparisons, add --update-baseline.
+"""
+
+import pytest
+
+from workoutlog import db
+from workoutlog.models import Exercise, Set, Workout
+
+pytest.importorskip("pytest_benchmark")
+
+EXERCISE = "Squat"
+
+# Routes by name, as method and URL template. The URLs are filled in with a
+# workout of the middle of the generated log.
+ROUTES = {
+    "entry": ("GET", "/api/"),
+    "workouts": ("GET", "/api/workouts/"),
+    "workouts_embed_summary": ("GET", "/api/workouts/?embed=summary"),
+    "workouts_by_exercise": ("GET", "/api/exercises/{exercise}/workouts/"),
+    "workout": ("GET", "/api/workouts/{workout_id}/"),
+    "workout_of_exercise": ("GET", "/api/exercises/{exercise}/workouts/{workout_id}/"),
+    "workout_put": ("PUT", "/api/workouts/{workout_id}/"),
+    "exercises": ("GET", "/api/exercises/"),
+    "exercises_within_workout": ("GET", "/api/workouts/{workout_id}/exercises/"),
+    "exercise": ("GET", "/api/exercises/{exercise}/"),
+    "exercise_of_workout": ("GET", "/api/workouts/{workout_id}/exercises/{exercise}/"),
+    "sets_workouts_path": ("GET", "/api/workouts/{workout_id}/exercises/{exercise}/sets/"),
+    "sets_exercises_path": ("GET", "/api/exercises/{exercise}/workouts/{workout_id}/sets/"),
+    "set_workouts_path": ("GET", "/api/workouts/{workout_id}/exercises/{exercise}/sets/1/"),
+    "set_exercises_path": ("GET", "/api/exercises/{exercise}/workouts/{workout_id}/sets/1/"),
+    "max_data": ("GET", "/api/exercises/{exercise}/max-data/"),
+    "max_data_item": ("GET", "/api/exercises/{exercise}/max-data/1/"),
+    "exercise_stats": ("GET", "/api/exercises/{exercise}/stats/"),
+    "exercise_e1rm": ("GET", "/api/exercises/{exercise}/e1rm/?formula=rpe"),
+    "weekly_programming": ("GET", "/api/weekly-programming/"),
+    "weekly_programming_for_exercise": ("GET", "/api/exercises/{exercise}/weekly-programming/"),
+    "weekly_programming_item": ("GET", "/api/weekly-programming/Main lift/1/"),
+    "weekly_programming_of_exercise": ("GET", "/api/exercises/{exercise}/weekly-programming/Main lift/1/"),
+    "export": ("GET", "/api/export.ndjson"),
+    "import": ("POST", "/api/import/")
+}
+
+# The PUT and the import write the same data again, so the database doesn't
+# change between the rounds
+IMPORT_CSV = (
+    "date_time,exercise_name,order_in_workout,weight,number_of_reps\n"
+    "2014-12-31T12:00,Squat,1,100,5\n"
+)
+
+
+def _url_args(app):
+    with app.app_context():
+        workout_ids = [workout_id for workout_id, in db.session.query(
+            Set.workout_id.distinct()
+        ).join(Exercise).filter(
+            Exercise.exercise_name == EXERCISE
+        ).order_by(Set.workout_id)]
+    return {
+        "exercise": EXERCISE,
+        "workout_id": workout_ids[len(workout_ids) // 2]
+    }
+
+
+def _read(resp):
+    resp.get_data()
+    return resp
+
+
+def test_routes_covered(bench_app):
+    """
+    Tests that every route of the API has a benchmark.
+    """
+
+    adapter = bench_app.url_map.bind("localhost")
+    args = _url_args(bench_app)
+    covered = set()
+    for method, url in ROUTES.values():
+        endpoint, values = adapter.match(url.format(**args).split("?")[0], method=method)
+        covered.add((endpoint, method))
+    for rule in bench_app.url_map.iter_rules():
+        if rule.endpoint.startswith("api.") and "GET" in rule.methods:
+            assert (rule.endpoint, "GET") in covered, rule.rule
+
+
+@pytest.mark.parametrize("route", sorted(ROUTES))
+def test_route(benchmark, baseline, bench_app, size, route):
+    client = bench_app.test_client()
+    method, url = ROUTES[route]
+    url = url.format(**_url_args(bench_app))
+    if route == "workout_put":
+        # The duration of the GET is formatted for reading, so it's left out
+        item = client.get(url).get_json()
+        body = {
+            key: value for key, value in item.items()
+            if key in Workout.get_schema()["properties"] and key != "duration"
+            and value is not None
+        }
+        request = lambda: client.put(url, json=body)
+    elif route == "import":
+        request = lambda: client.post(url, data=IMPORT_CSV, content_type="text/csv")
+    else:
+        request = lambda: client.get(url)
+
+    # Streamed responses are read to the end
+    resp = benchmark(lambda: _read(request()))
+    assert resp.status_code < 300, resp.data
+    baseline.check("{}[{}]".format(route, size), benchmark.stats.stats.median)
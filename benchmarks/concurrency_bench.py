@@ -0,0 +1,202 @@
+"""
+Concurrent read load against the WSGI and the ASGI entry points, with the
+same number of threads. Run from the root folder:
+
+    pytest benchmarks/concurrency_bench.py [--bench-clients 32]
+        [--bench-idle-clients 16] [--bench-threads 8]
+
+Every reader requests each URL of READ_URLS once. While they do, the idle
+clients hold a connection open by sending their request body slowly, like
+long-polling clients. A threaded WSGI server spends a thread on every
+connection, so the idle clients hold threads the readers need. The ASGI app
+only takes a thread once a request has been received.
+
+Both modes must return the same responses. Their median latencies of the
+readers are compared against benchmarks/baseline.json, see conftest.py.
+"""
+
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from workoutlog import db
+from workoutlog.asgi import AsgiAdapter
+from workoutlog.models import Exercise, Set
+
+EXERCISE = "Squat"
+
+# Seconds an idle client takes to send its request
+IDLE_SECONDS = 0.5
+
+READ_URLS = (
+    "/api/workouts/",
+    "/api/workouts/?embed=summary",
+    "/api/workouts/{workout_id}/",
+    "/api/workouts/{workout_id}/exercises/",
+    "/api/workouts/{workout_id}/exercises/{exercise}/sets/",
+    "/api/exercises/",
+    "/api/exercises/{exercise}/workouts/",
+    "/api/exercises/{exercise}/stats/",
+    "/api/weekly-programming/"
+)
+
+# Idle clients post the same set again, so the database doesn't change
+IDLE_CSV = (
+    b"date_time,exercise_name,order_in_workout,weight,number_of_reps\n"
+    b"2014-12-31T12:00,Squat,1,100,5\n"
+)
+
+
+def _urls(app):
+    with app.app_context():
+        workout_ids = [workout_id for workout_id, in db.session.query(
+            Set.workout_id.distinct()
+        ).join(Exercise).filter(
+            Exercise.exercise_name == EXERCISE
+        ).order_by(Set.workout_id)]
+    args = {"exercise": EXERCISE, "workout_id": workout_ids[len(workout_ids) // 2]}
+    return [url.format(**args) for url in READ_URLS]
+
+
+class _SlowStream(io.BytesIO):
+    # Request body that arrives after IDLE_SECONDS
+
+    def _wait(self):
+        if self.tell() == 0:
+            time.sleep(IDLE_SECONDS)
+
+    def read(self, *args):
+        self._wait()
+        return super().read(*args)
+
+    def readline(self, *args):
+        self._wait()
+        return super().readline(*args)
+
+
+def _wsgi_request(app, start, url, body=None):
+    # The latency includes the time spent waiting for a thread
+    if body is None:
+        environ = EnvironBuilder(url).get_environ()
+    else:
+        environ = EnvironBuilder(url, method="POST", content_type="text/csv",
+            input_stream=_SlowStream(body),
+            content_length=len(body)
+        ).get_environ()
+    app_iter, status, headers = run_wsgi_app(app, environ, buffered=True)
+    return url, int(status.split(" ", 1)[0]), b"".join(app_iter), time.perf_counter() - start
+
+
+def _run_wsgi(app, urls, clients, idle_clients, threads):
+    # A threaded WSGI server: every connection takes one of the threads
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        idle = [
+            executor.submit(_wsgi_request, app, start, "/api/import/", IDLE_CSV)
+            for i in range(idle_clients)
+        ]
+        readers = [
+            executor.submit(_wsgi_request, app, start, url)
+            for i in range(clients) for url in urls
+        ]
+        responses = [future.result() for future in readers]
+        assert all(future.result()[1] == 200 for future in idle)
+    return responses
+
+
+async def _asgi_request(app, url, body=None):
+    start = time.perf_counter()
+    path, _, query_string = url.partition("?")
+    if body is None:
+        method, headers = "GET", []
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    else:
+        method, headers = "POST", [(b"content-type", b"text/csv")]
+        messages = [
+            {"type": "http.request", "body": b"", "more_body": True},
+            {"type": "http.request", "body": body, "more_body": False}
+        ]
+    sent = []
+
+    async def receive():
+        if body is not None and len(messages) == 1:
+            await asyncio.sleep(IDLE_SECONDS)
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": headers,
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 50000)
+    }, receive, send)
+    return (
+        url,
+        sent[0]["status"],
+        b"".join(message["body"] for message in sent[1:]),
+        time.perf_counter() - start
+    )
+
+
+def _run_asgi(app, urls, clients, idle_clients, threads):
+    adapter = AsgiAdapter(app, threads)
+
+    async def run():
+        idle = [
+            asyncio.ensure_future(_asgi_request(adapter, "/api/import/", IDLE_CSV))
+            for i in range(idle_clients)
+        ]
+        responses = await asyncio.gather(*[
+            _asgi_request(adapter, url) for i in range(clients) for url in urls
+        ])
+        assert all(response[1] == 200 for response in await asyncio.gather(*idle))
+        return responses
+
+    try:
+        return asyncio.run(run())
+    finally:
+        adapter.executor.shutdown()
+
+
+@pytest.mark.parametrize("mode", ["wsgi", "asgi"])
+def test_concurrent_reads(baseline, bench_app, size, mode, request):
+    config = request.config
+    clients = config.getoption("--bench-clients")
+    idle_clients = config.getoption("--bench-idle-clients")
+    threads = config.getoption("--bench-threads")
+    urls = _urls(bench_app)
+    run = _run_wsgi if mode == "wsgi" else _run_asgi
+
+    # Warm up, then compare the responses against sequential requests
+    client = bench_app.test_client()
+    client.post("/api/import/", data=IDLE_CSV, content_type="text/csv")
+    expected = {url: client.get(url).data for url in urls}
+    start = time.perf_counter()
+    responses = run(bench_app, urls, clients, idle_clients, threads)
+    seconds = time.perf_counter() - start
+    for url, status, body, latency in responses:
+        assert status == 200, url
+        assert body == expected[url], url
+
+    latencies = sorted(response[3] for response in responses)
+    median = statistics.median(latencies)
+    print("\n{} [{}]: {} reads with {} idle clients and {} threads in {:.2f} s, "
+          "{:.0f} reads/s, median {:.1f} ms, p95 {:.1f} ms".format(
+        mode, size, len(responses), idle_clients, threads, seconds,
+        len(responses) / seconds, median * 1000,
+        latencies[int(len(latencies) * 0.95)] * 1000
+    ))
+    baseline.check("concurrent_reads_{}[{}]".format(mode, size), median)
@@ -0,0 +1,127 @@
+"""
+Fixtures and options of the benchmarks in api_bench.py and
+concurrency_bench.py. The database of every size is generated once per
+session with workoutlog.loadgen.
+
+The median of every benchmark is compared against the JSON baseline, and a
+benchmark that is slower than its baseline by more than the tolerance fails,
+as does a benchmark that has no baseline. The committed baseline.json was
+recorded with the default options for the sizes 1k, 100k and 1M. Other sizes
+and machines need their own baseline, recorded with --update-baseline.
+"""
+
+import json
+import os
+import tempfile
+
+import pytest
+
+from workoutlog import create_app, db, importer, loadgen
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+_SUFFIXES = {"k": 1000, "M": 1000000}
+
+
+def _parse_size(size):
+    if size[-1] in _SUFFIXES:
+        return int(size[:-1]) * _SUFFIXES[size[-1]]
+    return int(size)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("workoutlog benchmarks")
+    group.addoption("--bench-sizes", default="1k",
+        help="Comma separated numbers of sets to benchmark with, e.g. 1k,100k,1M")
+    group.addoption("--bench-baseline", default=BASELINE_PATH,
+        help="JSON file of the baseline medians")
+    group.addoption("--bench-tolerance", type=float, default=0.25,
+        help="Allowed slowdown against the baseline, 0.25 is 25 %%")
+    group.addoption("--update-baseline", action="store_true",
+        help="Write the medians of this run to the baseline instead of comparing")
+    group.addoption("--bench-clients", type=int, default=32,
+        help="Concurrent readers of concurrency_bench.py")
+    group.addoption("--bench-idle-clients", type=int, default=16,
+        help="Slow clients that hold a connection open in concurrency_bench.py")
+    group.addoption("--bench-threads", type=int, default=8,
+        help="Threads of the server in concurrency_bench.py")
+
+
+def pytest_generate_tests(metafunc):
+    if "size" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("--bench-sizes").split(",")
+        metafunc.parametrize("size", sizes, scope="session")
+
+
+@pytest.fixture(scope="session")
+def bench_app(size):
+    """
+    App with a generated training log of the given number of sets.
+    """
+
+    db_fd, db_fname = tempfile.mkstemp()
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "TESTING": True
+    })
+    with app.app_context():
+        db.create_all()
+        records = loadgen.generate_training_log(max_sets=_parse_size(size), seed=0)
+        importer.import_records(enumerate(records, 1))
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    os.close(db_fd)
+    for fname in (db_fname, db_fname + "-wal", db_fname + "-shm"):
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+
+class Baseline(object):
+    """
+    Medians of the benchmarks in seconds, by benchmark name.
+    """
+
+    def __init__(self, path, tolerance, update):
+        self.path = path
+        self.tolerance = tolerance
+        self.update = update
+        self.medians = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.medians = json.load(f)
+
+    def check(self, name, median):
+        if self.update:
+            self.medians[name] = median
+            return
+        if name not in self.medians:
+            pytest.fail("{} has no baseline in {}, record one with --update-baseline".format(
+                name, self.path
+            ))
+        limit = self.medians[name] * (1 + self.tolerance)
+        if median > limit:
+            pytest.fail("{} regressed: median {:.3f} ms, baseline {:.3f} ms".format(
+                name, median * 1000, self.medians[name] * 1000
+            ))
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.medians, f, indent=4, sort_keys=True)
+            f.write("\n")
+
+
+@pytest.fixture(scope="session")
+def baseline(request):
+    config = request.config
+    baseline = Baseline(
+        config.getoption("--bench-baseline"),
+        config.getoption("--bench-tolerance"),
+        config.getoption("--update-baseline")
+    )
+    yield baseline
+    if baseline.update:
+        baseline.save()
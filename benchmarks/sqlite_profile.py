@@ -0,0 +1,120 @@
+"""
+Compares the read and write throughput of the API with the tuned SQLite
+profile (SQLITE_PRAGMAS in create_app) against plain SQLite defaults.
+
+Run from the root folder:
+
+    python -m benchmarks.sqlite_profile [--threads 8] [--requests 200]
+
+Every thread uses its own test client, so the writers compete for the
+database lock like requests served by a threaded server do.
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+from workoutlog import create_app, db
+
+# Only the foreign keys, everything else as SQLite defaults to
+DEFAULT_PRAGMAS = {
+    "foreign_keys": "ON"
+}
+
+
+def _create_app(db_fname, pragmas):
+    config = {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "TESTING": True
+    }
+    if pragmas is not None:
+        config["SQLITE_PRAGMAS"] = pragmas
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def _run_threads(app, threads, work):
+    errors = []
+    start = time.perf_counter()
+
+    def run(thread_number):
+        client = app.test_client()
+        try:
+            work(client, thread_number)
+        except Exception as exc:
+            errors.append(exc)
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+
+def _benchmark(name, pragmas, threads, requests):
+    db_fd, db_fname = tempfile.mkstemp()
+    app = _create_app(db_fname, pragmas)
+    start_date = datetime.datetime(2020, 1, 1)
+    results = {"write": 0, "write_failed": 0, "read": 0, "read_failed": 0}
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            results[key] += 1
+
+    def write(client, thread_number):
+        for i in range(requests):
+            minutes = thread_number * requests + i
+            resp = client.post("/api/workouts/", json={
+                "date_time": (start_date + datetime.timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M"),
+                "duration": "01:00",
+                "body_weight": 70
+            })
+            count("write" if resp.status_code == 201 else "write_failed")
+
+    def read(client, thread_number):
+        for i in range(requests):
+            resp = client.get("/api/workouts/?limit=20")
+            count("read" if resp.status_code == 200 else "read_failed")
+
+    write_time, write_errors = _run_threads(app, threads, write)
+    read_time, read_errors = _run_threads(app, threads, read)
+
+    print("{}:".format(name))
+    print("    writes: {:8.1f} req/s, {} failed".format(
+        results["write"] / write_time,
+        results["write_failed"] + len(write_errors)
+    ))
+    print("    reads:  {:8.1f} req/s, {} failed".format(
+        results["read"] / read_time,
+        results["read_failed"] + len(read_errors)
+    ))
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    os.close(db_fd)
+    for fname in (db_fname, db_fname + "-wal", db_fname + "-shm"):
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200,
+        help="requests per thread")
+    args = parser.parse_args()
+
+    _benchmark("SQLite defaults", DEFAULT_PRAGMAS, args.threads, args.requests)
+    _benchmark("Tuned profile", None, args.threads, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures the latency of editing a workout's date_time with PUT as the number
+of workouts in the database grows. The latency should stay flat, because
+the collision check is a single lookup from the unique index of date_time.
+
+Run from the root folder:
+
+    python -m benchmarks.workout_put [--sizes 100 1000 10000] [--requests 100]
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from workoutlog import create_app, db
+from workoutlog.models import Workout
+
+
+def _benchmark(size, requests):
+    db_fd, db_fname = tempfile.mkstemp()
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "TESTING": True
+    })
+    start_date = datetime.datetime(2000, 1, 1)
+    with app.app_context():
+        db.create_all()
+        db.session.bulk_insert_mappings(Workout, [
+            {"date_time": start_date + datetime.timedelta(hours=i)}
+            for i in range(size)
+        ])
+        db.session.commit()
+
+    client = app.test_client()
+    timings = []
+    for i in range(requests):
+        date_time = start_date - datetime.timedelta(hours=i + 1)
+        start = time.perf_counter()
+        resp = client.put("/api/workouts/1/", json={
+            "date_time": date_time.strftime("%Y-%m-%d %H:%M")
+        })
+        timings.append(time.perf_counter() - start)
+        assert resp.status_code == 204, resp.data
+
+    print("{:>10} workouts: median {:7.2f} ms, max {:7.2f} ms".format(
+        size,
+        statistics.median(timings) * 1000,
+        max(timings) * 1000
+    ))
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    os.close(db_fd)
+    for fname in (db_fname, db_fname + "-wal", db_fname + "-shm"):
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        _benchmark(size, args.requests)
+
+
+if __name__ == "__main__":
+    main()
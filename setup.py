@@ -12,5 +12,11 @@ setup(
         "flask-sqlalchemy",
         "SQLAlchemy",
         "jsonschema"
-    ]
+    ],
+    extras_require={
+        "fast": ["orjson", "numpy"]
+    },
+    entry_points={
+        "console_scripts": ["workoutlog = workoutlog.server:cli"]
+    }
 )
@@ -1,15 +1,26 @@
+import asyncio
 import json
+import multiprocessing
 import os
+import re
 import pytest
+import socket
 import tempfile
+import threading
+import time
 import datetime
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from jsonschema import validate
+from flask import url_for
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
 
-from workoutlog import create_app, db
-from workoutlog.models import Workout, Exercise, Set, MaxData, WeeklyProgramming
-from workoutlog.utils import strfTimedelta
+import workoutlog.utils
+from workoutlog import asgi, cache, create_app, db, importer, models, server, sharding, tenancy
+from workoutlog.models import Workout, Exercise, Set, MaxData, WeeklyProgramming, User
+from workoutlog.utils import link_for, strfTimedelta
+from tests.query_counter import QueryCounter
 
 
 # Enforce foreign key constraints
@@ -41,6 +52,36 @@ def client():
     os.close(db_fd)
     os.unlink(db_fname)
 
+# App with three shards of which at most two are open at a time, see
+# workoutlog/sharding.py
+@pytest.fixture
+def sharded_client(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "main.db"),
+        "SHARD_DATABASE_URIS": [
+            "sqlite:///" + str(tmp_path / "shard-{}.db".format(shard)) for shard in range(3)
+        ],
+        "SHARD_ENGINE_POOL_SIZE": 2,
+        "TESTING": True
+    })
+    runner = app.test_cli_runner()
+    runner.invoke(models.init_db_command)
+    for username in ("alice", "bob", "carol"):
+        runner.invoke(models.create_user_command, [username])
+
+    yield app.test_client()
+
+    with app.app_context():
+        db.session.remove()
+        for engine in sharding.database_engines():
+            engine.dispose()
+
+# Counts the SQL statements of the requests made within it, see
+# tests/query_counter.py
+@pytest.fixture
+def query_counter(client):
+    return QueryCounter(db.get_engine(client.application))
+
 
 def _populate_db():
     # Workouts
@@ -328,6 +369,297 @@ class TestApiEntry(object):
         body = json.loads(resp.data)
 
 
+class TestSerialization(object):
+    
+    RESOURCE_URL = "/api/workouts/"
+
+    # test that responses are compact unless pretty printing is asked for
+    def test_get_compact(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        assert b"\n" not in resp.data
+        assert b'": ' not in resp.data
+        compact = json.loads(resp.data)
+
+        resp = client.get(self.RESOURCE_URL + "?pretty=1")
+        assert resp.status_code == 200
+        assert b'\n    "@namespaces": {' in resp.data
+        assert len(resp.data) > len(json.dumps(compact))
+        assert json.loads(resp.data) == compact
+
+        # errors are compact too
+        resp = client.get("/api/workouts/42/")
+        assert resp.status_code == 404
+        assert b"\n" not in resp.data
+
+    # test that the standard library json module is used without orjson
+    def test_get_without_orjson(self, client, monkeypatch):
+        resp = client.get(self.RESOURCE_URL)
+        monkeypatch.setattr(workoutlog.utils, "orjson", None)
+        resp_stdlib = client.get(self.RESOURCE_URL)
+        assert resp_stdlib.status_code == 200
+        assert b"\n" not in resp_stdlib.data
+        assert json.loads(resp_stdlib.data) == json.loads(resp.data)
+
+
+class TestLinkTemplates(object):
+    
+    RESOURCE_URLS = [
+        "/api/",
+        "/api/workouts/",
+        "/api/workouts/1/",
+        "/api/workouts/1/exercises/?embed=sets",
+        "/api/workouts/1/exercises/Squat/",
+        "/api/workouts/1/exercises/Squat/sets/",
+        "/api/workouts/1/exercises/Squat/sets/1/",
+        "/api/exercises/",
+        "/api/exercises/Paused%20Squat/",
+        "/api/exercises/Paused%20Squat/workouts/",
+        "/api/exercises/Paused%20Squat/workouts/2/",
+        "/api/exercises/Paused%20Squat/workouts/2/sets/",
+        "/api/exercises/Paused%20Squat/max-data/",
+        "/api/exercises/Paused%20Squat/max-data/1/",
+        "/api/exercises/Squat/weekly-programming/",
+        "/api/weekly-programming/",
+        "/api/weekly-programming/Main%20lift/1/",
+    ]
+
+    # test that the templates create the same links as url_for
+    def test_link_for(self, client):
+        app = client.application
+        values = {
+            "workout_id": 12,
+            "exercise_name": "Paused Squat/ä%?#",
+            "order_in_workout": 3,
+            "order_for_exercise": 4,
+            "exercise_type": "Main lift",
+            "week_number": 2,
+        }
+        with app.test_request_context("/api/"):
+            for rule in app.url_map.iter_rules():
+                if not rule.endpoint.startswith("api."):
+                    continue
+                args = {arg: values[arg] for arg in rule.arguments}
+                assert link_for(rule.endpoint, **args) == url_for(rule.endpoint, **args)
+            
+            # query string arguments are left to url_for
+            assert link_for("api.workoutcollection", before="x y", limit=None) == \
+                url_for("api.workoutcollection", before="x y")
+
+    # test that the responses are byte-identical to the ones built with url_for
+    def test_get_identical(self, client):
+        app = client.application
+        templated = [client.get(url).data for url in self.RESOURCE_URLS]
+        templates = app.extensions["link_templates"]
+        templates._templates = {}
+        for url, data in zip(self.RESOURCE_URLS, templated):
+            resp = client.get(url)
+            assert resp.status_code == 200
+            assert resp.data == data
+
+
+class TestConditionalGet(object):
+    
+    RESOURCE_URL = "/api/workouts/"
+
+    # test that unchanged resources are answered with 304 Not Modified
+    def test_get_not_modified(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+        assert resp.headers["Last-Modified"]
+        
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.headers["ETag"] == etag
+        assert resp.data == b""
+        
+        # another URL doesn't share the ETag
+        resp = client.get(self.RESOURCE_URL + "?limit=1", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        
+        # changing a workout changes the ETag
+        resp = client.post(self.RESOURCE_URL, json=_get_workout_json())
+        assert resp.status_code == 201
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+        assert len(json.loads(resp.data)["items"]) == 3
+
+    # test that changes to association tables and related tables are noticed
+    def test_get_related_changes(self, client):
+        resp = client.get("/api/workouts/1/exercises/")
+        etag = resp.headers["ETag"]
+        resp = client.post("/api/workouts/1/exercises/", json={"exercise_name": "Paused Squat"})
+        assert resp.status_code == 201
+        resp = client.get("/api/workouts/1/exercises/", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+        
+        resp = client.delete("/api/workouts/1/exercises/Squat/sets/1/")
+        assert resp.status_code == 204
+        resp = client.get("/api/workouts/1/exercises/", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        
+        # errors don't get ETags
+        resp = client.get("/api/workouts/42/exercises/")
+        assert resp.status_code == 404
+        assert "ETag" not in resp.headers
+
+
+class TestQueryPlans(object):
+
+    # every GET route of the API with data from _populate_db
+    RESOURCE_URLS = [
+        "/api/workouts/",
+        "/api/workouts/?limit=1",
+        "/api/workouts/1/",
+        "/api/exercises/",
+        "/api/exercises/Squat/",
+        "/api/exercises/Squat/workouts/",
+        "/api/exercises/Squat/workouts/1/",
+        "/api/workouts/1/exercises/",
+        "/api/workouts/1/exercises/?embed=sets",
+        "/api/workouts/1/exercises/Squat/",
+        "/api/workouts/1/exercises/Squat/sets/",
+        "/api/workouts/1/exercises/Squat/sets/1/",
+        "/api/exercises/Squat/workouts/1/sets/",
+        "/api/exercises/Squat/workouts/1/sets/1/",
+        "/api/exercises/Paused Squat/max-data/",
+        "/api/exercises/Paused Squat/max-data/2/",
+        "/api/exercises/Squat/stats/",
+        "/api/exercises/Squat/stats/?from=2021-01-01&to=2021-12-31",
+        "/api/exercises/Squat/e1rm/?formula=rpe",
+        "/api/weekly-programming/",
+        "/api/weekly-programming/Main lift/1/",
+        "/api/exercises/Squat/weekly-programming/",
+        "/api/exercises/Squat/weekly-programming/Main lift/2/",
+    ]
+
+    # test that no filtered query reads a whole table without an index
+    def test_get_no_full_scans(self, client):
+        engine = db.get_engine(client.application)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for url in self.RESOURCE_URLS:
+                resp = client.get(url)
+                assert resp.status_code == 200, url
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert statements
+
+        scans = []
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                # unfiltered collections are read whole on purpose
+                if not re.search(r"\bWHERE\b", statement, re.IGNORECASE):
+                    continue
+                rows = conn.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+                # full scans of a table or a whole index, SEARCH is fine
+                for row in rows:
+                    if row[-1].startswith("SCAN "):
+                        scans.append((row[-1], statement))
+        assert not scans, scans
+
+
+class TestQueryCounts(object):
+
+    # upper bound of SQL statements of every GET route, which mustn't grow
+    # with the number of rows
+    ROUTE_QUERY_LIMITS = {
+        "/api/": 0,
+        "/api/workouts/": 2,
+        "/api/workouts/?embed=summary": 2,
+        "/api/workouts/1/": 2,
+        "/api/exercises/": 2,
+        "/api/exercises/Squat/": 2,
+        "/api/exercises/Squat/workouts/": 3,
+        "/api/exercises/Squat/workouts/1/": 3,
+        "/api/workouts/1/exercises/": 3,
+        "/api/workouts/1/exercises/?embed=sets": 3,
+        "/api/workouts/1/exercises/Squat/": 3,
+        "/api/workouts/1/exercises/Squat/sets/": 4,
+        "/api/workouts/1/exercises/Squat/sets/1/": 4,
+        "/api/exercises/Squat/workouts/1/sets/": 4,
+        "/api/exercises/Squat/workouts/1/sets/1/": 4,
+        "/api/exercises/Paused Squat/max-data/": 3,
+        "/api/exercises/Paused Squat/max-data/2/": 3,
+        "/api/exercises/Squat/stats/": 3,
+        "/api/exercises/Squat/e1rm/": 3,
+        "/api/weekly-programming/": 2,
+        "/api/weekly-programming/Main lift/1/": 2,
+        "/api/exercises/Squat/weekly-programming/": 3,
+        "/api/exercises/Squat/weekly-programming/Main lift/2/": 3,
+        "/api/export.ndjson": 7
+    }
+
+    # test that no route issues more statements than its bound or lazy
+    # loads in a loop
+    def test_get_query_counts(self, client, query_counter):
+        # more rows so that loops over them would show up
+        with client.application.app_context():
+            importer.import_records(enumerate([
+                {
+                    "type": "set",
+                    "workout": "2021-07-{:02} 18:00".format(day),
+                    "exercise": exercise,
+                    "weight": 100,
+                    "number_of_reps": 5
+                }
+                for day in range(1, 6)
+                for exercise in ("Squat", "Paused Squat", "Bench Press")
+                for order in range(3)
+            ], 1))
+
+        for url, limit in self.ROUTE_QUERY_LIMITS.items():
+            with query_counter:
+                resp = client.get(url)
+                resp.get_data()
+            assert resp.status_code == 200, url
+            query_counter.assert_at_most(limit)
+
+    # test that adding an exercise to a workout checks for it with one query
+    # instead of loading the exercises of the workout
+    def test_post_exercise_query_counts(self, client, query_counter):
+        url = "/api/workouts/2/exercises/"
+        with query_counter:
+            resp = client.post(url, json={"exercise_name": "Squat"})
+        assert resp.status_code == 201
+        query_counter.assert_at_most(8)
+        with query_counter:
+            resp = client.post(url, json={"exercise_name": "Squat"})
+        assert resp.status_code == 409
+        query_counter.assert_at_most(3)
+        resp = client.get(url)
+        names = [item["exercise_name"] for item in json.loads(resp.data)["items"]]
+        assert names.count("Squat") == 1
+
+    # test that lazy loads in a loop are reported with their stack
+    def test_n_plus_one_reported(self, client, query_counter):
+        with client.application.app_context():
+            with query_counter:
+                for workout in Workout.query.all():
+                    workout.sets
+        assert query_counter.count == 3
+        loads = query_counter.repeated_lazy_loads()
+        assert len(loads) == 1
+        (site, statement), statements = loads.popitem()
+        assert len(statements) == 2
+        assert site.startswith(os.path.join("tests", "api_test.py"))
+        assert "FROM \"set\"" in statement
+
+        with pytest.raises(AssertionError) as e:
+            query_counter.assert_at_most(10)
+        assert "N+1: 2 lazy loads at " + site in str(e.value)
+        assert "workout.sets" in str(e.value)
+
+
 class TestWorkoutCollection(object):
     
     RESOURCE_URL = "/api/workouts/"
@@ -344,6 +676,123 @@ class TestWorkoutCollection(object):
             _check_control_get_method("self", client, item)
             _check_control_get_method("profile", client, item)
 
+    # test that the workouts can be paged through with the next/prev controls
+    def test_get_paginated(self, client):
+        resp = client.get(self.RESOURCE_URL + "?limit=1")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 1
+        assert body["items"][0]["workout_id"] == 2
+        assert "prev" not in body["@controls"]
+        
+        # follow next to the older workout
+        resp = client.get(body["@controls"]["next"]["href"])
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 1
+        assert body["items"][0]["workout_id"] == 1
+        assert "next" not in body["@controls"]
+        
+        # and back with prev
+        resp = client.get(body["@controls"]["prev"]["href"])
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 1
+        assert body["items"][0]["workout_id"] == 2
+        assert "prev" not in body["@controls"]
+        assert "next" in body["@controls"]
+
+        # test with invalid cursor and limits
+        resp = client.get(self.RESOURCE_URL + "?before=abc")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?limit=abc")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?limit=0")
+        assert resp.status_code == 400
+
+    # test that the items can refer to the schema of the collection
+    def test_get_collection_schemas(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        full = resp.data
+        item = json.loads(full)["items"][0]
+        assert item["@controls"]["edit"]["schema"] == Workout.get_schema()
+        
+        resp = client.get(self.RESOURCE_URL + "?schemas=collection")
+        assert resp.status_code == 200
+        assert len(resp.data) < len(full)
+        body = json.loads(resp.data)
+        for item in body["items"]:
+            ctrl = item["@controls"]["edit"]
+            assert "schema" not in ctrl
+            assert ctrl["schemaUrl"] == "#/@controls/workoutlog:add-workout/schema"
+
+        # the self and paging controls keep the representation
+        resp = client.get(self.RESOURCE_URL + "?schemas=collection&limit=1")
+        controls = json.loads(resp.data)["@controls"]
+        assert controls["self"]["href"].endswith("?limit=1&schemas=collection")
+        assert controls["next"]["href"].endswith("&schemas=collection")
+        resp = client.get(controls["self"]["href"])
+        assert json.loads(resp.data)["items"][0]["@controls"]["edit"]["schemaUrl"]
+        
+        # resolve the JSON pointer and check that the schema works
+        item = body["items"][0]
+        target = body
+        for key in item["@controls"]["edit"]["schemaUrl"][2:].split("/"):
+            target = target[key]
+        item["@controls"]["edit"]["schema"] = target
+        _check_control_put_method("edit", client, item, "workout")
+
+    # test that summaries of the sets are embedded with ?embed=summary
+    def test_get_embed_summary(self, client):
+        resp = client.get(self.RESOURCE_URL + "?embed=summary&limit=1")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert body["@controls"]["next"]["href"].endswith("&embed=summary")
+        summary = body["items"][0]["summary"]
+        assert summary["set_count"] == 3
+        assert summary["tonnage"] == 3 * 80 * 8
+        assert summary["exercise_count"] == 1
+        assert summary["exercises"] == ["Paused Squat"]
+        
+        # the summary follows the changes to the sets
+        etag = resp.headers["ETag"]
+        resp = client.post("/api/workouts/2/exercises/", json={"exercise_name": "Squat"})
+        resp = client.post("/api/workouts/2/exercises/Squat/sets/", json=_get_set_json())
+        assert resp.status_code == 201
+        resp = client.get(
+            self.RESOURCE_URL + "?embed=summary&limit=1",
+            headers={"If-None-Match": etag}
+        )
+        assert resp.status_code == 200
+        summary = json.loads(resp.data)["items"][0]["summary"]
+        assert summary["set_count"] == 4
+        assert summary["tonnage"] == 3 * 80 * 8 + 115 * 6
+        assert summary["total_duration_seconds"] == 90 * 60
+        assert summary["exercise_count"] == 2
+        assert summary["exercises"] == ["Paused Squat", "Squat"]
+
+        # and to the names of the exercises
+        etag = resp.headers["ETag"]
+        resp = client.put("/api/exercises/Paused%20Squat/",
+            json={"exercise_name": "Box Squat", "exercise_type": "Variation lift"}
+        )
+        assert resp.status_code == 204
+        resp = client.get(
+            self.RESOURCE_URL + "?embed=summary&limit=1",
+            headers={"If-None-Match": etag}
+        )
+        assert resp.status_code == 200
+        summary = json.loads(resp.data)["items"][0]["summary"]
+        assert summary["exercises"] == ["Box Squat", "Squat"]
+        
+        # workouts without sets have an empty summary
+        resp = client.post(self.RESOURCE_URL, json=_get_workout_json())
+        resp = client.get(self.RESOURCE_URL + "?embed=summary")
+        summary = json.loads(resp.data)["items"][-1]["summary"]
+        assert summary["set_count"] == 0
+        assert summary["exercises"] == []
+        assert "summary" not in json.loads(client.get(self.RESOURCE_URL).data)["items"][0]
+
     # test POST method for WorkoutCollection
     def test_post(self, client):
         valid = _get_workout_json()
@@ -439,6 +888,11 @@ class TestWorkoutItem(object):
         valid["date_time"] = datetime.datetime(2025, 12, 12, 12, 12).strftime('%Y-%m-%d %H:%M')
         resp = client.put(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 204
+        assert resp.headers["Location"].endswith(self.RESOURCE_URL)
+        
+        # test keeping the workout's own date_time
+        resp = client.put(self.RESOURCE_URL, json=valid)
+        assert resp.status_code == 204
 
         # send string over 1000 characters as notes field for 400
         long_string = ""
@@ -548,6 +1002,31 @@ class TestExercisesWithinWorkout(object):
             _check_control_get_method("self", client, item)
             _check_control_get_method("profile", client, item)
 
+    # test GET method with the sets embedded to the exercises
+    def test_get_embed_sets(self, client):
+        resp = client.get(self.RESOURCE_URL + "?embed=sets")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 1
+        for item in body["items"]:
+            _check_control_post_method("workoutlog:add-set", client, item, "set")
+            assert [s["order_in_workout"] for s in item["sets"]] == [1, 2, 3]
+            for set_item in item["sets"]:
+                _check_control_get_method("self", client, set_item)
+                _check_control_get_method("profile", client, set_item)
+            _check_control_delete_method("workoutlog:delete", client, item["sets"][0])
+
+        # exercises without sets in the workout have no embedded sets
+        client.post(self.RESOURCE_URL, json=_get_exercise_json())
+        resp = client.get(self.RESOURCE_URL + "?embed=sets")
+        body = json.loads(resp.data)
+        assert [len(item["sets"]) for item in body["items"]] == [3, 0]
+
+        # sets are only embedded when asked for
+        resp = client.get(self.RESOURCE_URL)
+        body = json.loads(resp.data)
+        assert "sets" not in body["items"][0]
+
     # test POST method for ExercisesWithinWorkout
     def test_post(self, client):
         valid = _get_exercise_json()
@@ -749,6 +1228,88 @@ class TestSetsWithinWorkout(object):
         resp = client.post(self.WORKOUTS_URL, json=valid)
         assert resp.status_code == 400
 
+    # test that parallel POSTs of single sets and batches without order
+    # numbers get unique numbers
+    def test_post_concurrent(self, client):
+        valid = _get_set_json()
+        valid.pop("order_in_workout")
+        statuses = []
+
+        def post_sets(batch):
+            thread_client = client.application.test_client()
+            for i in range(5):
+                resp = thread_client.post(self.WORKOUTS_URL,
+                    json=[valid, valid] if batch else valid
+                )
+                statuses.append(resp.status_code)
+
+        threads = [
+            threading.Thread(target=post_sets, args=(i % 2 == 1,)) for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert statuses == [201] * 20
+
+        # 3 existing sets, 10 single sets and 10 batches of 2
+        resp = client.get(self.WORKOUTS_URL)
+        orders = [item["order_in_workout"] for item in json.loads(resp.data)["items"]]
+        assert sorted(orders) == list(range(1, 34))
+
+    # test POST method with a list of sets for SetsWithinWorkout
+    def test_post_batch(self, client):
+        resp = client.get(self.WORKOUTS_URL)
+        body = json.loads(resp.data)
+        ctrl = body["@controls"]["workoutlog:add-sets"]
+        assert ctrl["method"].lower() == "post"
+        assert ctrl["href"] == self.WORKOUTS_URL
+        
+        first = _get_set_json()
+        first.pop("order_in_workout")
+        second = _get_set_json()
+        second["order_in_workout"] = 10
+        third = _get_set_json()
+        third.pop("order_in_workout")
+        validate([first, second, third], ctrl["schema"])
+
+        # test with valid and see that the sets exist afterward, the sets
+        # without order numbers are numbered after the highest one
+        resp = client.post(self.WORKOUTS_URL, json=[first, second, third])
+        assert resp.status_code == 201
+        body = json.loads(resp.data)
+        assert [item["order_in_workout"] for item in body["items"]] == [11, 10, 12]
+        for item in body["items"]:
+            _check_control_get_method("self", client, item)
+        resp = client.get(self.WORKOUTS_URL)
+        assert len(json.loads(resp.data)["items"]) == 6
+
+        # test that every invalid set is reported and nothing is added
+        invalid = _get_set_json()
+        invalid["number_of_reps"] = 5.5
+        resp = client.post(self.WORKOUTS_URL, json=[first, invalid, invalid])
+        assert resp.status_code == 400
+        messages = json.loads(resp.data)["@error"]["@messages"]
+        assert len(messages) == 2
+        assert messages[0].startswith("Set 1:")
+        assert messages[1].startswith("Set 2:")
+        invalid["number_of_reps"] = 5
+        invalid["duration"] = "invalid duration"
+        resp = client.post(self.WORKOUTS_URL, json=[first, invalid])
+        assert resp.status_code == 400
+        resp = client.post(self.WORKOUTS_URL, json=[])
+        assert resp.status_code == 400
+
+        # test order numbers that are taken or used twice in the request
+        resp = client.post(self.WORKOUTS_URL, json=[first, second])
+        assert resp.status_code == 409
+        assert json.loads(resp.data)["@error"]["@messages"][0].startswith("Set 1:")
+        second["order_in_workout"] = 20
+        resp = client.post(self.WORKOUTS_URL, json=[second, first, second])
+        assert resp.status_code == 409
+        resp = client.get(self.WORKOUTS_URL)
+        assert len(json.loads(resp.data)["items"]) == 6
+
       
 
 class TestSetItem(object):
@@ -917,6 +1478,765 @@ class TestMaxDataItem(object):
         assert resp.status_code == 404     
     
 
+class TestExerciseStats(object):
+    
+    RESOURCE_URL = "/api/exercises/Squat/stats/"
+    INVALID_URL = "/api/exercises/sqwuat/stats/"
+
+    # test GET method for ExerciseStats
+    def test_get(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("profile", client, body)
+        _check_control_get_method("up", client, body)
+        assert len(body["items"]) == 1
+        week = body["items"][0]
+        assert week["week_start"] == "2021-06-07"
+        assert week["tonnage"] == 3 * 100 * 8
+        assert week["total_reps"] == 24
+        assert week["set_count"] == 3
+        assert week["average_rpe"] is None
+        assert week["best_estimated_1rm"] == round(100 * (1 + 8 / 30.0), 2)
+        
+        # the exercise links to its stats
+        resp = client.get("/api/exercises/Squat/")
+        body = json.loads(resp.data)
+        _check_control_get_method("workoutlog:exercise-stats", client, body)
+
+        # add a set in another week and test the date range
+        client.post("/api/workouts/2/exercises/", json={"exercise_name": "Squat"})
+        valid = _get_set_json()
+        resp = client.post("/api/workouts/2/exercises/Squat/sets/", json=valid)
+        assert resp.status_code == 201
+        resp = client.get(self.RESOURCE_URL)
+        body = json.loads(resp.data)
+        assert [week["week_start"] for week in body["items"]] == ["2021-06-07", "2022-07-04"]
+        assert body["items"][1]["average_rpe"] == valid["rate_of_perceived_exertion"]
+        resp = client.get(self.RESOURCE_URL + "?from=2022-07-08&to=2022-07-08")
+        body = json.loads(resp.data)
+        assert [week["week_start"] for week in body["items"]] == ["2022-07-04"]
+        assert body["@controls"]["self"]["href"].endswith("?from=2022-07-08&to=2022-07-08")
+        resp = client.get(self.RESOURCE_URL + "?to=2022-07-07")
+        assert len(json.loads(resp.data)["items"]) == 1
+
+        # test invalid dates and exercise
+        resp = client.get(self.RESOURCE_URL + "?from=2022-13-01")
+        assert resp.status_code == 400
+        resp = client.get(self.INVALID_URL)
+        assert resp.status_code == 404
+
+class TestExerciseE1RM(object):
+    
+    RESOURCE_URL = "/api/exercises/Squat/e1rm/"
+    INVALID_URL = "/api/exercises/sqwuat/e1rm/"
+
+    # test GET method for ExerciseE1RM
+    def test_get(self, client):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        _check_namespace(client, body)
+        _check_control_get_method("up", client, body)
+        assert body["formula"] == "epley"
+        assert body["items"] == [
+            {"date": "2021-06-07", "estimated_max": round(100 * (1 + 8 / 30), 2)}
+        ]
+        
+        # the exercise links to its e1RM series
+        resp = client.get("/api/exercises/Squat/")
+        body = json.loads(resp.data)
+        _check_control_get_method("workoutlog:exercise-e1rm", client, body)
+
+        # the best set of the day is estimated from 8 reps with 4 in reserve
+        resp = client.get(self.RESOURCE_URL + "?formula=rpe")
+        body = json.loads(resp.data)
+        assert body["items"][0]["estimated_max"] == round(100 / 0.68, 2)
+        assert body["@controls"]["self"]["href"].endswith("?formula=rpe")
+        resp = client.get(self.RESOURCE_URL + "?formula=brzycki&from=2022-01-01")
+        assert json.loads(resp.data)["items"] == []
+
+        # test invalid formula, dates and exercise
+        resp = client.get(self.RESOURCE_URL + "?formula=guess")
+        assert resp.status_code == 400
+        resp = client.get(self.RESOURCE_URL + "?to=yesterday")
+        assert resp.status_code == 400
+        resp = client.get(self.INVALID_URL)
+        assert resp.status_code == 404
+
+class TestExport(object):
+    
+    RESOURCE_URL = "/api/export.ndjson"
+
+    # test GET method for TrainingLogExport
+    def test_get(self, client):
+        resp = client.get("/api/")
+        body = json.loads(resp.data)
+        assert body["@controls"]["workoutlog:export"]["href"] == self.RESOURCE_URL
+        
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        assert resp.is_streamed
+        assert resp.mimetype == "application/x-ndjson"
+        records = [json.loads(line) for line in resp.data.splitlines()]
+        assert records[0]["type"] == "export"
+        types = [record["type"] for record in records[1:]]
+        assert types.count("exercise") == 2
+        assert types.count("workout") == 2
+        assert types.count("workout_exercise") == 2
+        assert types.count("set") == 6
+        assert types.count("max_data") == 3
+        assert types.count("weekly_programming") == 2
+        
+        # rows refer to each other by natural keys
+        workout = records[types.index("workout") + 1]
+        assert workout["date_time"] == "2021-06-07T09:10:00"
+        assert workout["duration"] == 80 * 60
+        set = records[types.index("set") + 1]
+        assert set["workout"] == workout["date_time"]
+        assert set["exercise"] == "Squat"
+        assert set["order_in_workout"] == 1
+
+class TestImport(object):
+    
+    RESOURCE_URL = "/api/import/"
+
+    # test POST method for TrainingLogImport
+    def test_post(self, client):
+        resp = client.get("/api/")
+        body = json.loads(resp.data)
+        assert body["@controls"]["workoutlog:import"]["href"] == self.RESOURCE_URL
+        assert body["@controls"]["workoutlog:import"]["method"] == "POST"
+
+        # the export imports back without new rows
+        export = client.get("/api/export.ndjson").data
+        resp = client.post(self.RESOURCE_URL, data=export,
+            content_type="application/x-ndjson"
+        )
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert body["records"]["set"] == 6
+        assert body["inserted"] == 0
+        assert body["skipped"]["set"] == 6
+        assert body["rows_per_second"] > 0
+
+        # sets of a new workout and exercise from CSV
+        resp = client.post(self.RESOURCE_URL, data=
+            "date_time,exercise_name,exercise_type,weight,number_of_reps\n"
+            "2021-05-01T10:00,Front Squat,Main lift,80,5\n"
+            "2021-05-01T10:00,Front Squat,Main lift,85,3\n"
+            "2021-05-01T10:00,Squat,,100,5\n",
+            content_type="text/csv"
+        )
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert body["rows"] == 3
+        # 3 sets, a workout, an exercise and 2 exercises within the workout
+        assert body["inserted"] == 7
+
+        resp = client.get("/api/exercises/Front Squat/")
+        assert json.loads(resp.data)["exercise_type"] == "Main lift"
+        resp = client.get("/api/workouts/")
+        workout = json.loads(resp.data)["items"][-1]
+        assert workout["date_time"] == "2021-05-01 10:00"
+        resp = client.get(workout["@controls"]["self"]["href"] + "exercises/Front Squat/sets/")
+        body = json.loads(resp.data)
+        assert [item["order_in_workout"] for item in body["items"]] == [1, 2]
+
+        # the same rows without order numbers again are skipped too
+        resp = client.post(self.RESOURCE_URL, data=
+            "date_time,exercise_name,weight,number_of_reps\n"
+            "2021-05-01T10:00,Front Squat,80,5\n"
+            "2021-05-01T10:00,Front Squat,85,3\n",
+            content_type="text/csv"
+        )
+        body = json.loads(resp.data)
+        assert body["inserted"] == 0
+        assert body["skipped"]["set"] == 2
+        resp = client.get(workout["@controls"]["self"]["href"] + "exercises/Front Squat/sets/")
+        body = json.loads(resp.data)
+        assert [item["order_in_workout"] for item in body["items"]] == [1, 2]
+
+        # the same rows again are skipped
+        resp = client.post(self.RESOURCE_URL, data=
+            "date_time,exercise_name,order_in_workout,weight,number_of_reps\n"
+            "2021-05-01T10:00,Front Squat,1,80,5\n",
+            content_type="text/csv"
+        )
+        assert json.loads(resp.data)["inserted"] == 0
+
+        # invalid imports
+        resp = client.post(self.RESOURCE_URL, data="date_time,weight\n", content_type="text/csv")
+        assert resp.status_code == 400
+        resp = client.post(self.RESOURCE_URL, data=
+            '{"type": "set", "workout": "2021-07-02T10:00", "exercise": "Squat"}\n'
+            '{"type": "set", "workout": "yesterday", "exercise": "Squat"}\n',
+            content_type="application/x-ndjson"
+        )
+        assert resp.status_code == 400
+        assert "Line 2" in json.loads(resp.data)["@error"]["@messages"][0]
+        resp = client.post(self.RESOURCE_URL, data='{"type": "lap"}\n',
+            content_type="application/x-ndjson"
+        )
+        assert resp.status_code == 400
+        resp = client.post(self.RESOURCE_URL, data="<xml/>", content_type="text/xml")
+        assert resp.status_code == 415
+
+class TestProfiling(object):
+
+    # test the Server-Timing header and the counters of /metrics
+    def test_metrics(self, client):
+        resp = client.get("/api/workouts/")
+        timing = resp.headers["Server-Timing"]
+        queries = int(re.search(r'db;dur=[0-9.]+;desc="(\d+) queries"', timing).group(1))
+        assert queries > 0
+        assert re.search(r"app;dur=[0-9.]+", timing)
+        assert re.search(r"serialize;dur=[0-9.]+", timing)
+        # the second request is served from the response cache
+        resp = client.get("/api/workouts/")
+        timing = resp.headers["Server-Timing"]
+        cached_queries = int(re.search(r'desc="(\d+) queries"', timing).group(1))
+        assert cached_queries < queries
+        client.get("/api/not-found/")
+
+        resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/plain"
+        metrics = {}
+        for line in resp.get_data(as_text=True).splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                metrics[name] = float(value)
+        labels = '{endpoint="api.workoutcollection",method="GET"}'
+        assert metrics["workoutlog_requests_total" + labels] == 2
+        assert metrics["workoutlog_sql_statements_total" + labels] == queries + cached_queries
+        assert metrics["workoutlog_sql_seconds_total" + labels] > 0
+        assert metrics["workoutlog_serialization_seconds_total" + labels] > 0
+        assert metrics["workoutlog_request_seconds_total" + labels] >= \
+            metrics["workoutlog_sql_seconds_total" + labels]
+        assert metrics['workoutlog_requests_total{endpoint="none",method="GET"}'] == 1
+        assert metrics["workoutlog_response_cache_hits_total"] == 1
+        assert metrics["workoutlog_response_cache_misses_total"] == 1
+
+    # test that ?profile=1 only profiles when it's enabled
+    def test_profile(self, client):
+        resp = client.get("/api/workouts/?profile=1")
+        assert resp.mimetype == "application/vnd.mason+json"
+
+        client.application.config["PROFILE_REQUESTS"] = True
+        resp = client.get("/api/workouts/?profile=1")
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/plain"
+        assert "function calls" in resp.get_data(as_text=True)
+        assert "Server-Timing" in resp.headers
+
+class TestResponseCache(object):
+
+    # test that repeated reads are served from the cache until a write
+    # commits to one of their tables
+    def test_hit_and_invalidation(self, client):
+        response_cache = client.application.extensions["response_cache"]
+        first = client.get("/api/exercises/")
+        second = client.get("/api/exercises/")
+        assert second.data == first.data
+        assert second.headers["ETag"] == first.headers["ETag"]
+        assert second.mimetype == "application/vnd.mason+json"
+        client.get("/api/workouts/")
+        client.get("/api/workouts/?limit=1")
+        assert (response_cache.hits, response_cache.misses, response_cache.entries) == (1, 3, 3)
+
+        # a flush that is rolled back drops nothing
+        with client.application.app_context():
+            db.session.add(Exercise(exercise_name="Deadlift"))
+            db.session.flush()
+            db.session.rollback()
+        assert response_cache.invalidations == 0
+
+        resp = client.post("/api/exercises/", json=_get_exercise_json())
+        assert resp.status_code == 201
+        assert response_cache.invalidations == 1
+        assert response_cache.entries == 2
+        assert "Deadlift" in client.get("/api/exercises/").get_data(as_text=True)
+        client.get("/api/workouts/")
+        assert response_cache.hits == 2
+
+    # test that every user has their own entries
+    def test_users(self, client):
+        response_cache = client.application.extensions["response_cache"]
+        with client.application.app_context():
+            db.session.add(User(username="other"))
+            db.session.commit()
+        headers = {"X-Workoutlog-User": "other"}
+        assert json.loads(client.get("/api/exercises/").data)["items"] != []
+        assert json.loads(client.get("/api/exercises/", headers=headers).data)["items"] == []
+        assert response_cache.entries == 2
+
+        # only the entry of the user who wrote is dropped
+        resp = client.post("/api/exercises/", json=_get_exercise_json(), headers=headers)
+        assert resp.status_code == 201
+        assert response_cache.invalidations == 1
+        assert response_cache.entries == 1
+        resp = client.get("/api/exercises/", headers=headers)
+        assert "Deadlift" in resp.get_data(as_text=True)
+
+    # test that writes of other processes make the entries miss
+    def test_stale_entries(self, client):
+        response_cache = client.application.extensions["response_cache"]
+        client.get("/api/exercises/")
+        with client.application.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(Exercise.__table__.insert().values(
+                    user_id=1, exercise_name="Deadlift"
+                ))
+                models.bump_change_counters(connection, ["exercise"])
+        assert response_cache.invalidations == 0
+        assert "Deadlift" in client.get("/api/exercises/").get_data(as_text=True)
+        assert (response_cache.hits, response_cache.misses) == (0, 2)
+
+    # test the memory bound, the LRU order and the time to live
+    def test_bounds(self):
+        now = [0.0]
+        response_cache = cache.ResponseCache(10, 5, clock=lambda: now[0])
+        response_cache.put((None, 1, "/a"), "a", ["exercise"], b"12345")
+        response_cache.put((None, 1, "/b"), "b", ["workout"], b"12345")
+        assert response_cache.get((None, 1, "/a"), "a") == b"12345"
+        response_cache.put((None, 1, "/c"), "c", ["workout"], b"123")
+        assert response_cache.evictions == 1
+        assert response_cache.get((None, 1, "/b"), "b") is None
+        assert response_cache.bytes == 8
+        response_cache.put((None, 1, "/d"), "d", ["workout"], b"12345678901")
+        assert response_cache.entries == 2
+        assert response_cache.get((None, 1, "/c"), "other etag") is None
+        assert response_cache.entries == 1
+
+        now[0] = 5.0
+        assert response_cache.get((None, 1, "/a"), "a") is None
+        assert (response_cache.entries, response_cache.bytes) == (0, 0)
+        assert response_cache._dependents == {}
+        assert "workoutlog_response_cache_evictions_total 1\n" in response_cache.render()
+
+class TestTenancy(object):
+
+    HEADERS = {"X-Workoutlog-User": "other"}
+
+    def _add_user(self, client):
+        with client.application.app_context():
+            db.session.add(User(username="other"))
+            db.session.commit()
+
+    # test that another user sees none of the data of the default user
+    def test_isolation(self, client):
+        self._add_user(client)
+        for url in ("/api/workouts/", "/api/exercises/", "/api/weekly-programming/"):
+            resp = client.get(url, headers=self.HEADERS)
+            assert resp.status_code == 200
+            assert json.loads(resp.data)["items"] == []
+            assert json.loads(client.get(url).data)["items"] != []
+
+        workout_url = json.loads(
+            client.get("/api/workouts/").data
+        )["items"][0]["@controls"]["self"]["href"]
+        assert client.get(workout_url, headers=self.HEADERS).status_code == 404
+        assert client.delete(workout_url, headers=self.HEADERS).status_code == 404
+        assert client.get("/api/exercises/Squat/", headers=self.HEADERS).status_code == 404
+        assert client.get(workout_url).status_code == 200
+
+    # test that names and dates are unique per user
+    def test_unique_per_user(self, client):
+        self._add_user(client)
+        workout = json.loads(client.get("/api/workouts/").data)["items"][0]
+        body = {"date_time": workout["date_time"]}
+        assert client.post("/api/workouts/", json=body).status_code == 409
+        resp = client.post("/api/workouts/", json=body, headers=self.HEADERS)
+        assert resp.status_code == 201
+        assert client.get(resp.headers["Location"], headers=self.HEADERS).status_code == 200
+        assert client.get(resp.headers["Location"]).status_code == 404
+
+        body = {"exercise_name": "Squat", "exercise_type": "Main lift"}
+        assert client.post("/api/exercises/", json=body).status_code == 409
+        resp = client.post("/api/exercises/", json=body, headers=self.HEADERS)
+        assert resp.status_code == 201
+        resp = client.get("/api/exercises/", headers=self.HEADERS)
+        assert [item["exercise_name"] for item in json.loads(resp.data)["items"]] == ["Squat"]
+
+    # test that the export of one user imports to another one
+    def test_import(self, client):
+        self._add_user(client)
+        export = client.get("/api/export.ndjson").data
+        resp = client.post("/api/import/", data=export,
+            content_type="application/x-ndjson", headers=self.HEADERS
+        )
+        assert resp.status_code == 200
+        assert json.loads(resp.data)["inserted"] > 0
+        for url in ("/api/workouts/", "/api/exercises/"):
+            mine = json.loads(client.get(url).data)["items"]
+            theirs = json.loads(client.get(url, headers=self.HEADERS).data)["items"]
+            assert len(mine) == len(theirs)
+        assert client.get("/api/export.ndjson", headers=self.HEADERS).data.count(b"\n") == \
+            export.count(b"\n")
+
+    # test that unknown users are not found
+    def test_unknown_user(self, client):
+        resp = client.get("/api/workouts/", headers={"X-Workoutlog-User": "nobody"})
+        assert resp.status_code == 404
+        assert "nobody" in json.loads(resp.data)["@error"]["@messages"][0]
+
+    # test that the user header can be required for the API
+    def test_require_user_header(self, client):
+        self._add_user(client)
+        client.application.config["REQUIRE_USER_HEADER"] = True
+        resp = client.get("/api/workouts/")
+        assert resp.status_code == 403
+        assert "X-Workoutlog-User" in json.loads(resp.data)["@error"]["@messages"][0]
+        resp = client.post("/api/exercises/", json=_get_exercise_json())
+        assert resp.status_code == 403
+        assert client.get("/api/workouts/", headers=self.HEADERS).status_code == 200
+        resp = client.get("/api/workouts/", headers={"X-Workoutlog-User": "default"})
+        assert json.loads(resp.data)["items"] != []
+        assert client.get("/workoutlog/").status_code == 200
+
+        # the warm-up of the server acts as the default user
+        responses = dict(server.warm_up(client.application))
+        assert responses["/api/workouts/"] == 200
+
+    # test that the ETag depends on the user
+    def test_etag(self, client):
+        self._add_user(client)
+        resp = client.get("/api/exercises/")
+        assert "X-Workoutlog-User" in resp.headers["Vary"]
+        resp = client.get("/api/exercises/", headers=dict(
+            self.HEADERS, **{"If-None-Match": resp.headers["ETag"]}
+        ))
+        assert resp.status_code == 200
+        assert json.loads(resp.data)["items"] == []
+
+class TestSharding(object):
+
+    # test that the users' data is written to their own shards
+    def test_routing(self, sharded_client):
+        app = sharded_client.application
+        router = app.extensions["shard_router"]
+        for username in ("alice", "bob", "carol"):
+            headers = {"X-Workoutlog-User": username}
+            resp = sharded_client.post("/api/workouts/",
+                json={"date_time": "2021-06-07 09:10"}, headers=headers
+            )
+            assert resp.status_code == 201
+            resp = sharded_client.post("/api/exercises/", json=_get_exercise_json(), headers=headers)
+            assert resp.status_code == 201
+            resp = sharded_client.get("/api/workouts/", headers=headers)
+            assert len(json.loads(resp.data)["items"]) == 1
+        assert len(router.open_shards) <= 2
+
+        with app.app_context():
+            placements = {
+                username: router.shard_of(username, shard)
+                for username, shard in db.session.query(User.username, User.shard)
+            }
+            # new users go to the shards with the fewest users
+            assert sorted(set(placements.values())) == [0, 1, 2]
+            for shard in range(3):
+                assert {username for username, in router.engine(shard).execute(
+                    "SELECT user.username FROM workout JOIN user ON user.id = workout.user_id"
+                )} == {
+                    username for username in ("alice", "bob", "carol")
+                    if placements[username] == shard
+                }
+            assert router.directory_engine.execute("SELECT * FROM workout").fetchall() == []
+
+        # the default user is on its own shard too
+        assert json.loads(sharded_client.get("/api/workouts/").data)["items"] == []
+        resp = sharded_client.get("/api/workouts/", headers={"X-Workoutlog-User": "nobody"})
+        assert resp.status_code == 404
+
+    # test that rebuild-summaries rebuilds the summaries on every shard
+    def test_rebuild_summaries(self, sharded_client):
+        app = sharded_client.application
+        router = app.extensions["shard_router"]
+        for username in ("alice", "bob", "carol"):
+            headers = {"X-Workoutlog-User": username}
+            resp = sharded_client.post("/api/workouts/",
+                json={"date_time": "2021-06-07 09:10"}, headers=headers
+            )
+            sets_url = resp.headers["Location"] + "exercises/Deadlift/sets/"
+            sharded_client.post("/api/exercises/", json=_get_exercise_json(), headers=headers)
+            resp = sharded_client.post(sets_url, json=_get_set_json(), headers=headers)
+            assert resp.status_code == 201
+
+        with app.app_context():
+            for shard in range(3):
+                router.engine(shard).execute("DELETE FROM workout_summary")
+        result = app.test_cli_runner().invoke(models.rebuild_summaries_command)
+        assert "Rebuilt the summaries of 3 workouts" in result.output
+        for username in ("alice", "bob", "carol"):
+            resp = sharded_client.get("/api/workouts/?embed=summary",
+                headers={"X-Workoutlog-User": username}
+            )
+            assert json.loads(resp.data)["items"][0]["summary"]["set_count"] == 1
+
+    # test that the ETag depends on the shard, as the change counters of
+    # fresh shards are the same
+    def test_etag(self, sharded_client):
+        app = sharded_client.application
+        view = workoutlog.utils.conditional_get("workout")(lambda: workoutlog.utils.create_mason_response({}))
+        etags = set()
+        with app.test_request_context("/api/workouts/"):
+            tenancy.bind_user("alice")
+            for shard in range(3):
+                sharding.bind_shard(shard)
+                etags.add(view().headers["ETag"])
+        assert len(etags) == 3
+
+def _http_get(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+async def _asgi_request(app, method, path, query_string=b"", headers=(), body=b""):
+    """
+    Sends a request to an ASGI app the way an ASGI server would. Returns the
+    response start message and the body messages.
+    """
+
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # lets other requests run between the messages
+        await asyncio.sleep(0)
+        sent.append(message)
+
+    await app({
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query_string,
+        "headers": list(headers),
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 50000)
+    }, receive, send)
+    return sent[0], sent[1:]
+
+class TestAsgi(object):
+
+    # test that the ASGI app responds like the WSGI app
+    def test_same_responses(self, client):
+        app = asgi.AsgiAdapter(client.application, 2)
+        for path, query_string in (
+                ("/api/", b""),
+                ("/api/workouts/", b"limit=1"),
+                ("/api/exercises/Squat/", b""),
+                ("/api/exercises/Squat/stats/", b"from=2021-01-01")
+                ):
+            expected = client.get(path, query_string=query_string.decode())
+            start, body = asyncio.run(_asgi_request(app, "GET", path, query_string))
+            assert start["status"] == expected.status_code
+            headers = dict(start["headers"])
+            assert headers[b"content-type"] == expected.headers["Content-Type"].encode()
+            assert headers[b"etag"] == expected.headers["ETag"].encode()
+            assert b"".join(message["body"] for message in body) == expected.data
+            assert body[-1]["more_body"] is False
+
+        # a body and headers
+        start, body = asyncio.run(_asgi_request(app, "POST", "/api/exercises/",
+            headers=[(b"content-type", b"application/json")],
+            body=json.dumps(_get_exercise_json()).encode()
+        ))
+        assert start["status"] == 201
+        assert dict(start["headers"])[b"location"] == b"http://localhost/api/exercises/Deadlift/"
+        assert client.get("/api/exercises/Deadlift/").status_code == 200
+        start, body = asyncio.run(_asgi_request(app, "GET", "/api/workouts/",
+            headers=[(b"x-workoutlog-user", b"nobody")]
+        ))
+        assert start["status"] == 404
+
+    # test that streamed responses are sent in chunks
+    def test_streaming(self, client, monkeypatch):
+        monkeypatch.setattr(asgi, "RESPONSE_CHUNK_SIZE", 100)
+        app = asgi.AsgiAdapter(client.application, 1, buffered_chunks=1)
+        start, body = asyncio.run(_asgi_request(app, "GET", "/api/export.ndjson"))
+        assert start["status"] == 200
+        assert len(body) > 2
+        assert all(message["more_body"] for message in body[:-1])
+        lines = b"".join(message["body"] for message in body).splitlines()
+        expected = client.get("/api/export.ndjson").data.splitlines()
+        assert len(lines) == len(expected)
+        assert lines[1:] == expected[1:]
+
+    # test that concurrent requests share the bounded thread pool
+    def test_concurrency(self, client):
+        app = asgi.AsgiAdapter(client.application, 2)
+
+        async def requests():
+            return await asyncio.gather(*[
+                _asgi_request(app, "GET", "/api/workouts/") for i in range(20)
+            ])
+
+        responses = asyncio.run(requests())
+        assert {start["status"] for start, body in responses} == {200}
+        assert len({b"".join(m["body"] for m in body) for start, body in responses}) == 1
+        assert app.executor._max_workers == 2
+
+    # test that an error after the response has started aborts it instead
+    # of ending it like a complete response
+    def test_error_while_streaming(self):
+        def wsgi_app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            for i in range(3):
+                yield b"x" * 70 * 1024
+            raise RuntimeError("export failed")
+
+        app = asgi.AsgiAdapter(wsgi_app, 1)
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(app({
+                "type": "http",
+                "method": "GET",
+                "path": "/api/export.ndjson",
+                "headers": []
+            }, receive, send))
+        assert sent[0]["status"] == 200
+        assert len(sent) > 1
+        assert all(message["more_body"] for message in sent[1:])
+
+    # test the lifespan protocol
+    def test_lifespan(self, client):
+        app = asgi.AsgiAdapter(client.application, 1)
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        asyncio.run(app({"type": "lifespan"}, receive, send))
+        assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+class TestServer(object):
+
+    # test that the warm-up requests every GET route once and isn't counted
+    def test_warm_up(self, client):
+        app = client.application
+        responses = server.warm_up(app)
+        urls = [url for url, status in responses]
+        rules = [
+            rule for rule in app.url_map.iter_rules()
+            if "GET" in rule.methods and rule.endpoint != "static"
+        ]
+        assert len(urls) == len(rules) == len(set(urls))
+        assert "/api/workouts/1/exercises/Squat/sets/1/" in urls
+        assert "/api/weekly-programming/Main%20lift/1/" in urls
+        assert all(status < 400 for url, status in responses if url.startswith("/api/"))
+        assert "api.workoutcollection" not in client.get("/metrics").get_data(as_text=True)
+
+    # test that the pooled server responds like the app to concurrent clients
+    def test_pooled_server(self, client):
+        app = client.application
+        httpd = server.PooledWSGIServer("127.0.0.1", 0, app, 2)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{}/api/workouts/".format(httpd.server_address[1])
+            with ThreadPoolExecutor(8) as executor:
+                bodies = list(executor.map(_http_get, [url] * 16))
+        finally:
+            httpd.shutdown()
+            thread.join()
+        assert set(bodies) == {client.get("/api/workouts/").data}
+        assert httpd.executor._max_workers == 2
+
+    # test that preforked workers serve the app until SIGTERM
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+    def test_preforked_workers(self, client):
+        config = {"SQLALCHEMY_DATABASE_URI": client.application.config["SQLALCHEMY_DATABASE_URI"]}
+        expected = client.get("/api/exercises/").data
+        for preload in (False, True):
+            listener = socket.create_server(("127.0.0.1", 0))
+            master = multiprocessing.get_context("fork").Process(target=server.serve,
+                args=(lambda: create_app(config),),
+                kwargs={"workers": 2, "threads": 2, "preload": preload, "listener": listener}
+            )
+            master.start()
+            url = "http://127.0.0.1:{}/api/exercises/".format(listener.getsockname()[1])
+            listener.close()
+            try:
+                with ThreadPoolExecutor(4) as executor:
+                    bodies = list(executor.map(_http_get, [url] * 8))
+            finally:
+                master.terminate()
+                master.join(30)
+            assert set(bodies) == {expected}
+            assert master.exitcode == 0
+
+    # test that the server stops when a worker can't start
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+    def test_worker_boot_error(self):
+        def create_broken_app():
+            raise RuntimeError("broken config")
+
+        listener = socket.create_server(("127.0.0.1", 0))
+        master = multiprocessing.get_context("fork").Process(target=server.serve,
+            args=(create_broken_app,), kwargs={"workers": 2, "listener": listener}
+        )
+        master.start()
+        listener.close()
+        master.join(30)
+        assert master.exitcode == 1
+
+    # test that a stopped worker finishes the requests it is running
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+    def test_graceful_stop(self, client):
+        config = {"SQLALCHEMY_DATABASE_URI": client.application.config["SQLALCHEMY_DATABASE_URI"]}
+        context = multiprocessing.get_context("fork")
+        started = context.Event()
+
+        def create_slow_app():
+            app = create_app(config)
+
+            def slow():
+                started.set()
+                time.sleep(1)
+                return "done"
+
+            app.add_url_rule("/slow", "slow", slow)
+            return app
+
+        listener = socket.create_server(("127.0.0.1", 0))
+        master = context.Process(target=server.serve, args=(create_slow_app,),
+            kwargs={"workers": 2, "threads": 2, "warm": False, "listener": listener}
+        )
+        master.start()
+        url = "http://127.0.0.1:{}/slow".format(listener.getsockname()[1])
+        listener.close()
+        try:
+            with ThreadPoolExecutor(1) as executor:
+                future = executor.submit(_http_get, url)
+                assert started.wait(30)
+                master.terminate()
+                assert future.result() == b"done"
+        finally:
+            master.terminate()
+            master.join(30)
+        assert master.exitcode == 0
+
 class TestWeeklyProgrammingCollection(object):
     
     RESOURCE_URL = "/api/weekly-programming/"
@@ -967,6 +2287,19 @@ class TestWeeklyProgrammingCollection(object):
         assert resp.status_code == 400
 
 
+    # test that the items can refer to the schema of the collection
+    def test_get_collection_schemas(self, client):
+        resp = client.get(self.RESOURCE_URL + "?schemas=collection")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert body["@controls"]["workoutlog:add-weekly-programming"]["schema"] == \
+            WeeklyProgramming.get_schema()
+        for item in body["items"]:
+            ctrl = item["@controls"]["edit"]
+            assert "schema" not in ctrl
+            assert ctrl["schemaUrl"] == "#/@controls/workoutlog:add-weekly-programming/schema"
+
+
 class TestWeeklyProgrammingForExercise(object):
     
     RESOURCE_URL = "/api/exercises/Squat/weekly-programming/"
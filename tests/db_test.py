@@ -1,15 +1,18 @@
 import os
+import json
 import pytest
 import tempfile
 import datetime
 import click
-from sqlalchemy import event
+from sqlalchemy import event, inspect
 from sqlalchemy.engine import Engine
 from sqlite3 import Connection as SQLite3Connection
 from sqlalchemy.exc import IntegrityError
 
 from workoutlog import create_app, db
 from workoutlog.models import *
+from workoutlog.migrations import upgrade_db_command
+from workoutlog.sharding import plan_rebalance, rebalance_shards_command
 
 
 # Enforce foreign key constraints
@@ -475,6 +478,111 @@ def test_weekly_programming_columns(app):
         assert WeeklyProgramming.query.first() == weekly_programming
 
 
+def test_next_free_order(app):
+    """
+    Tests that next_free_order finds the first unused order number
+    """
+    
+    with app.app_context():
+        workout = _get_workout()
+        exercise = _get_exercise()
+        db.session.add(workout)
+        db.session.add(exercise)
+        db.session.commit()
+        assert next_free_order(
+            Set.order_in_workout, exercise_id=exercise.id, workout_id=workout.workout_id
+        ) == 1
+        
+        for order_in_workout in (1, 2, 4):
+            set = _get_set(exercise, workout)
+            set.order_in_workout = order_in_workout
+            db.session.add(set)
+        db.session.add(_get_max_data_2(exercise))
+        db.session.commit()
+        assert next_free_order(
+            Set.order_in_workout, exercise_id=exercise.id, workout_id=workout.workout_id
+        ) == 3
+        assert next_free_order(MaxData.order_for_exercise, exercise_id=exercise.id) == 1
+        
+        db.session.add(_get_max_data_1(exercise))
+        db.session.commit()
+        assert next_free_order(MaxData.order_for_exercise, exercise_id=exercise.id) == 3
+
+def test_workout_summary(app):
+    """
+    Tests that WorkoutSummary follows the inserts, updates and deletes of
+    sets and that rebuilding gives the same summary
+    """
+    
+    with app.app_context():
+        workout = _get_workout()
+        exercise = _get_exercise()
+        set_1 = _get_set(exercise, workout)
+        set_2 = _get_set(exercise, workout)
+        set_2.order_in_workout = 2
+        db.session.add(workout)
+        db.session.add(exercise)
+        db.session.add(set_1)
+        db.session.add(set_2)
+        db.session.commit()
+        
+        summary = WorkoutSummary.query.first()
+        assert summary.set_count == 2
+        assert summary.tonnage == 2 * 100 * 8
+        assert summary.total_duration_seconds == 60
+        assert summary.exercise_count == 1
+        assert json.loads(summary.exercise_names) == [exercise.exercise_name]
+        
+        set_2.weight = 120
+        set_2.distance = 5
+        db.session.commit()
+        db.session.refresh(summary)
+        assert summary.tonnage == 100 * 8 + 120 * 8
+        assert summary.total_distance == 5
+        
+        db.session.delete(set_1)
+        db.session.commit()
+        db.session.refresh(summary)
+        assert summary.set_count == 1
+        assert summary.tonnage == 120 * 8
+        assert summary.total_duration_seconds == 30
+        
+        with db.engine.begin() as connection:
+            rebuild_workout_summaries(connection)
+        db.session.refresh(summary)
+        assert summary.set_count == 1
+        assert summary.tonnage == 120 * 8
+        assert summary.total_duration_seconds == 30
+        assert summary.exercise_count == 1
+        assert json.loads(summary.exercise_names) == [exercise.exercise_name]
+        
+        db.session.delete(workout)
+        db.session.commit()
+        assert WorkoutSummary.query.count() == 0
+
+def test_schemas_frozen():
+    """
+    Tests that the shared schemas are built once and can't be modified
+    """
+    assert Workout.get_schema() is Workout.get_schema()
+    with pytest.raises(TypeError):
+        Set.get_schema()["type"] = "array"
+    with pytest.raises(TypeError):
+        Exercise.get_schema()["properties"].pop("exercise_name")
+    assert MaxData.get_schema() == MaxData._build_schema()
+
+
+def test_sqlite_pragmas(app):
+    """
+    Tests that the configured SQLite pragmas are set on new connections
+    """
+    with app.app_context():
+        assert db.engine.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert db.engine.execute("PRAGMA synchronous").scalar() == 1
+        assert db.engine.execute("PRAGMA temp_store").scalar() == 2
+        assert db.engine.execute("PRAGMA busy_timeout").scalar() == 5000
+        assert db.engine.execute("PRAGMA foreign_keys").scalar() == 1
+
 def test_cli_init(app):
     """
     Tests that init_db_command exists
@@ -497,4 +605,353 @@ def test_cli_testgen(app):
     """
     runner = app.test_cli_runner()
     result = runner.invoke(insert_initial_data)
-    assert result
\ No newline at end of file
+    assert result
+
+
+def test_cli_rebuild_summaries(app):
+    """
+    Tests that rebuild_summaries_command recomputes the summaries
+    """
+    runner = app.test_cli_runner()
+    runner.invoke(insert_initial_data)
+    with app.app_context():
+        expected = [tuple(row) for row in db.session.query(WorkoutSummary.__table__)]
+        version = ChangeCounter.query.get("workout_summary").version
+        db.engine.execute("DELETE FROM workout_summary")
+    result = runner.invoke(rebuild_summaries_command)
+    assert result.exit_code == 0
+    with app.app_context():
+        assert [tuple(row) for row in db.session.query(WorkoutSummary.__table__)] == expected
+        # the ETags of the summaries change
+        assert ChangeCounter.query.get("workout_summary").version == version + 1
+
+def test_cli_export(app):
+    """
+    Tests that export_command writes one JSON record per line
+    """
+    runner = app.test_cli_runner()
+    runner.invoke(insert_initial_data)
+    result = runner.invoke(export_command)
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert records[0]["type"] == "export"
+    with app.app_context():
+        assert len([r for r in records if r["type"] == "set"]) == Set.query.count()
+
+def test_cli_import(app, tmp_path):
+    """
+    Tests that import_command imports an export into an empty database and
+    CSV sets into an existing one
+    """
+    runner = app.test_cli_runner()
+    runner.invoke(insert_initial_data)
+    export = tmp_path / "workoutlog.ndjson"
+    runner.invoke(export_command, ["--output", str(export)])
+    runner.invoke(delete_db_command)
+    runner.invoke(init_db_command)
+    result = runner.invoke(import_command, [str(export), "--chunk-size", "10"])
+    assert result.exit_code == 0
+    assert "rows/s" in result.output
+    result = runner.invoke(export_command)
+    assert result.output.splitlines()[1:] == export.read_text().splitlines()[1:]
+
+    sets = tmp_path / "sets.csv"
+    sets.write_text(
+        "date_time,exercise_name,weight,number_of_reps,duration\n"
+        "2021-08-20 18:00,Squat,100,5,\n"
+        "2021-08-20 18:00,Plank,,,0:02:30\n"
+    )
+    result = runner.invoke(import_command, [str(sets)])
+    assert result.exit_code == 0
+    with app.app_context():
+        workout = Workout.query.filter_by(
+            date_time=datetime.datetime(2021, 8, 20, 18)
+        ).first()
+        assert len(workout.exercises) == 2
+        assert workout.summary.set_count == 2
+        assert workout.summary.total_duration_seconds == 150
+
+    sets.write_text("date_time,exercise_name,weight\n2021-08-20 18:00,Squat,heavy\n")
+    result = runner.invoke(import_command, [str(sets)])
+    assert result.exit_code != 0
+    assert "Line 2" in result.output
+
+def test_cli_gen_load(app):
+    """
+    Tests that gen_load_command generates the same training log with the
+    same seed
+    """
+    runner = app.test_cli_runner()
+    result = runner.invoke(gen_load_command, ["--sets", "500", "--seed", "3"])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert Set.query.count() == 500
+        assert Exercise.query.count() > 10
+        assert WeeklyProgramming.query.count() > 0
+        assert WorkoutSummary.query.count() == Workout.query.count()
+        first = [tuple(row) for row in db.session.query(Set.__table__)]
+
+    runner.invoke(delete_db_command)
+    runner.invoke(init_db_command)
+    result = runner.invoke(gen_load_command, ["--sets", "500", "--seed", "3"])
+    with app.app_context():
+        assert [tuple(row) for row in db.session.query(Set.__table__)] == first
+
+    runner.invoke(delete_db_command)
+    runner.invoke(init_db_command)
+    result = runner.invoke(gen_load_command, ["--years", "0.5", "--sets-per-workout", "10"])
+    with app.app_context():
+        workouts = Workout.query.count()
+        assert 52 / 2 * 2 < workouts < 52 / 2 * 6
+        assert Set.query.count() / workouts == pytest.approx(10, rel=0.2)
+
+def test_cli_upgrade(app):
+    """
+    Tests that upgrade_db_command adds missing indexes and tables once
+    """
+    with app.app_context():
+        db.engine.execute("DROP INDEX ix_set_workout_exercise_order")
+        db.engine.execute("DROP TABLE change_counter")
+        db.engine.execute("ALTER TABLE workout_summary DROP COLUMN exercise_names")
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(upgrade_db_command)
+    assert "Applied migration 0002_access_path_indexes" in result.output
+    with app.app_context():
+        indexes = inspect(db.engine).get_indexes("set")
+        assert "ix_set_workout_exercise_order" in [index["name"] for index in indexes]
+        assert "change_counter" in inspect(db.engine).get_table_names()
+        columns = inspect(db.engine).get_columns("workout_summary")
+        assert "exercise_names" in [column["name"] for column in columns]
+
+    result = runner.invoke(upgrade_db_command)
+    assert "up to date" in result.output
+
+def test_cli_create_user(app):
+    """
+    Tests that create_user_command creates users once and that the data
+    commands act as the given user
+    """
+    runner = app.test_cli_runner()
+    result = runner.invoke(create_user_command, ["other"])
+    assert result.exit_code == 0
+    assert "id 2" in result.output
+    result = runner.invoke(create_user_command, ["other"])
+    assert result.exit_code != 0
+    assert "already exists" in result.output
+
+    result = runner.invoke(gen_load_command, ["--sets", "50", "--user", "other"])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert Workout.query.count() == 0
+        assert db.session.query(Workout.__table__).filter_by(user_id=2).count() > 0
+    result = runner.invoke(export_command, ["--user", "other"])
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert len([r for r in records if r["type"] == "set"]) == 50
+    result = runner.invoke(export_command, ["--user", "nobody"])
+    assert result.exit_code != 0
+    assert "nobody" in result.output
+
+
+def test_cli_gen_load_users(app):
+    """
+    Tests that gen_load_command spreads the log across the given number of
+    users, creating them once
+    """
+    runner = app.test_cli_runner()
+    result = runner.invoke(gen_load_command, ["--sets", "100", "--users", "3"])
+    assert result.exit_code == 0, result.output
+    assert "100 sets for 3 users" in result.output
+    with app.app_context():
+        users = dict(db.session.query(User.username, User.id))
+        assert sorted(users) == [DEFAULT_USERNAME, "load-1", "load-2", "load-3"]
+        sets = dict(db.engine.execute(
+            'SELECT workout.user_id, COUNT(*) FROM "set" JOIN workout '
+            'ON workout.workout_id = "set".workout_id GROUP BY workout.user_id'
+        ).fetchall())
+        assert [sets[users["load-{}".format(i)]] for i in (1, 2, 3)] == [34, 33, 33]
+        assert Workout.query.count() == 0
+
+        # every user has a log of their own seed
+        dates = [
+            db.engine.execute(
+                "SELECT date_time FROM workout WHERE user_id = ? ORDER BY date_time",
+                users["load-{}".format(i)]
+            ).fetchall()
+            for i in (1, 2)
+        ]
+        assert dates[0] != dates[1]
+
+    # generating again reuses the users and adds nothing
+    result = runner.invoke(gen_load_command, ["--sets", "100", "--users", "3"])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert User.query.count() == 4
+        assert db.engine.execute('SELECT COUNT(*) FROM "set"').scalar() == 100
+
+    result = runner.invoke(gen_load_command, ["--users", "2", "--user", "load-1"])
+    assert result.exit_code != 0
+
+# Tables of the models before there were users
+OLD_SCHEMA = """
+CREATE TABLE workout (
+    workout_id INTEGER NOT NULL,
+    date_time DATETIME NOT NULL,
+    duration DATETIME,
+    body_weight FLOAT,
+    average_heart_rate INTEGER,
+    max_heart_rate INTEGER,
+    notes VARCHAR(1000),
+    PRIMARY KEY (workout_id),
+    UNIQUE (date_time)
+);
+CREATE TABLE exercise (
+    id INTEGER NOT NULL,
+    exercise_name VARCHAR(100) NOT NULL,
+    exercise_type VARCHAR(100),
+    PRIMARY KEY (id),
+    UNIQUE (exercise_name)
+);
+CREATE TABLE weekly_programming (
+    id INTEGER NOT NULL,
+    week_number INTEGER NOT NULL,
+    exercise_type VARCHAR(100) NOT NULL,
+    intensity FLOAT,
+    number_of_sets INTEGER,
+    number_of_reps INTEGER,
+    reps_in_reserve INTEGER,
+    rate_of_perceived_exertion FLOAT,
+    duration DATETIME,
+    distance FLOAT,
+    average_heart_rate INTEGER,
+    notes VARCHAR(1000),
+    PRIMARY KEY (id),
+    CONSTRAINT _week_exercise_uc UNIQUE (week_number, exercise_type)
+);
+CREATE INDEX ix_weekly_programming_type_week ON weekly_programming (exercise_type, week_number);
+CREATE TABLE max_data (
+    id INTEGER NOT NULL,
+    exercise_id INTEGER,
+    order_for_exercise INTEGER NOT NULL,
+    date DATE NOT NULL,
+    training_max FLOAT,
+    estimated_max FLOAT,
+    tested_max FLOAT,
+    PRIMARY KEY (id),
+    CONSTRAINT _exercise_order_uc UNIQUE (exercise_id, order_for_exercise),
+    FOREIGN KEY(exercise_id) REFERENCES exercise (id) ON DELETE CASCADE
+);
+"""
+
+def test_cli_upgrade_users(app):
+    """
+    Tests that upgrade_db_command moves the data of a database from before
+    there were users to the default user
+    """
+    runner = app.test_cli_runner()
+    runner.invoke(insert_initial_data)
+    tables = ("workout", "exercise", "weekly_programming", "max_data")
+    with app.app_context():
+        rows = {
+            table: [tuple(row) for row in db.engine.execute(
+                'SELECT * FROM "{}" ORDER BY 1'.format(table)
+            )]
+            for table in tables + ("set", "exercise_workout_association")
+        }
+        connection = db.engine.raw_connection()
+        # The foreign keys of the other tables keep referring to the old names
+        connection.execute("PRAGMA foreign_keys=OFF")
+        connection.execute("PRAGMA legacy_alter_table=ON")
+        for table in tables + ("user",):
+            connection.execute('ALTER TABLE "{0}" RENAME TO _old_{0}'.format(table))
+        connection.executescript(OLD_SCHEMA)
+        for table in tables:
+            columns = ", ".join(
+                column.name for column in db.metadata.tables[table].columns
+                if column.name != "user_id"
+            )
+            connection.execute("INSERT INTO {0} ({1}) SELECT {1} FROM _old_{0}".format(
+                table, columns
+            ))
+        for table in tables + ("user",):
+            connection.execute("DROP TABLE _old_{}".format(table))
+        connection.commit()
+        connection.close()
+
+    result = runner.invoke(upgrade_db_command)
+    assert result.exit_code == 0, result.output
+    assert "Applied migration 0004_users" in result.output
+    with app.app_context():
+        assert "_old_workout" not in inspect(db.engine).get_table_names()
+        for table, table_rows in rows.items():
+            assert [tuple(row) for row in db.engine.execute(
+                'SELECT * FROM "{}" ORDER BY 1'.format(table)
+            )] == table_rows
+        assert User.query.get(DEFAULT_USER_ID).username == DEFAULT_USERNAME
+        indexes = inspect(db.engine).get_indexes("weekly_programming")
+        assert [index["name"] for index in indexes] == ["ix_weekly_programming_user_type_week"]
+        assert Set.query.first().workout.exercises
+
+        # the rebuilt tables cascade deletes again
+        db.session.delete(Exercise.query.filter_by(exercise_name="Squat").first())
+        db.session.commit()
+        assert not db.engine.execute(
+            "SELECT * FROM max_data WHERE exercise_id NOT IN (SELECT id FROM exercise)"
+        ).fetchall()
+
+def test_plan_rebalance():
+    """
+    Tests that plan_rebalance only makes moves that even out the shards
+    """
+    assert plan_rebalance({1: (0, 10), 2: (1, 10)}, 2) == []
+    assert plan_rebalance({1: (0, 10), 2: (0, 10)}, 2) == [(2, 0, 1)]
+    # a user heavier than the difference stays
+    assert plan_rebalance({1: (0, 100), 2: (1, 10)}, 2) == []
+    moves = plan_rebalance({1: (0, 50), 2: (0, 30), 3: (0, 20), 4: (1, 0)}, 3)
+    assert moves == [(1, 0, 1), (2, 0, 2)]
+
+def test_cli_rebalance_shards(tmp_path):
+    """
+    Tests that rebalance_shards_command moves the training log of a user to
+    the least loaded shard
+    """
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "main.db"),
+        "SHARD_DATABASE_URIS": [
+            "sqlite:///" + str(tmp_path / "shard-{}.db".format(shard)) for shard in range(2)
+        ],
+        "TESTING": True
+    })
+    runner = app.test_cli_runner()
+    runner.invoke(init_db_command)
+    runner.invoke(create_user_command, ["alice"])
+    runner.invoke(create_user_command, ["bob"])
+    router = app.extensions["shard_router"]
+    with app.app_context():
+        shards = dict(db.session.query(User.username, User.shard))
+        # both users on the shard of alice
+        db.session.query(User).filter_by(username="bob").update({"shard": shards["alice"]})
+        db.session.commit()
+        router.add_user(shards["alice"], 3, "bob")
+    runner.invoke(gen_load_command, ["--sets", "300", "--user", "alice"])
+    result = runner.invoke(gen_load_command, ["--sets", "100", "--user", "bob"])
+    assert result.exit_code == 0
+    export = runner.invoke(export_command, ["--user", "alice"]).output.splitlines()[1:]
+
+    result = runner.invoke(rebalance_shards_command, ["--dry-run"])
+    assert "Would move user 'alice' (300 sets)" in result.output
+    result = runner.invoke(rebalance_shards_command)
+    assert result.exit_code == 0, result.output
+    assert "Moving user 'alice'" in result.output
+
+    with app.app_context():
+        target = db.session.query(User.shard).filter_by(username="alice").scalar()
+        assert target != shards["alice"]
+        source_engine = router.engine(shards["alice"])
+        assert source_engine.execute("SELECT DISTINCT user_id FROM workout").fetchall() == [(3, )]
+        assert router.engine(target).execute(
+            'SELECT count(*) FROM "set"'
+        ).scalar() == 300
+    assert runner.invoke(export_command, ["--user", "alice"]).output.splitlines()[1:] == export
+    result = runner.invoke(rebalance_shards_command)
+    assert "balanced" in result.output
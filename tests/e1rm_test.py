@@ -0,0 +1,90 @@
+import math
+import random
+import pytest
+
+from workoutlog import e1rm
+
+
+WEIGHTS = [100, 100, 80, None, 50, 60]
+REPS = [1, 5, 8, 5, 40, 3]
+REPS_IN_RESERVE = e1rm.reps_in_reserve_of(
+    [None, 2, None, 1, 0, None],
+    [None, None, 9.5, None, None, 7.5]
+)
+EXPECTED = {
+    "epley": [100, 116.67, 101.33, None, 116.67, 66],
+    "brzycki": [100, 112.5, 99.31, None, None, 63.53],
+    "rpe": [None, 123.3, 103.36, None, None, 70.59]
+}
+
+
+@pytest.fixture(params=["numpy", "array"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(e1rm, "numpy", None)
+    return request.param
+
+
+def _rounded(estimates):
+    return [None if math.isnan(value) else round(value, 2) for value in estimates]
+
+
+def test_reps_in_reserve_of():
+    """
+    Tests that RPE is used for the sets that don't have reps in reserve
+    """
+    assert REPS_IN_RESERVE == [None, 2, 0.5, 1, 0, 2.5]
+
+
+def test_formulas(backend):
+    """
+    Tests all formulas with NumPy and with the array module
+    """
+    for name, formula in e1rm.FORMULAS.items():
+        estimates = formula(WEIGHTS, REPS, REPS_IN_RESERVE)
+        assert len(estimates) == len(WEIGHTS)
+        assert _rounded(estimates) == EXPECTED[name]
+
+
+def test_daily_best(backend):
+    """
+    Tests that the best estimate of each day is picked and days without
+    estimates are left out
+    """
+    days = ["2021-01-01", "2021-01-01", "2021-01-02", "2021-01-03", "2021-01-03"]
+    estimates = e1rm.brzycki([100, 100, None, 50, 60], [5, 3, 5, 40, 3])
+    series = e1rm.daily_best(days, estimates)
+    assert [day for day, _ in series] == ["2021-01-01", "2021-01-03"]
+    assert [round(value, 2) for _, value in series] == [112.5, 63.53]
+    assert e1rm.daily_best([], e1rm.epley([], [])) == []
+
+
+def test_backends_match(monkeypatch):
+    """
+    Tests that NumPy and the array module give the same estimates and daily
+    bests for the same sets
+    """
+    pytest.importorskip("numpy")
+    rand = random.Random(0)
+    size = 1000
+    weights = [rand.choice([None, 0, 20.5, 60, 100, 142.5]) for i in range(size)]
+    reps = [rand.choice([None, 1, 2, 5, 8, 12, 13, 36, 37, 40]) for i in range(size)]
+    reps_in_reserve = e1rm.reps_in_reserve_of(
+        [rand.choice([None, 0, 1, 2, 4]) for i in range(size)],
+        [rand.choice([None, 6.5, 8, 8.5, 10]) for i in range(size)]
+    )
+    days = sorted("2021-01-{:02d}".format(rand.randint(1, 28)) for i in range(size))
+
+    def results():
+        for name, formula in e1rm.FORMULAS.items():
+            estimates = formula(weights, reps, reps_in_reserve)
+            yield name, _rounded(estimates)
+            yield name + " daily best", [
+                (day, round(value, 2)) for day, value in e1rm.daily_best(days, estimates)
+            ]
+
+    with_numpy = list(results())
+    monkeypatch.setattr(e1rm, "numpy", None)
+    assert list(results()) == with_numpy
@@ -0,0 +1,130 @@
+"""
+Counts the SQL statements of requests in tests and finds N+1 patterns, i.e.
+the same lazy load issued again and again from one line of a handler.
+
+    with QueryCounter(db.get_engine(app)) as counter:
+        client.get("/api/workouts/1/exercises/")
+    counter.assert_at_most(3)
+
+Failed assertions list every statement with the line of the project that
+issued it, and the stack traces of the repeated lazy loads.
+"""
+
+import os
+import traceback
+from sqlalchemy import event
+
+import workoutlog
+
+# Frames of the project, i.e. workoutlog and the tests
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(workoutlog.__file__)))
+
+# Functions of SQLAlchemy that load relationships lazily. Dynamic
+# relationships query from dynamic.py.
+LAZY_LOAD_FUNCTIONS = {
+    ("strategies.py", "_emit_lazyload"),
+    ("dynamic.py", "__iter__")
+}
+
+
+class Statement(object):
+    """
+    A statement that was executed, with the stack that executed it.
+    """
+
+    def __init__(self, statement, stack):
+        self.statement = statement
+        self.stack = stack
+        self.lazy = any(
+            (os.path.basename(frame.filename), frame.name) in LAZY_LOAD_FUNCTIONS
+            and "sqlalchemy" in frame.filename
+            for frame in stack
+        )
+        self.app_stack = [
+            frame for frame in stack
+            if frame.filename.endswith(".py")
+            and os.path.abspath(frame.filename).startswith(PROJECT_DIR)
+            and "site-packages" not in frame.filename
+        ]
+
+    @property
+    def site(self):
+        """
+        The innermost line of the project that led to the statement.
+        """
+
+        if not self.app_stack:
+            return "<outside the project>"
+        frame = self.app_stack[-1]
+        return "{}:{} in {}".format(
+            os.path.relpath(frame.filename, PROJECT_DIR),
+            frame.lineno,
+            frame.name
+        )
+
+
+class QueryCounter(object):
+    """
+    Context manager that records the statements executed on an engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(Statement(statement, traceback.extract_stack()[:-1]))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated_lazy_loads(self, limit=1):
+        """
+        Returns the lazy loads that were issued more than limit times from the
+        same line with the same SQL, as lists of Statements by (site, SQL).
+        """
+
+        loads = {}
+        for statement in self.statements:
+            if statement.lazy:
+                loads.setdefault((statement.site, statement.statement), []).append(statement)
+        return {
+            key: statements for key, statements in loads.items()
+            if len(statements) > limit
+        }
+
+    def report(self):
+        lines = ["{} SQL statements:".format(self.count)]
+        for statement in self.statements:
+            lines.append("  {}{}: {}".format(
+                "lazy load at " if statement.lazy else "",
+                statement.site,
+                " ".join(statement.statement.split())[:120]
+            ))
+        for (site, sql), statements in self.repeated_lazy_loads().items():
+            lines.append("")
+            lines.append("N+1: {} lazy loads at {}:".format(len(statements), site))
+            lines.append("  " + " ".join(sql.split())[:200])
+            lines.extend(
+                line.rstrip("\n")
+                for line in traceback.format_list(statements[0].app_stack)
+            )
+        return "\n".join(lines)
+
+    def assert_at_most(self, limit):
+        """
+        Asserts that at most limit statements were executed and that no lazy
+        load was repeated.
+        """
+
+        assert self.count <= limit and not self.repeated_lazy_loads(), \
+            "At most {} statements allowed. {}".format(limit, self.report())
@@ -1,14 +1,12 @@
-import json
 import os
 from flask import Flask, Response, send_from_directory, redirect
 from flask.cli import with_appcontext
-from flask_sqlalchemy import SQLAlchemy
 from workoutlog.constants import *
+from workoutlog.sharding import ShardedSQLAlchemy
 from sqlalchemy import event
-from sqlalchemy.engine import Engine
 from sqlite3 import Connection as SQLite3Connection
 
-db = SQLAlchemy()
+db = ShardedSQLAlchemy()
 
 # Based on http://flask.pocoo.org/docs/1.0/tutorial/factory/#the-application-factory
 # Modified to use Flask SQLAlchemy
@@ -17,7 +15,42 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY="dev",
         SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path, "development.db"),
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        WORKOUT_PAGE_SIZE=50,
+        WORKOUT_PAGE_SIZE_MAX=500,
+        # Allows ?profile=1 to return a cProfile summary of the request
+        PROFILE_REQUESTS=False,
+        # Header with the username of the user a request acts as. The API
+        # doesn't authenticate users, so the header must be set by an
+        # authenticating reverse proxy that strips it from client requests.
+        USER_HEADER="X-Workoutlog-User",
+        # Rejects API requests without the user header with 403 instead of
+        # acting as the default user
+        REQUIRE_USER_HEADER=False,
+        # Database URIs of the shards of the users' data, see
+        # workoutlog.sharding. Without shards all data is in the main database.
+        SHARD_DATABASE_URIS=[],
+        # Maximum number of shards with an open engine
+        SHARD_ENGINE_POOL_SIZE=8,
+        # Threads that run the requests of the ASGI entry point, and the
+        # response chunks they may send ahead of a client, see workoutlog.asgi
+        ASGI_THREADS=16,
+        ASGI_BUFFERED_CHUNKS=4,
+        # Bytes of responses kept in the response cache of the collections,
+        # 0 disables it, and the seconds an entry is served for, see
+        # workoutlog.cache
+        RESPONSE_CACHE_MAX_BYTES=64 * 1024 * 1024,
+        RESPONSE_CACHE_TTL=300,
+        # Pragmas set on every SQLite connection in this order, None skips one
+        SQLITE_PRAGMAS={
+            "busy_timeout": 5000,
+            "foreign_keys": "ON",
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64 * 1024,
+            "temp_store": "MEMORY"
+        }
     )
 
     if test_config is None:
@@ -30,35 +63,68 @@ def create_app(test_config=None):
     except OSError:
         pass
 
-    # Enforce foreign key constraints
-    @event.listens_for(Engine, "connect")
-    def _set_sqlite_pragma(dbapi_connection, connection_record):
-         if isinstance(dbapi_connection, SQLite3Connection):
-              cursor = dbapi_connection.cursor()
-              cursor.execute("PRAGMA foreign_keys=ON;")
-              cursor.close()
-
     db.init_app(app)
+    from . import sharding
+    sharding.init_app(app)
+
+    # Enforce foreign key constraints and tune SQLite for concurrent use.
+    # The listener is added to the engines of this app only, so apps created
+    # with different configs don't share their pragmas.
+    sqlite_pragmas = app.config["SQLITE_PRAGMAS"]
+
+    def _add_pragma_listener(engine):
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragma(dbapi_connection, connection_record):
+            if isinstance(dbapi_connection, SQLite3Connection):
+                cursor = dbapi_connection.cursor()
+                for name, value in sqlite_pragmas.items():
+                    if value is not None:
+                        cursor.execute("PRAGMA {}={};".format(name, value))
+                cursor.close()
+
+    with app.app_context():
+        _add_pragma_listener(db.engine)
+    if "shard_router" in app.extensions:
+        app.extensions["shard_router"].engine_hooks.append(_add_pragma_listener)
 
     from . import models
+    from . import cache
+    from . import migrations
+    from . import profiling
+    from . import tenancy
     from . import api
     
     # add CLI commands
     app.cli.add_command(models.init_db_command)
     app.cli.add_command(models.delete_db_command)
     app.cli.add_command(models.insert_initial_data)
+    app.cli.add_command(models.rebuild_summaries_command)
+    app.cli.add_command(models.export_command)
+    app.cli.add_command(models.import_command)
+    app.cli.add_command(models.gen_load_command)
+    app.cli.add_command(models.create_user_command)
+    app.cli.add_command(migrations.upgrade_db_command)
+    app.cli.add_command(sharding.rebalance_shards_command)
     app.register_blueprint(api.api_bp)
+    profiling.init_app(app)
+    tenancy.init_app(app)
+    cache.init_app(app)
+
+    from .utils import LinkTemplates, WorkoutLogBuilder, conditional_get, create_mason_response
 
-    from .utils import WorkoutLogBuilder
+    app.extensions["link_templates"] = LinkTemplates(app.url_map)
 
     @app.route("/api/", methods=["GET"])
+    @conditional_get()
     def entry():
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", "/api/")
         body.add_control_get_workouts()
         body.add_control_get_exercises()
         body.add_control_get_weekly_programming_all()
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        body.add_control_export()
+        body.add_control_import()
+        return create_mason_response(body)
 
     @app.route(LINK_RELATIONS_URL)
     def send_link_relations_html():
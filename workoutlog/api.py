@@ -6,6 +6,8 @@ from workoutlog.resources.exercise import ExerciseCollection, ExercisesWithinWor
 from workoutlog.resources.set import SetsWithinWorkout, SetItem
 from workoutlog.resources.weekly_programming import WeeklyProgrammingCollection, WeeklyProgrammingForExercise, WeeklyProgrammingItem
 from workoutlog.resources.max_data import MaxDataForExercise, MaxDataItem
+from workoutlog.resources.stats import ExerciseStats, ExerciseE1RM
+from workoutlog.resources.export import TrainingLogExport, TrainingLogImport
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 api = Api(api_bp)
@@ -43,8 +45,14 @@ api.add_resource(SetItem, "/exercises/<exercise_name>/workouts/<workout_id>/sets
 api.add_resource(MaxDataForExercise, "/exercises/<exercise_name>/max-data/")
 api.add_resource(MaxDataItem, "/exercises/<exercise_name>/max-data/<order_for_exercise>/")
 
+api.add_resource(ExerciseStats, "/exercises/<exercise_name>/stats/")
+api.add_resource(ExerciseE1RM, "/exercises/<exercise_name>/e1rm/")
+
 api.add_resource(WeeklyProgrammingCollection, "/weekly-programming/")
 api.add_resource(WeeklyProgrammingForExercise, "/exercises/<exercise_name>/weekly-programming/")
 api.add_resource(WeeklyProgrammingItem,
     "/weekly-programming/<exercise_type>/<week_number>/",
-    "/exercises/<exercise_name>/weekly-programming/<exercise_type>/<week_number>/",)
\ No newline at end of file
+    "/exercises/<exercise_name>/weekly-programming/<exercise_type>/<week_number>/",)
+
+api.add_resource(TrainingLogExport, "/export.ndjson")
+api.add_resource(TrainingLogImport, "/import/")
@@ -0,0 +1,206 @@
+"""
+ASGI entry point of the app, for serving it with an ASGI server:
+
+    uvicorn --factory workoutlog.asgi:create_asgi_app
+
+The resources are synchronous Flask views on SQLite, so every request runs
+in a pool of ASGI_THREADS threads while the event loop only deals with the
+clients. Clients don't take a thread while they send their request or wait
+for a response: the request body is read into a spooled file before the
+request is handed to a thread, and the response is passed back to the event
+loop in chunks. The threads can run ahead of a slow client by at most
+ASGI_BUFFERED_CHUNKS chunks, which only matters for streamed responses like
+the export.
+
+A request is run from start to end in one thread, because the session and
+its SQLite connection belong to the thread that opened them. If the
+application fails after the response has started, the error is raised to
+the server, which aborts the connection.
+"""
+
+import asyncio
+import logging
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes of a response collected in the thread before they are sent
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Bytes of a request body kept in memory before spooling it to disk
+REQUEST_BODY_MEMORY = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class AsgiAdapter(object):
+    """
+    ASGI application that runs a WSGI application in a bounded thread pool.
+    : param wsgi_app: the WSGI application
+    : param int threads: number of threads that run requests
+    : param int buffered_chunks: chunks a thread may send ahead of the client
+    """
+
+    def __init__(self, wsgi_app, threads, buffered_chunks=4):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.buffered_chunks = buffered_chunks
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="workoutlog-asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type '{}'".format(scope["type"]))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(REQUEST_BODY_MEMORY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        length = body.tell()
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        credits = threading.Semaphore(self.buffered_chunks)
+        cancelled = threading.Event()
+        environ = _environ(scope, body, length)
+        future = loop.run_in_executor(
+            self.executor, self._run, environ, loop, chunks, credits, cancelled
+        )
+
+        started = False
+        try:
+            while True:
+                start, data, more, error = await chunks.get()
+                if error is not None:
+                    if started:
+                        # Raising makes the server abort the connection, so
+                        # the client doesn't take the response as complete
+                        raise error
+                    start = ("500 INTERNAL SERVER ERROR", [("Content-Type", "text/plain")])
+                    data, more = b"Internal Server Error", False
+                if start is not None and not started:
+                    started = True
+                    await send({
+                        "type": "http.response.start",
+                        "status": int(start[0].split(" ", 1)[0]),
+                        "headers": [
+                            (name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in start[1]
+                        ]
+                    })
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+                if not more:
+                    break
+                credits.release()
+        finally:
+            # Lets a thread blocked on a slow or gone client finish
+            cancelled.set()
+            credits.release()
+            await future
+            body.close()
+
+    def _run(self, environ, loop, chunks, credits, cancelled):
+        # Runs the WSGI application and iterates its response in a thread
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started and started[0] is None:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [(status, headers)]
+
+        def emit(data, more, error=None):
+            start = started[0] if started else None
+            if started:
+                started[0] = None
+            loop.call_soon_threadsafe(chunks.put_nowait, (start, data, more, error))
+
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                buffer = []
+                size = 0
+                for data in iterable:
+                    buffer.append(data)
+                    size += len(data)
+                    if size >= RESPONSE_CHUNK_SIZE:
+                        credits.acquire()
+                        if cancelled.is_set():
+                            return
+                        emit(b"".join(buffer), True)
+                        buffer = []
+                        size = 0
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+            emit(b"".join(buffer), False)
+        except Exception as e:
+            logger.exception("Error in ASGI request %s", environ.get("PATH_INFO"))
+            emit(b"", False, e)
+
+
+def _environ(scope, body, length):
+    # The WSGI environ of an ASGI HTTP scope, see PEP 3333
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return environ
+
+
+def create_asgi_app(test_config=None):
+    """
+    Creates the app and returns its ASGI application.
+    : param dict test_config: config passed to create_app
+    """
+
+    from workoutlog import create_app
+    app = create_app(test_config)
+    return AsgiAdapter(app, app.config["ASGI_THREADS"], app.config["ASGI_BUFFERED_CHUNKS"])
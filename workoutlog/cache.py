@@ -0,0 +1,228 @@
+"""
+In-process cache of the serialized responses of the collections, which are
+read far more often than they are written. Resources opt in with
+conditional_get(..., cache=True).
+
+An entry is keyed by the shard, the user and the URL of the request, path
+and query string, and holds the Mason bytes of the response with the ETag
+it was served with. conditional_get computes the ETag from the change
+counters of the resource's tables before the handler runs, and an entry is
+only served while the ETag still matches. Writes of other processes, like
+the other workers of workoutlog serve or CLI commands, therefore make the
+entries miss instead of serving stale data.
+
+Writes of this process drop the entries they make stale as soon as they are
+committed: every flush records the tables it changed and the users the rows
+belong to, and after_commit drops the entries of those users that depend on
+those tables. Rolled back changes drop nothing. The change counters are per
+table though, so the entries of other users that depend on a written table
+miss when they are read next.
+
+The cache holds at most RESPONSE_CACHE_MAX_BYTES bytes of responses, and the
+least recently used entries are evicted to make room. Entries older than
+RESPONSE_CACHE_TTL seconds are not served. The hits, misses, evictions and
+invalidations are counted in /metrics.
+"""
+
+import collections
+import threading
+import time
+from itertools import chain
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+
+from workoutlog import db
+from workoutlog.models import get_changed_tables
+from workoutlog.tenancy import current_user_id
+
+# Name, help text and attribute of ResponseCache of every metric
+METRICS = (
+    ("workoutlog_response_cache_hits_total", "counter", "Responses served from the cache", "hits"),
+    ("workoutlog_response_cache_misses_total", "counter", "Responses not found in the cache or stale", "misses"),
+    ("workoutlog_response_cache_evictions_total", "counter", "Entries evicted to stay within the memory bound", "evictions"),
+    ("workoutlog_response_cache_invalidations_total", "counter", "Entries dropped by committed writes", "invalidations"),
+    ("workoutlog_response_cache_entries", "gauge", "Entries in the cache", "entries"),
+    ("workoutlog_response_cache_bytes", "gauge", "Bytes of the responses in the cache", "bytes")
+)
+
+
+class _Entry(object):
+
+    def __init__(self, etag, data, tables, expires):
+        self.etag = etag
+        self.data = data
+        self.tables = tables
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """
+    LRU cache of response bytes with a memory bound and a time to live.
+    Entries are keyed by (shard, user id, URL) tuples.
+    : param int max_bytes: maximum number of bytes of responses
+    : param float ttl: seconds an entry is served for
+    : param clock: function returning the current time in seconds
+    """
+
+    def __init__(self, max_bytes, ttl, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()
+        # Keys of the entries by the (shard, user id, table) they depend on
+        self._dependents = {}
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self):
+        return len(self._entries)
+
+    def get(self, key, etag):
+        """
+        Returns the cached response of a key if it was served with the given
+        ETag and hasn't expired, or None.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.etag != etag or entry.expires <= self.clock():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.data
+
+    def put(self, key, etag, tables, data):
+        """
+        Caches the response of a key.
+        : param str etag: ETag of the response
+        : param tables: names of the tables the response is built from
+        : param bytes data: the response body
+        """
+
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(etag, data, frozenset(tables), self.clock() + self.ttl)
+            self.bytes += len(data)
+            shard, user_id = key[:2]
+            for table in tables:
+                self._dependents.setdefault((shard, user_id, table), set()).add(key)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, shard, user_id, tables):
+        """
+        Drops the entries of a user that depend on any of the given tables.
+        """
+
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys.update(self._dependents.get((shard, user_id, table), ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= len(entry.data)
+        shard, user_id = key[:2]
+        for table in entry.tables:
+            dependents = self._dependents[shard, user_id, table]
+            dependents.discard(key)
+            if not dependents:
+                del self._dependents[shard, user_id, table]
+
+    def render(self):
+        """
+        Returns the counters in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            values = {attribute: getattr(self, attribute) for _, _, _, attribute in METRICS}
+        lines = []
+        for name, type, help, attribute in METRICS:
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, type))
+            lines.append("{} {}".format(name, values[attribute]))
+        return "\n".join(lines) + "\n"
+
+
+def cache_key(url):
+    """
+    Returns the cache key of a URL for the user and shard of the current
+    request.
+    """
+
+    return (g.get("shard"), current_user_id(), url)
+
+
+def get_cache():
+    """
+    Returns the response cache of the current app, or None if it's disabled.
+    """
+
+    return current_app.extensions.get("response_cache")
+
+
+@event.listens_for(db.session, "after_flush")
+def _record_changes(session, flush_context):
+    if not has_app_context():
+        return
+    table_names = get_changed_tables(session)
+    if not table_names:
+        return
+    user_ids = {current_user_id()}
+    for obj in chain(session.new, session.dirty, session.deleted):
+        user_ids.add(getattr(obj, "user_id", None) or current_user_id())
+    changes = session.info.setdefault("response_cache_changes", {})
+    for user_id in user_ids:
+        changes.setdefault((g.get("shard"), user_id), set()).update(table_names)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_changes(session):
+    changes = session.info.pop("response_cache_changes", None)
+    if not changes:
+        return
+    cache = session.app.extensions.get("response_cache")
+    if cache is None:
+        return
+    for (shard, user_id), table_names in changes.items():
+        cache.invalidate(shard, user_id, table_names)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("response_cache_changes", None)
+
+
+def init_app(app):
+    """
+    Adds a response cache to an app unless RESPONSE_CACHE_MAX_BYTES is 0.
+    """
+
+    if app.config["RESPONSE_CACHE_MAX_BYTES"]:
+        app.extensions["response_cache"] = ResponseCache(
+            app.config["RESPONSE_CACHE_MAX_BYTES"], app.config["RESPONSE_CACHE_TTL"]
+        )
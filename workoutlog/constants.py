@@ -7,4 +7,7 @@ WORKOUT_PROFILE = "/profiles/workout/"
 EXERCISE_PROFILE = "/profiles/exercise/"
 MAX_DATA_PROFILE = "/profiles/max-data/"
 SET_PROFILE = "/profiles/set/"
-WEEKLY_PROGRAMMING_PROFILE = "/profiles/weekly-programming/"
\ No newline at end of file
+WEEKLY_PROGRAMMING_PROFILE = "/profiles/weekly-programming/"
+STATS_PROFILE = "/profiles/stats/"
+E1RM_PROFILE = "/profiles/e1rm/"
+IMPORT_PROFILE = "/profiles/import/"
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Estimated one rep max (e1RM) formulas. Every formula takes the weights, reps
+and reps in reserve of many sets as sequences and returns the estimates as
+an array of the same length, with NaN for sets that can't be estimated.
+
+The formulas are vectorized with NumPy when it's installed. Without it they
+run over array module arrays: every formula multiplies the weights by a
+factor of the reps, which is computed once per distinct number of reps and
+applied to all sets with map.
+"""
+
+import math
+import operator
+from array import array
+from itertools import groupby, repeat
+
+# NumPy is an optional dependency, see extras_require in setup.py
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float("nan")
+
+# Percentage of 1RM that can be lifted for 1-12 reps to failure, from the
+# RPE chart of Reactive Training Systems. A set of 5 reps with 2 reps in
+# reserve (RPE 8) is estimated like 7 reps to failure.
+REPS_TO_FAILURE_PERCENTAGES = (
+    100.0, 95.5, 92.2, 89.2, 86.3, 83.7, 81.1, 78.6, 76.2, 73.9, 70.7, 68.0
+)
+CHART_REPS = range(1, len(REPS_TO_FAILURE_PERCENTAGES) + 1)
+
+
+def _to_array(values):
+    """
+    Converts a sequence with None values to an array of floats with NaNs.
+    """
+
+    values = [NAN if value is None else value for value in values]
+    if numpy is not None:
+        return numpy.asarray(values, dtype=float)
+    return array("d", values)
+
+
+def _scale(weights, reps, factor):
+    """
+    Multiplies the weights by factor(reps) without NumPy. The factor is
+    computed once per distinct number of reps, and sets without reps get NaN.
+    """
+
+    factors = {r: factor(r) for r in set(reps) if not math.isnan(r)}
+    return array("d", map(operator.mul, weights, map(factors.get, reps, repeat(NAN))))
+
+
+def _epley_factor(reps):
+    return 1 if reps == 1 else 1 + reps / 30
+
+
+def epley(weights, reps, reps_in_reserve=None):
+    """
+    weight * (1 + reps / 30). A single rep is already a max, so it's used as
+    is.
+    """
+
+    weights = _to_array(weights)
+    reps = _to_array(reps)
+    if numpy is not None:
+        with numpy.errstate(invalid="ignore"):
+            estimates = weights * (1 + reps / 30)
+            return numpy.where(reps == 1, weights, estimates)
+    return _scale(weights, reps, _epley_factor)
+
+
+def _brzycki_factor(reps):
+    return 36 / (37 - reps) if reps < 37 else NAN
+
+
+def brzycki(weights, reps, reps_in_reserve=None):
+    """
+    weight * 36 / (37 - reps), defined for less than 37 reps.
+    """
+
+    weights = _to_array(weights)
+    reps = _to_array(reps)
+    if numpy is not None:
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            estimates = weights * 36 / (37 - reps)
+            return numpy.where(reps < 37, estimates, NAN)
+    return _scale(weights, reps, _brzycki_factor)
+
+
+def rpe_table(weights, reps, reps_in_reserve):
+    """
+    weight divided by the percentage of 1RM for reps + reps in reserve reps
+    to failure in the RPE chart. Half reps in reserve (e.g. RPE 8.5) are
+    interpolated, and sets beyond the chart or without reps in reserve
+    can't be estimated.
+    """
+
+    weights = _to_array(weights)
+    reps = _to_array(reps)
+    reps_in_reserve = _to_array(reps_in_reserve)
+    if numpy is not None:
+        percentages = numpy.interp(
+            reps + reps_in_reserve, CHART_REPS, REPS_TO_FAILURE_PERCENTAGES,
+            left=NAN, right=NAN
+        )
+        return weights / percentages * 100
+    reps_to_failure = array("d", map(operator.add, reps, reps_in_reserve))
+    return _scale(weights, reps_to_failure, _rpe_table_factor)
+
+
+def _rpe_table_factor(reps_to_failure):
+    return 100 / _interpolate(reps_to_failure, CHART_REPS, REPS_TO_FAILURE_PERCENTAGES)
+
+
+def _interpolate(x, xs, ys):
+    if math.isnan(x) or x < xs[0] or x > xs[-1]:
+        return NAN
+    index = min(int(x) - xs[0], len(xs) - 2)
+    fraction = x - xs[index]
+    return ys[index] + (ys[index + 1] - ys[index]) * fraction
+
+
+FORMULAS = {
+    "epley": epley,
+    "brzycki": brzycki,
+    "rpe": rpe_table
+}
+
+
+def reps_in_reserve_of(reps_in_reserve, rate_of_perceived_exertion):
+    """
+    Returns the reps in reserve of each set, derived from the RPE (RPE 10 is
+    0 reps in reserve) for sets that only have an RPE.
+    """
+
+    return [
+        rir if rir is not None else (10 - rpe if rpe is not None else None)
+        for rir, rpe in zip(reps_in_reserve, rate_of_perceived_exertion)
+    ]
+
+
+def daily_best(days, estimates):
+    """
+    Returns (day, best estimate) pairs from estimates ordered by day. Days
+    without any estimate are left out.
+    """
+
+    if numpy is not None and len(days):
+        days = numpy.asarray(days)
+        estimates = numpy.asarray(estimates, dtype=float)
+        starts = numpy.flatnonzero(numpy.r_[True, days[1:] != days[:-1]])
+        best = numpy.fmax.reduceat(estimates, starts)
+        return [
+            (str(days[start]), float(value))
+            for start, value in zip(starts, best) if not math.isnan(value)
+        ]
+
+    series = []
+    for day, group in groupby(zip(days, estimates), key=lambda pair: pair[0]):
+        values = [value for _, value in group if not math.isnan(value)]
+        if values:
+            series.append((day, max(values)))
+    return series
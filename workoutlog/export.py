@@ -0,0 +1,128 @@
+"""
+Export of the whole training log as newline delimited JSON (NDJSON). Every
+line is one record with a "type" and the columns of one row. Rows refer to
+each other by their natural keys, i.e. workouts by date_time, exercises by
+exercise_name and weekly programming by week_number and exercise_type, so
+that the export can be imported into another database.
+
+The records are read with server side cursors in batches of
+EXPORT_BATCH_SIZE rows, so the memory use doesn't grow with the database.
+"""
+
+import datetime
+from workoutlog import db
+from workoutlog.models import *
+from workoutlog.utils import dump_json
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 1000
+
+
+def _value(value):
+    # Intervals as seconds and dates in ISO 8601 so that they can be parsed back
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds())
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _records(record_type, query):
+    for row in query.yield_per(EXPORT_BATCH_SIZE):
+        record = {"type": record_type}
+        for key, value in row._asdict().items():
+            record[key] = _value(value)
+        yield record
+
+
+def iter_export_records():
+    """
+    Yields the records of the export in an order where every row comes after
+    the rows it refers to. The first record describes the export itself.
+    """
+
+    yield {
+        "type": "export",
+        "version": EXPORT_FORMAT_VERSION,
+        "exported_at": datetime.datetime.utcnow().isoformat()
+    }
+
+    yield from _records("exercise", db.session.query(
+        Exercise.exercise_name,
+        Exercise.exercise_type
+    ).order_by(Exercise.id))
+
+    yield from _records("workout", db.session.query(
+        Workout.date_time,
+        Workout.duration,
+        Workout.body_weight,
+        Workout.average_heart_rate,
+        Workout.max_heart_rate,
+        Workout.notes
+    ).order_by(Workout.date_time))
+
+    yield from _records("workout_exercise", db.session.query(
+        Workout.date_time.label("workout"),
+        Exercise.exercise_name.label("exercise")
+    ).select_from(exercise_workout_association).join(
+        Workout, Workout.workout_id == exercise_workout_association.c.workout_id
+    ).join(
+        Exercise, Exercise.id == exercise_workout_association.c.exercise_id
+    ).order_by(Workout.date_time, Exercise.exercise_name))
+
+    yield from _records("set", db.session.query(
+        Workout.date_time.label("workout"),
+        Exercise.exercise_name.label("exercise"),
+        Set.order_in_workout,
+        Set.weight,
+        Set.number_of_reps,
+        Set.reps_in_reserve,
+        Set.rate_of_perceived_exertion,
+        Set.duration,
+        Set.distance
+    ).join(Workout, Workout.workout_id == Set.workout_id).join(
+        Exercise, Exercise.id == Set.exercise_id
+    ).order_by(Set.id))
+
+    yield from _records("max_data", db.session.query(
+        Exercise.exercise_name.label("exercise"),
+        MaxData.order_for_exercise,
+        MaxData.date,
+        MaxData.training_max,
+        MaxData.estimated_max,
+        MaxData.tested_max
+    ).join(Exercise, Exercise.id == MaxData.exercise_id).order_by(MaxData.id))
+
+    yield from _records("weekly_programming", db.session.query(
+        WeeklyProgramming.week_number,
+        WeeklyProgramming.exercise_type,
+        WeeklyProgramming.intensity,
+        WeeklyProgramming.number_of_sets,
+        WeeklyProgramming.number_of_reps,
+        WeeklyProgramming.reps_in_reserve,
+        WeeklyProgramming.rate_of_perceived_exertion,
+        WeeklyProgramming.duration,
+        WeeklyProgramming.distance,
+        WeeklyProgramming.average_heart_rate,
+        WeeklyProgramming.notes
+    ).order_by(WeeklyProgramming.id))
+
+    yield from _records("programming_exercise", db.session.query(
+        WeeklyProgramming.week_number,
+        WeeklyProgramming.exercise_type,
+        Exercise.exercise_name.label("exercise")
+    ).select_from(exercise_programming_association).join(
+        WeeklyProgramming,
+        WeeklyProgramming.id == exercise_programming_association.c.weekly_programming_id
+    ).join(
+        Exercise, Exercise.id == exercise_programming_association.c.exercise_id
+    ).order_by(WeeklyProgramming.id, Exercise.exercise_name))
+
+
+def iter_export_lines():
+    """
+    Yields the export records serialized as NDJSON lines.
+    """
+
+    for record in iter_export_records():
+        yield dump_json(record) + b"\n"
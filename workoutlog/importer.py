@@ -0,0 +1,429 @@
+"""
+Bulk import of training logs from NDJSON or CSV.
+
+NDJSON imports take the records written by workoutlog.export. CSV imports
+take one set per row with the columns of CSV_COLUMNS, where date_time and
+exercise_name are required. The workouts and exercises of the rows are
+created as needed.
+
+The input is parsed as a stream and written with executemany inserts in
+transactions of IMPORT_CHUNK_SIZE records. Rows that already exist, by
+their natural keys, are skipped, so an interrupted import can be run again.
+Sets without an order number are numbered by their position among the sets
+of the same exercise and workout in the input, so running an import again
+skips them too. The skipped records are counted in the result, as they can
+also be real conflicts, like a set whose order number is already taken.
+Exercises and workouts are resolved to ids through in-memory maps that
+only query the database for names and dates they haven't seen yet.
+
+The rows are imported for the user bound to the app context, see
+workoutlog.tenancy.
+"""
+
+import csv
+import datetime
+import json
+import time
+from sqlalchemy import select, tuple_
+from workoutlog import db
+from workoutlog.models import *
+from workoutlog.tenancy import current_user_id
+
+IMPORT_CHUNK_SIZE = 5000
+
+CSV_COLUMNS = (
+    "date_time",
+    "exercise_name",
+    "exercise_type",
+    "order_in_workout",
+    "weight",
+    "number_of_reps",
+    "reps_in_reserve",
+    "rate_of_perceived_exertion",
+    "duration",
+    "distance"
+)
+
+# Record types in the order their rows are inserted in
+RECORD_TYPES = (
+    "exercise",
+    "workout",
+    "workout_exercise",
+    "set",
+    "max_data",
+    "weekly_programming",
+    "programming_exercise"
+)
+
+_INTEGERS = {
+    "order_in_workout", "number_of_reps", "reps_in_reserve",
+    "order_for_exercise", "week_number", "number_of_sets",
+    "average_heart_rate", "max_heart_rate"
+}
+_FLOATS = {
+    "weight", "rate_of_perceived_exertion", "distance", "body_weight",
+    "training_max", "estimated_max", "tested_max", "intensity"
+}
+
+
+class ImportFormatError(ValueError):
+    """
+    Raised for input that can't be imported. The line number is the line of
+    the input the error was found on.
+    """
+
+    def __init__(self, line_number, message):
+        super().__init__("Line {}: {}".format(line_number, message))
+        self.line_number = line_number
+
+
+def parse_ndjson(lines):
+    """
+    Yields (line number, record) pairs from NDJSON lines. Empty lines and the
+    header record of the export are skipped.
+    """
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ImportFormatError(line_number, str(e))
+        if not isinstance(record, dict) or "type" not in record:
+            raise ImportFormatError(line_number, "Records must be objects with a type")
+        if record["type"] == "export":
+            continue
+        yield line_number, record
+
+
+def parse_csv(lines):
+    """
+    Yields (line number, record) pairs of sets from CSV lines with a header.
+    Empty cells are missing values.
+    """
+
+    reader = csv.DictReader(lines)
+    missing = {"date_time", "exercise_name"} - set(reader.fieldnames or ())
+    if missing:
+        raise ImportFormatError(1, "Missing columns: {}".format(", ".join(sorted(missing))))
+    for row in reader:
+        record = {"type": "set"}
+        for column in CSV_COLUMNS:
+            if row.get(column):
+                record[column] = row[column]
+        record["workout"] = record.pop("date_time", None)
+        record["exercise"] = record.pop("exercise_name", None)
+        yield reader.line_num, record
+
+
+def _integer(value):
+    return None if value is None or value == "" else int(value)
+
+
+def _float(value):
+    return None if value is None or value == "" else float(value)
+
+
+def _duration(value):
+    # Seconds as exported, or H:MM / H:MM:SS like the API and CSV files use
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.timedelta(seconds=value)
+    parts = [int(part) for part in value.split(":")]
+    if len(parts) == 2:
+        parts.append(0)
+    hours, minutes, seconds = parts
+    return datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+def _row(record, columns):
+    row = {}
+    for column in columns:
+        value = record.get(column)
+        if column in _INTEGERS:
+            value = _integer(value)
+        elif column in _FLOATS:
+            value = _float(value)
+        elif column == "duration":
+            value = _duration(value)
+        elif column in ("date_time", "workout"):
+            value = datetime.datetime.fromisoformat(value)
+        elif column == "date":
+            value = datetime.date.fromisoformat(value)
+        elif value is not None and not isinstance(value, str):
+            raise TypeError("{} must be a string".format(column))
+        row[column] = value
+    return row
+
+
+# Columns of each record type, the required ones first
+_RECORD_COLUMNS = {
+    "exercise": (("exercise_name",), ("exercise_type",)),
+    "workout": (("date_time",), (
+        "duration", "body_weight", "average_heart_rate", "max_heart_rate", "notes"
+    )),
+    "workout_exercise": (("workout", "exercise"), ()),
+    "set": (("workout", "exercise"), (
+        "exercise_type", "order_in_workout", "weight", "number_of_reps",
+        "reps_in_reserve", "rate_of_perceived_exertion", "duration", "distance"
+    )),
+    "max_data": (("exercise", "order_for_exercise", "date"), (
+        "training_max", "estimated_max", "tested_max"
+    )),
+    "weekly_programming": (("week_number", "exercise_type"), (
+        "intensity", "number_of_sets", "number_of_reps", "reps_in_reserve",
+        "rate_of_perceived_exertion", "duration", "distance",
+        "average_heart_rate", "notes"
+    )),
+    "programming_exercise": (("week_number", "exercise_type", "exercise"), ())
+}
+
+
+class _Importer(object):
+    """
+    Collects one chunk of records at a time and writes it to the database in
+    one transaction.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.user_id = current_user_id()
+        self.exercise_ids = {}
+        self.workout_ids = {}
+        # Sets of every (workout id, exercise id) seen in the input so far
+        self.positions = {}
+        self.counts = dict.fromkeys(RECORD_TYPES, 0)
+        self.inserted = 0
+        self.skipped = dict.fromkeys(RECORD_TYPES, 0)
+        self.rows = {record_type: [] for record_type in RECORD_TYPES}
+        self.pending = 0
+
+    def add(self, line_number, record):
+        """
+        Converts a record to a row and adds it to the current chunk.
+        """
+
+        record_type = record["type"]
+        if record_type not in _RECORD_COLUMNS:
+            raise ImportFormatError(line_number, "Unknown record type '{}'".format(record_type))
+        required, optional = _RECORD_COLUMNS[record_type]
+        for column in required:
+            if record.get(column) in (None, ""):
+                raise ImportFormatError(line_number, "Missing {} of {}".format(column, record_type))
+        try:
+            row = _row(record, required + optional)
+        except (TypeError, ValueError) as e:
+            raise ImportFormatError(line_number, "Invalid {}: {}".format(record_type, e))
+
+        self.rows[record_type].append((line_number, row))
+        self.counts[record_type] += 1
+        self.pending += 1
+
+    def _insert(self, table, rows, record_type=None):
+        # Returns the number of inserted rows. The rows that already exist
+        # are counted as skipped records of the given type.
+        if not rows:
+            return 0
+        result = self.connection.execute(table.insert().prefix_with("OR IGNORE"), rows)
+        inserted = max(result.rowcount, 0)
+        self.inserted += inserted
+        if record_type is not None:
+            self.skipped[record_type] += len(rows) - inserted
+        return inserted
+
+    def _resolve(self, ids, key_column, id_column, keys, new_row):
+        # Looks up the ids of the keys not in the map yet and creates the
+        # rows that don't exist. Returns the keys that were created.
+        created = set()
+        for attempt in range(2):
+            missing = list(dict.fromkeys(key for key in keys if key not in ids))
+            for start in range(0, len(missing), 500):
+                ids.update(
+                    (key, id) for id, key in self.connection.execute(
+                        select([id_column, key_column]).where(
+                            key_column.table.c.user_id == self.user_id
+                        ).where(
+                            key_column.in_(missing[start:start + 500])
+                        )
+                    )
+                )
+            missing = [key for key in missing if key not in ids]
+            if not missing:
+                return created
+            created.update(missing)
+            self._insert(key_column.table, [new_row(key) for key in missing])
+        return created
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            with self.connection.begin():
+                self._flush()
+        finally:
+            self.rows = {record_type: [] for record_type in RECORD_TYPES}
+            self.pending = 0
+
+    def _flush(self):
+        rows = {
+            record_type: [row for line_number, row in self.rows[record_type]]
+            for record_type in RECORD_TYPES
+        }
+
+        # Exercises and workouts, including the ones only referred to
+        exercise_types = {}
+        for row in rows["exercise"]:
+            exercise_types[row["exercise_name"]] = row["exercise_type"]
+        for row in rows["set"]:
+            exercise_types.setdefault(row["exercise"], row["exercise_type"])
+        for record_type in ("workout_exercise", "max_data", "programming_exercise"):
+            for row in rows[record_type]:
+                exercise_types.setdefault(row["exercise"], None)
+        created = self._resolve(
+            self.exercise_ids, Exercise.exercise_name, Exercise.id, exercise_types,
+            lambda name: {
+                "user_id": self.user_id,
+                "exercise_name": name,
+                "exercise_type": exercise_types[name]
+            }
+        )
+        self.skipped["exercise"] += len(rows["exercise"]) - len(
+            {row["exercise_name"] for row in rows["exercise"]} & created
+        )
+
+        for record_type in ("workout", "max_data", "weekly_programming"):
+            for row in rows[record_type]:
+                row["user_id"] = self.user_id
+        self.skipped["workout"] += len(rows["workout"]) - self._insert(Workout.__table__, [
+            row for row in rows["workout"] if row["date_time"] not in self.workout_ids
+        ])
+        date_times = [row["date_time"] for row in rows["workout"]]
+        for record_type in ("workout_exercise", "set"):
+            date_times.extend(row["workout"] for row in rows[record_type])
+        self._resolve(
+            self.workout_ids, Workout.date_time, Workout.workout_id, date_times,
+            lambda date_time: {"user_id": self.user_id, "date_time": date_time}
+        )
+
+        # Sets and the exercises of the workouts
+        associations = [
+            (self.workout_ids[row["workout"]], self.exercise_ids[row["exercise"]])
+            for row in rows["workout_exercise"]
+        ]
+        set_associations = set()
+        set_rows = []
+        for row in rows["set"]:
+            workout_id = self.workout_ids[row.pop("workout")]
+            exercise_id = self.exercise_ids[row.pop("exercise")]
+            row.pop("exercise_type")
+            row.update(workout_id=workout_id, exercise_id=exercise_id)
+            key = (workout_id, exercise_id)
+            self.positions[key] = self.positions.get(key, 0) + 1
+            if row["order_in_workout"] is None:
+                row["order_in_workout"] = self.positions[key]
+            set_associations.add(key)
+            set_rows.append(row)
+
+        self._insert(exercise_workout_association, [
+            {"workout_id": workout_id, "exercise_id": exercise_id}
+            for workout_id, exercise_id in associations
+        ], "workout_exercise")
+        self._insert(exercise_workout_association, [
+            {"workout_id": workout_id, "exercise_id": exercise_id}
+            for workout_id, exercise_id in set_associations.difference(associations)
+        ])
+        self._insert(Set.__table__, set_rows, "set")
+
+        # Max data and weekly programming
+        for row in rows["max_data"]:
+            row["exercise_id"] = self.exercise_ids[row.pop("exercise")]
+        self._insert(MaxData.__table__, rows["max_data"], "max_data")
+        self._insert(WeeklyProgramming.__table__, rows["weekly_programming"], "weekly_programming")
+        self._insert_programming_exercises(self.rows["programming_exercise"])
+
+        # The rows were written without the session, so the events that keep
+        # the change counters and workout summaries up to date didn't run
+        changed_tables = set()
+        for record_type, table_names in (
+                ("exercise", ["exercise"]),
+                ("workout", ["workout"]),
+                ("workout_exercise", ["exercise", "workout", "exercise_workout_association"]),
+                ("set", ["exercise", "workout", "exercise_workout_association", "set", "workout_summary"]),
+                ("max_data", ["exercise", "max_data"]),
+                ("weekly_programming", ["weekly_programming"]),
+                ("programming_exercise", ["exercise", "exercise_programming_association"])
+                ):
+            if rows[record_type]:
+                changed_tables.update(table_names)
+        if set_rows:
+            rebuild_workout_summaries(
+                self.connection, list({row["workout_id"] for row in set_rows})
+            )
+        bump_change_counters(self.connection, changed_tables)
+
+    def _insert_programming_exercises(self, programming_exercises):
+        if not programming_exercises:
+            return
+        keys = list({
+            (row["week_number"], row["exercise_type"])
+            for line_number, row in programming_exercises
+        })
+        programming_ids = {
+            (week_number, exercise_type): id
+            for id, week_number, exercise_type in self.connection.execute(
+                select([
+                    WeeklyProgramming.id,
+                    WeeklyProgramming.week_number,
+                    WeeklyProgramming.exercise_type
+                ]).where(
+                    WeeklyProgramming.user_id == self.user_id
+                ).where(tuple_(
+                    WeeklyProgramming.week_number,
+                    WeeklyProgramming.exercise_type
+                ).in_(keys))
+            )
+        }
+        association_rows = []
+        for line_number, row in programming_exercises:
+            key = (row["week_number"], row["exercise_type"])
+            if key not in programming_ids:
+                raise ImportFormatError(line_number,
+                    "No weekly programming for week {} of '{}'".format(*key)
+                )
+            association_rows.append({
+                "weekly_programming_id": programming_ids[key],
+                "exercise_id": self.exercise_ids[row["exercise"]]
+            })
+        self._insert(exercise_programming_association, association_rows, "programming_exercise")
+
+
+def import_records(records, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports (line number, record) pairs in transactions of chunk_size
+    records. Returns the number of records of each type, the number of
+    inserted rows, the number of skipped records of each type and the
+    throughput. Raises ImportFormatError for invalid
+    records, in which case the chunks before the invalid one stay imported.
+    """
+
+    start = time.perf_counter()
+    with db.engine.connect() as connection:
+        importer = _Importer(connection)
+        for line_number, record in records:
+            importer.add(line_number, record)
+            if importer.pending >= chunk_size:
+                importer.flush()
+        importer.flush()
+    seconds = time.perf_counter() - start
+
+    rows = sum(importer.counts.values())
+    return {
+        "records": importer.counts,
+        "rows": rows,
+        "inserted": importer.inserted,
+        "skipped": importer.skipped,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None
+    }
@@ -0,0 +1,247 @@
+"""
+Seeded generator of synthetic training logs for load testing. The log is a
+lifter training 3-5 times a week on a periodized program, with weights that
+progress quickly at first and then plateau, deload weeks, missed weeks,
+conditioning sessions, max tests and the weekly programming of the program.
+
+The same seed always generates the same log. The records are in the format
+of workoutlog.export, so they can be written with workoutlog.importer.
+"""
+
+import datetime
+import math
+import random
+
+GENERATOR_START = datetime.datetime(2015, 1, 5)
+
+# Name, type, starting weight (None for conditioning) and relative gain
+# over the first years
+EXERCISES = (
+    ("Squat", "Main lift", 80.0, 0.9),
+    ("Bench Press", "Main lift", 60.0, 0.7),
+    ("Deadlift", "Main lift", 100.0, 0.9),
+    ("Overhead Press", "Main lift", 40.0, 0.6),
+    ("Barbell Row", "Assistance", 50.0, 0.7),
+    ("Romanian Deadlift", "Assistance", 70.0, 0.8),
+    ("Front Squat", "Assistance", 60.0, 0.8),
+    ("Close Grip Bench Press", "Assistance", 50.0, 0.6),
+    ("Pull-up", "Assistance", 0.0, 0.0),
+    ("Lunge", "Accessory", 30.0, 0.5),
+    ("Biceps Curl", "Accessory", 12.0, 0.5),
+    ("Triceps Extension", "Accessory", 15.0, 0.5),
+    ("Lateral Raise", "Accessory", 8.0, 0.4),
+    ("Running", "Conditioning", None, 0.0),
+    ("Rowing Machine", "Conditioning", None, 0.0)
+)
+
+# Percentage of the training max, reps and RPE of the main lifts in each
+# week of the four week wave. The fourth week is a deload.
+WAVE = (
+    (0.70, 8, 7.0),
+    (0.77, 5, 8.0),
+    (0.84, 3, 8.5),
+    (0.60, 5, 6.0)
+)
+PROGRAM_WEEKS = 12
+
+
+def _exercises_of(exercise_type):
+    return [exercise for exercise in EXERCISES if exercise[1] == exercise_type]
+
+
+def _round_weight(weight):
+    return round(weight / 2.5) * 2.5
+
+
+class _Lifter(object):
+
+    def __init__(self, seed, sets_per_workout):
+        self.random = random.Random(seed)
+        self.sets_per_workout = sets_per_workout
+        self.body_weight = self.random.uniform(65.0, 95.0)
+        self.resting_heart_rate = self.random.randint(55, 75)
+
+    def training_max(self, exercise, weeks):
+        # Fast beginner gains that level off
+        name, exercise_type, start_weight, gain = exercise
+        return start_weight * (1 + gain * math.log1p(weeks / 26.0) / math.log(11))
+
+    def workout(self, date_time, weeks, day):
+        """
+        Returns the workout record and the set records of one workout.
+        """
+
+        rand = self.random
+        self.body_weight = min(max(self.body_weight + rand.gauss(0, 0.3), 55.0), 120.0)
+        total_sets = max(1, int(round(rand.gauss(self.sets_per_workout, self.sets_per_workout * 0.15))))
+
+        # A main lift, assistance and accessories, and sometimes conditioning
+        main = _exercises_of("Main lift")
+        exercises = [main[day % len(main)]]
+        exercises.append(_exercises_of("Assistance")[(weeks + day) % 5])
+        exercises.extend(rand.sample(_exercises_of("Accessory"), 2))
+        if rand.random() < 0.25:
+            exercises.append(rand.choice(_exercises_of("Conditioning")))
+        exercises = exercises[:max(1, min(len(exercises), total_sets))]
+
+        # The main lift gets the most sets
+        weights = [3] + [2] * (len(exercises) - 1)
+        set_counts = [1] * len(exercises)
+        for i in range(total_sets - len(exercises)):
+            set_counts[rand.choices(range(len(exercises)), weights)[0]] += 1
+
+        percentage, wave_reps, wave_rpe = WAVE[weeks % len(WAVE)]
+        sets = []
+        for exercise, set_count in zip(exercises, set_counts):
+            name, exercise_type, start_weight, gain = exercise
+            for order in range(1, set_count + 1):
+                if start_weight is None:
+                    minutes = rand.uniform(15, 45)
+                    sets.append({
+                        "exercise": name,
+                        "order_in_workout": order,
+                        "duration": int(minutes * 60),
+                        "distance": round(minutes / rand.uniform(5.0, 7.0), 2)
+                    })
+                    continue
+                if exercise_type == "Main lift":
+                    weight = self.training_max(exercise, weeks) * percentage
+                    reps = wave_reps
+                    rpe = wave_rpe + (order - 1) * 0.5 / set_count
+                else:
+                    weight = self.training_max(exercise, weeks) * rand.uniform(0.95, 1.05)
+                    reps = rand.choice((6, 8, 8, 10, 10, 12, 15))
+                    rpe = rand.uniform(6.5, 9.0)
+                rpe = min(10.0, round((rpe + rand.gauss(0, 0.5)) * 2) / 2)
+                # Missed reps on hard sets
+                if rpe >= 9.5 and rand.random() < 0.3:
+                    reps = max(1, reps - rand.randint(1, 2))
+                sets.append({
+                    "exercise": name,
+                    "order_in_workout": order,
+                    "weight": _round_weight(weight),
+                    "number_of_reps": reps,
+                    "reps_in_reserve": int(10 - rpe),
+                    "rate_of_perceived_exertion": rpe
+                })
+
+        conditioning = sum(s.get("duration", 0) for s in sets)
+        record = {
+            "date_time": date_time.isoformat(),
+            "duration": int(total_sets * rand.uniform(180, 300) + conditioning),
+            "body_weight": round(self.body_weight, 1),
+            "average_heart_rate": self.resting_heart_rate + rand.randint(35, 60),
+            "max_heart_rate": self.resting_heart_rate + rand.randint(90, 120),
+            "notes": rand.choice((None, None, None, "Felt strong", "Tired", "Short on time"))
+        }
+        return record, sets
+
+
+def _weekly_programming():
+    for week_number in range(1, PROGRAM_WEEKS + 1):
+        percentage, reps, rpe = WAVE[(week_number - 1) % len(WAVE)]
+        for exercise_type, intensity, sets, reps, rpe in (
+                ("Main lift", percentage * 100, 5, reps, rpe),
+                ("Assistance", None, 4, 8, 8.0),
+                ("Accessory", None, 3, 12, 8.5)
+                ):
+            yield {
+                "type": "weekly_programming",
+                "week_number": week_number,
+                "exercise_type": exercise_type,
+                "intensity": intensity,
+                "number_of_sets": sets,
+                "number_of_reps": reps,
+                "reps_in_reserve": int(10 - rpe),
+                "rate_of_perceived_exertion": rpe
+            }
+        yield {
+            "type": "weekly_programming",
+            "week_number": week_number,
+            "exercise_type": "Conditioning",
+            "duration": 30 * 60,
+            "distance": 5.0,
+            "average_heart_rate": 150
+        }
+
+
+def generate_training_log(years=None, sets_per_workout=20, seed=0, max_sets=None):
+    """
+    Yields the records of a synthetic training log in the order they can be
+    imported in. The log ends after the given number of years or when it has
+    max_sets sets, whichever comes first. Without either limit the log is
+    one year long.
+    : param float years: length of the log in years, no limit if None
+    : param int sets_per_workout: average number of sets in a workout
+    : param int seed: seed of the random numbers
+    : param int max_sets: maximum number of sets, no maximum if None
+    """
+
+    lifter = _Lifter(seed, sets_per_workout)
+    rand = lifter.random
+
+    for name, exercise_type, start_weight, gain in EXERCISES:
+        yield {"type": "exercise", "exercise_name": name, "exercise_type": exercise_type}
+    yield from _weekly_programming()
+    for week_number in range(1, PROGRAM_WEEKS + 1):
+        for name, exercise_type, start_weight, gain in EXERCISES:
+            yield {
+                "type": "programming_exercise",
+                "week_number": week_number,
+                "exercise_type": exercise_type,
+                "exercise": name
+            }
+
+    set_count = 0
+    max_tests = {}
+    if years is None and max_sets is None:
+        years = 1.0
+    end = datetime.datetime.max
+    if years is not None:
+        end = GENERATOR_START + datetime.timedelta(days=365.25 * years)
+    week_start = GENERATOR_START
+    weeks = 0
+    while week_start < end and (max_sets is None or set_count < max_sets):
+        # Some weeks are missed because of holidays and illness
+        if rand.random() < 0.05:
+            week_start += datetime.timedelta(weeks=1)
+            continue
+
+        days = sorted(rand.sample(range(7), rand.choice((3, 3, 4, 4, 4, 5))))
+        for day_index, day in enumerate(days):
+            hour = rand.choice((7, 12, 17, 17, 18, 18, 19, 20))
+            date_time = week_start + datetime.timedelta(
+                days=day, hours=hour, minutes=rand.choice((0, 15, 30, 45))
+            )
+            if date_time >= end:
+                break
+            workout, sets = lifter.workout(date_time, weeks, day_index)
+            if max_sets is not None:
+                sets = sets[:max_sets - set_count]
+            workout["type"] = "workout"
+            yield workout
+            for set in sets:
+                set["type"] = "set"
+                set["workout"] = workout["date_time"]
+                yield set
+            set_count += len(sets)
+            if max_sets is not None and set_count >= max_sets:
+                break
+
+        # The main lifts are tested at the end of every program
+        if weeks % PROGRAM_WEEKS == PROGRAM_WEEKS - 1:
+            for exercise in _exercises_of("Main lift"):
+                training_max = lifter.training_max(exercise, weeks)
+                order = max_tests[exercise[0]] = max_tests.get(exercise[0], 0) + 1
+                yield {
+                    "type": "max_data",
+                    "exercise": exercise[0],
+                    "order_for_exercise": order,
+                    "date": (week_start + datetime.timedelta(days=6)).date().isoformat(),
+                    "training_max": _round_weight(training_max),
+                    "estimated_max": _round_weight(training_max / 0.9),
+                    "tested_max": _round_weight(training_max / 0.9 * rand.uniform(0.95, 1.05))
+                }
+
+        week_start += datetime.timedelta(weeks=1)
+        weeks += 1
@@ -0,0 +1,184 @@
+import datetime
+import re
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateTable
+from workoutlog import db
+from workoutlog.models import *
+from workoutlog.sharding import database_engines
+
+
+#
+# Schema migrations for databases created with an older version of the models.
+# New databases get the whole schema from init-db, so every migration checks
+# the current state of the database first and only changes what is missing.
+#
+# SQLite can't change the constraints of a table, so such migrations rebuild
+# the table: the table is created again from the model under a temporary
+# name, the rows are copied to it and it replaces the old table. The foreign
+# keys are off while migrating, so that dropping the old table doesn't
+# cascade to the rows referring to it.
+#
+
+# Revisions that have been applied to the database
+schema_migration = db.Table("schema_migration",
+    db.Column("revision", db.String(100), primary_key=True),
+    db.Column("applied_at", db.DateTime, nullable=False)
+)
+
+MIGRATIONS = []
+
+
+def migration(revision):
+    """
+    Registers an upgrade function as a migration. The migrations are applied
+    in the order they are registered in.
+    : param str revision: unique name of the migration
+    """
+
+    def decorator(upgrade_function):
+        MIGRATIONS.append((revision, upgrade_function))
+        return upgrade_function
+    return decorator
+
+
+def _create_missing_indexes(connection, table):
+    # Indexes of columns that are added by later migrations are created by
+    # those migrations
+    existing = {index["name"] for index in inspect(connection).get_indexes(table.name)}
+    columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for index in table.indexes:
+        if index.name not in existing and {c.name for c in index.columns} <= columns:
+            index.create(connection)
+
+
+def _rebuild_table(connection, table, **values):
+    """
+    Rebuilds a table to match its model. The columns of the old table are
+    copied and the new columns are set to the given values.
+    : param Table table: table of the model
+    : param values: values of the columns the old table doesn't have
+    """
+
+    old_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    columns = [column.name for column in table.columns if column.name in old_columns]
+    new_name = "_new_" + table.name
+
+    create = str(CreateTable(table).compile(connection))
+    connection.execute(re.sub(
+        r"^\s*CREATE TABLE \S+", "CREATE TABLE " + new_name, create, count=1
+    ))
+    connection.execute(text(
+        "INSERT INTO {new} ({columns}) SELECT {old_columns} FROM {old}".format(
+            new=new_name,
+            old=table.name,
+            columns=", ".join(columns + list(values)),
+            old_columns=", ".join(columns + [":" + name for name in values])
+        )
+    ), **values)
+    connection.execute("DROP TABLE {}".format(table.name))
+    connection.execute("ALTER TABLE {} RENAME TO {}".format(new_name, table.name))
+    for index in table.indexes:
+        index.create(connection)
+
+
+@migration("0001_change_counter")
+def _add_change_counter(connection):
+    ChangeCounter.__table__.create(connection, checkfirst=True)
+
+
+@migration("0002_access_path_indexes")
+def _add_access_path_indexes(connection):
+    for table in (
+            Set.__table__,
+            WeeklyProgramming.__table__,
+            exercise_workout_association,
+            exercise_programming_association
+            ):
+        _create_missing_indexes(connection, table)
+
+
+@migration("0003_workout_summary")
+def _add_workout_summary(connection):
+    if "workout_summary" not in inspect(connection).get_table_names():
+        WorkoutSummary.__table__.create(connection)
+        rebuild_workout_summaries(connection)
+
+
+@migration("0004_users")
+def _add_users(connection):
+    if "user" not in inspect(connection).get_table_names():
+        # Creating the table inserts the default user
+        User.__table__.create(connection)
+    for model in (Exercise, Workout, MaxData, WeeklyProgramming):
+        columns = [column["name"] for column in inspect(connection).get_columns(model.__tablename__)]
+        if "user_id" not in columns:
+            _rebuild_table(connection, model.__table__, user_id=DEFAULT_USER_ID)
+
+
+@migration("0005_user_shard")
+def _add_user_shard(connection):
+    columns = [column["name"] for column in inspect(connection).get_columns("user")]
+    if "shard" not in columns:
+        connection.execute('ALTER TABLE "user" ADD COLUMN shard INTEGER')
+
+
+@migration("0006_workout_summary_exercises")
+def _add_workout_summary_exercises(connection):
+    columns = [column["name"] for column in inspect(connection).get_columns("workout_summary")]
+    if "exercise_names" not in columns:
+        connection.execute(
+            "ALTER TABLE workout_summary ADD COLUMN exercise_names TEXT NOT NULL DEFAULT '[]'"
+        )
+        rebuild_workout_summaries(connection)
+
+
+def upgrade(connection):
+    """
+    Applies the migrations that haven't been applied to the database yet and
+    returns their revisions. The connection must be in a transaction with
+    the foreign keys off.
+    """
+
+    schema_migration.create(connection, checkfirst=True)
+    applied = {
+        row.revision for row in connection.execute(select([schema_migration.c.revision]))
+    }
+
+    upgraded = []
+    for revision, upgrade_function in MIGRATIONS:
+        if revision in applied:
+            continue
+        upgrade_function(connection)
+        connection.execute(schema_migration.insert().values(
+            revision=revision,
+            applied_at=datetime.datetime.utcnow()
+            )
+        )
+        upgraded.append(revision)
+    return upgraded
+
+
+# Upgrades the database to the current models
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    for engine in database_engines():
+        with engine.connect() as connection:
+            # The pragma has no effect within a transaction
+            connection.execute("PRAGMA foreign_keys=OFF")
+            try:
+                with connection.begin():
+                    upgraded = upgrade(connection)
+                    violations = connection.execute("PRAGMA foreign_key_check").fetchall()
+                    if violations:
+                        raise click.ClickException(
+                            "The migrations broke foreign keys: {}".format(violations)
+                        )
+            finally:
+                connection.execute("PRAGMA foreign_keys=ON")
+        for revision in upgraded:
+            click.echo("Applied migration {} to {}".format(revision, engine.url))
+        if not upgraded:
+            click.echo("{} is up to date".format(engine.url))
@@ -1,9 +1,12 @@
 import datetime
 from enum import unique
+from itertools import chain
 import click
 from flask.cli import with_appcontext
-from sqlalchemy import desc
+from sqlalchemy import and_, case, cast, desc, event, exists, func, inspect, select
+from sqlalchemy.orm import attributes
 from workoutlog import db
+from workoutlog.tenancy import DEFAULT_USER_ID, DEFAULT_USERNAME, current_user_id
 
 
 
@@ -11,14 +14,20 @@ from workoutlog import db
 # Association tables for many-to-many relationships 
 #
 
+# The primary keys index the associations by exercise and the extra indexes
+# cover the lookups from the other direction
 exercise_workout_association = db.Table("exercise_workout_association",
     db.Column("exercise_id", db.ForeignKey("exercise.id"), primary_key=True),
-    db.Column("workout_id", db.ForeignKey("workout.workout_id"), primary_key=True)
+    db.Column("workout_id", db.ForeignKey("workout.workout_id"), primary_key=True),
+    db.Index("ix_exercise_workout_association_workout", "workout_id", "exercise_id")
 )
 
 exercise_programming_association = db.Table("exercise_programming_association",
     db.Column("exercise_id", db.ForeignKey("exercise.id"), primary_key=True),
-    db.Column("weekly_programming_id", db.ForeignKey("weekly_programming.id"), primary_key=True)
+    db.Column("weekly_programming_id", db.ForeignKey("weekly_programming.id"), primary_key=True),
+    db.Index("ix_exercise_programming_association_programming",
+        "weekly_programming_id", "exercise_id"
+    )
 )
 
 
@@ -26,10 +35,38 @@ exercise_programming_association = db.Table("exercise_programming_association",
 # Models
 #
 
+class User(db.Model):
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), unique=True, nullable=False)
+    # Assigned shard of the user's data, see workoutlog.sharding
+    shard = db.Column(db.Integer, nullable=True)
+
+
+# Databases always have the default user, which owns the rows created
+# without a bound user
+@event.listens_for(User.__table__, "after_create")
+def _insert_default_user(target, connection, **kwargs):
+    connection.execute(target.insert().values(
+        id=DEFAULT_USER_ID,
+        username=DEFAULT_USERNAME
+        )
+    )
+
+
 class Workout(db.Model):
 
+    # The workouts of a user are listed from the unique index by date_time
+    __table_args__ = (db.UniqueConstraint(
+        "user_id",
+        "date_time",
+        name="_user_date_time_uc"), )
+
     workout_id = db.Column(db.Integer, primary_key=True)
-    date_time = db.Column(db.DateTime, unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False, default=current_user_id
+    )
+    date_time = db.Column(db.DateTime, nullable=False)
     duration = db.Column(db.Interval, nullable=True)
     body_weight = db.Column(db.Float, nullable=True)
     average_heart_rate = db.Column(db.Integer, nullable=True)
@@ -44,9 +81,16 @@ class Workout(db.Model):
         cascade="all, delete-orphan", 
         back_populates="workout"
     )
+    # Maintained by the Set events below and deleted by the foreign key
+    # cascade, so it's never written through this relationship
+    summary = db.relationship("WorkoutSummary", uselist=False, viewonly=True)
     
     @staticmethod
     def get_schema():
+        return WORKOUT_SCHEMA
+
+    @staticmethod
+    def _build_schema():
         schema = {
             "type": "object",
             "required": ["date_time"],
@@ -85,8 +129,16 @@ class Workout(db.Model):
 
 class Exercise(db.Model):
 
+    __table_args__ = (db.UniqueConstraint(
+        "user_id",
+        "exercise_name",
+        name="_user_exercise_name_uc"), )
+
     id = db.Column(db.Integer, primary_key=True)
-    exercise_name = db.Column(db.String(100), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False, default=current_user_id
+    )
+    exercise_name = db.Column(db.String(100), nullable=False)
     exercise_type = db.Column(db.String(100), nullable=True)
 
     workouts = db.relationship("Workout",
@@ -108,6 +160,10 @@ class Exercise(db.Model):
 
     @staticmethod
     def get_schema():
+        return EXERCISE_SCHEMA
+
+    @staticmethod
+    def _build_schema():
         schema = {
             "type": "object",
             "required": ["exercise_name"]
@@ -126,11 +182,17 @@ class Exercise(db.Model):
 
 class Set(db.Model):
 
+    # The unique constraint covers the sets of an exercise and the index
+    # covers all sets of a workout in the order they are listed in
     __table_args__ = (db.UniqueConstraint(
         "exercise_id",
         "workout_id",
         "order_in_workout",
-        name="_exercise_session_order_uc"), )
+        name="_exercise_session_order_uc"),
+        db.Index("ix_set_workout_exercise_order",
+        "workout_id",
+        "exercise_id",
+        "order_in_workout"), )
 
     id = db.Column(db.Integer, primary_key=True)
     exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id",
@@ -153,6 +215,10 @@ class Set(db.Model):
 
     @staticmethod
     def get_schema():
+        return SET_SCHEMA
+
+    @staticmethod
+    def _build_schema():
         schema = {
             "type": "object",
             "required": []
@@ -191,12 +257,20 @@ class Set(db.Model):
     
 class MaxData(db.Model):
 
+    # The index covers all max data of a user
     __table_args__ = (db.UniqueConstraint(
         "exercise_id", 
         "order_for_exercise", 
-        name="_exercise_order_uc"), )
+        name="_exercise_order_uc"),
+        db.Index("ix_max_data_user_exercise",
+        "user_id",
+        "exercise_id",
+        "order_for_exercise"), )
 
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False, default=current_user_id
+    )
     exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id", ondelete="CASCADE"))
     order_for_exercise = db.Column(db.Integer, nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -208,6 +282,10 @@ class MaxData(db.Model):
 
     @staticmethod
     def get_schema():
+        return MAX_DATA_SCHEMA
+
+    @staticmethod
+    def _build_schema():
         schema = {
             "type": "object",
             "required": ["date"]
@@ -238,12 +316,22 @@ class MaxData(db.Model):
 
 class WeeklyProgramming(db.Model):
 
+    # The unique constraint covers lookups by week and the index covers the
+    # programming of an exercise type
     __table_args__ = (db.UniqueConstraint(
+        "user_id",
         "week_number",
         "exercise_type",
-        name="_week_exercise_uc"), )
+        name="_user_week_exercise_uc"),
+        db.Index("ix_weekly_programming_user_type_week",
+        "user_id",
+        "exercise_type",
+        "week_number"), )
 
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False, default=current_user_id
+    )
     week_number = db.Column(db.Integer, nullable=False)
     exercise_type = db.Column(db.String(100), nullable=False)
     intensity = db.Column(db.Float, nullable=True)
@@ -261,6 +349,10 @@ class WeeklyProgramming(db.Model):
 
     @staticmethod
     def get_schema():
+        return WEEKLY_PROGRAMMING_SCHEMA
+
+    @staticmethod
+    def _build_schema():
         schema = {
             "type": "object",
             "required": ["week_number", "exercise_type"]
@@ -313,6 +405,322 @@ class WeeklyProgramming(db.Model):
         return schema
 
 
+# Totals of the sets of a workout, so that workout listings don't have to
+# read every set. The rows are kept up to date by the Set events further
+# below and can be recomputed with the rebuild-summaries command.
+class WorkoutSummary(db.Model):
+
+    workout_id = db.Column(db.Integer, db.ForeignKey("workout.workout_id",
+        ondelete="CASCADE"), primary_key=True
+    )
+    set_count = db.Column(db.Integer, nullable=False, default=0)
+    tonnage = db.Column(db.Float, nullable=False, default=0)
+    total_distance = db.Column(db.Float, nullable=False, default=0)
+    total_duration_seconds = db.Column(db.Integer, nullable=False, default=0)
+    exercise_count = db.Column(db.Integer, nullable=False, default=0)
+    # JSON array of the names of the exercises of the sets, sorted by name
+    exercise_names = db.Column(db.Text, nullable=False, default="[]")
+
+
+
+#
+# Schemas
+#
+
+class FrozenDict(dict):
+    """
+    Read-only dictionary for data that is shared between requests. It is a
+    dict subclass so it can be serialized and validated against like any
+    other dictionary.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict can't be modified")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    @classmethod
+    def freeze(cls, obj):
+        """
+        Recursively turns the dictionaries in obj into FrozenDicts.
+        """
+
+        if isinstance(obj, dict):
+            return cls((key, cls.freeze(value)) for key, value in obj.items())
+        # Lists stay lists because jsonschema only accepts lists as arrays
+        if isinstance(obj, list):
+            return [cls.freeze(value) for value in obj]
+        return obj
+
+
+# The schemas are built once and shared by all requests and all items of the
+# collections instead of building a new dictionary for every control.
+WORKOUT_SCHEMA = FrozenDict.freeze(Workout._build_schema())
+EXERCISE_SCHEMA = FrozenDict.freeze(Exercise._build_schema())
+SET_SCHEMA = FrozenDict.freeze(Set._build_schema())
+SET_BATCH_SCHEMA = FrozenDict.freeze({
+    "type": "array",
+    "minItems": 1,
+    "items": Set._build_schema()
+})
+MAX_DATA_SCHEMA = FrozenDict.freeze(MaxData._build_schema())
+WEEKLY_PROGRAMMING_SCHEMA = FrozenDict.freeze(WeeklyProgramming._build_schema())
+
+
+# Version counter for a database table. It is incremented on every flush that
+# inserts, updates or deletes rows of the table, and the resources derive
+# their ETag and Last-Modified headers from it.
+class ChangeCounter(db.Model):
+
+    table_name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+#
+# Change tracking for conditional GET requests
+#
+
+def bump_change_counters(connection, table_names):
+    """
+    Increments the change counters of the given tables. Used by the session
+    event below, and directly by code that writes to the tables without the
+    ORM.
+    """
+
+    counters = ChangeCounter.__table__
+    now = datetime.datetime.utcnow()
+    # Sorted so that concurrent transactions lock the rows in the same order
+    for table_name in sorted(table_names):
+        result = connection.execute(counters.update().where(
+            counters.c.table_name == table_name
+            ).values(
+            version=counters.c.version + 1,
+            updated_at=now
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(counters.insert().values(
+                table_name=table_name,
+                version=1,
+                updated_at=now
+                )
+            )
+
+
+def get_changed_tables(session):
+    """
+    Returns the names of the tables the pending changes of the session will
+    write to, including the association tables of changed many-to-many
+    relationships.
+    """
+
+    table_names = set()
+    dirty = session.dirty
+    for obj in chain(session.new, dirty, session.deleted):
+        mapper = inspect(obj).mapper
+        table_names.add(mapper.local_table.name)
+        for relationship in mapper.relationships:
+            if relationship.secondary is None:
+                continue
+            # Collections that haven't been loaded can't have changes
+            if obj in dirty and not attributes.get_history(
+                    obj, relationship.key,
+                    passive=attributes.PASSIVE_NO_INITIALIZE
+                    ).has_changes():
+                continue
+            table_names.add(relationship.secondary.name)
+    table_names.discard(ChangeCounter.__tablename__)
+    # The Set events and the renames of exercises write the summaries without
+    # the session
+    if Set.__tablename__ in table_names or any(
+            isinstance(obj, Exercise)
+            and attributes.get_history(obj, "exercise_name").has_changes()
+            for obj in dirty
+            ):
+        table_names.add(WorkoutSummary.__tablename__)
+    return table_names
+
+
+@event.listens_for(db.session, "after_flush")
+def _bump_changed_tables(session, flush_context):
+    table_names = get_changed_tables(session)
+    if table_names:
+        bump_change_counters(session.connection(), table_names)
+
+
+#
+# Order numbers of sets and max data
+#
+
+# How many times a free order number is looked up again when a concurrent
+# request takes the same number first
+ORDER_ALLOCATION_ATTEMPTS = 10
+
+
+def next_free_order(order_column, **filters):
+    """
+    Returns the first unused order number starting from 1 among the rows
+    matching the filters. The gap is found in the database with a single
+    query that is served by the unique constraint of the order number.
+    : param Column order_column: order number column, e.g. Set.order_in_workout
+    : param filters: column names and values the order numbers are unique within
+    """
+
+    table = order_column.table
+    order = order_column.name
+    row = table.alias()
+    next_row = table.alias()
+
+    def order_taken(alias, number):
+        return exists().where(and_(
+            alias.c[order] == number,
+            *[alias.c[name] == value for name, value in filters.items()]
+        ))
+
+    first_gap = select([func.min(row.c[order]) + 1]).where(and_(
+        ~order_taken(next_row, row.c[order] + 1),
+        *[row.c[name] == value for name, value in filters.items()]
+    )).as_scalar()
+    query = select([case([(~order_taken(table, 1), 1)], else_=first_gap)])
+    return db.session.execute(query).scalar()
+
+
+#
+# Workout summaries
+#
+
+def _set_totals(weight, number_of_reps, distance, duration, sign=1):
+    tonnage = 0
+    if weight is not None and number_of_reps is not None:
+        tonnage = weight * number_of_reps
+    return {
+        "set_count": sign,
+        "tonnage": sign * tonnage,
+        "total_distance": sign * (distance or 0),
+        "total_duration_seconds": sign * int(
+            duration.total_seconds() if duration is not None else 0
+        )
+    }
+
+
+def _exercise_names(workout_id):
+    # JSON array of the sorted names of the exercises of a workout's sets.
+    # The workout_id may be a column of the sets of an enclosing query, which
+    # a subquery in FROM is only correlated to when told so.
+    sets = Set.__table__.alias()
+    exercises = Exercise.__table__
+    names = select([exercises.c.exercise_name]).distinct().select_from(
+        sets.join(exercises, sets.c.exercise_id == exercises.c.id)
+    ).where(sets.c.workout_id == workout_id).order_by(
+        exercises.c.exercise_name
+    ).correlate(Set.__table__).alias()
+    return select([func.json_group_array(names.c.exercise_name)]).as_scalar()
+
+
+def update_workout_summary(connection, workout_id, totals):
+    """
+    Adds the totals of added sets to the summary of a workout, or subtracts
+    them with negative totals. The exercises are collected again from the
+    sets of the workout.
+    """
+
+    summaries = WorkoutSummary.__table__
+    sets = Set.__table__
+    exercise_count = select([func.count(sets.c.exercise_id.distinct())]).where(
+        sets.c.workout_id == workout_id
+    ).as_scalar()
+    exercise_names = _exercise_names(workout_id)
+    result = connection.execute(summaries.update().where(
+        summaries.c.workout_id == workout_id
+        ).values(
+        exercise_count=exercise_count,
+        exercise_names=exercise_names,
+        **{name: summaries.c[name] + value for name, value in totals.items()}
+        )
+    )
+    if result.rowcount == 0 and totals["set_count"] > 0:
+        connection.execute(summaries.insert().values(
+            workout_id=workout_id,
+            exercise_count=exercise_count,
+            exercise_names=exercise_names,
+            **totals
+            )
+        )
+
+
+def rebuild_workout_summaries(connection, workout_ids=None):
+    """
+    Recomputes the summaries of the given workouts, or all workouts, from
+    their sets. Used after writing sets without the ORM, e.g. in imports.
+    """
+
+    summaries = WorkoutSummary.__table__
+    sets = Set.__table__
+    tonnage = func.coalesce(sets.c.weight * sets.c.number_of_reps, 0)
+    # Intervals are stored as datetimes relative to the epoch
+    duration = func.coalesce(func.strftime("%s", sets.c.duration), 0)
+    totals = select([
+        sets.c.workout_id,
+        func.count(),
+        func.sum(tonnage),
+        func.sum(func.coalesce(sets.c.distance, 0)),
+        func.sum(cast(duration, db.Integer)),
+        func.count(sets.c.exercise_id.distinct()),
+        _exercise_names(sets.c.workout_id)
+    ]).group_by(sets.c.workout_id)
+    delete = summaries.delete()
+    if workout_ids is not None:
+        totals = totals.where(sets.c.workout_id.in_(workout_ids))
+        delete = delete.where(summaries.c.workout_id.in_(workout_ids))
+
+    connection.execute(delete)
+    connection.execute(summaries.insert().from_select(
+        [
+            "workout_id",
+            "set_count",
+            "tonnage",
+            "total_distance",
+            "total_duration_seconds",
+            "exercise_count",
+            "exercise_names"
+        ],
+        totals
+    ))
+
+
+@event.listens_for(Set, "after_insert")
+def _add_set_to_summary(mapper, connection, target):
+    update_workout_summary(connection, target.workout_id, _set_totals(
+        target.weight, target.number_of_reps, target.distance, target.duration
+    ))
+
+
+@event.listens_for(Set, "after_update")
+def _update_set_in_summary(mapper, connection, target):
+    # The previous values of the set may not have been loaded, so the
+    # summaries of its workouts are counted again from their sets
+    workout_ids = {target.workout_id}
+    workout_ids.update(attributes.get_history(target, "workout_id").deleted)
+    rebuild_workout_summaries(connection, list(workout_ids))
+
+
+@event.listens_for(Set, "after_delete")
+def _remove_set_from_summary(mapper, connection, target):
+    update_workout_summary(connection, target.workout_id, _set_totals(
+        target.weight, target.number_of_reps, target.distance, target.duration,
+        sign=-1
+    ))
+
+
+@event.listens_for(Exercise, "after_update")
+def _rename_exercise_in_summaries(mapper, connection, target):
+    if not attributes.get_history(target, "exercise_name").has_changes():
+        return
+    sets = Set.__table__
+    rebuild_workout_summaries(connection, select([sets.c.workout_id]).where(
+        sets.c.exercise_id == target.id
+    ).distinct())
 
 
 #
@@ -673,14 +1081,166 @@ def insert_initial_data(*args, **kwargs):
     db.session.commit()
 
 
+def _bind_cli_user(username):
+    # Commands act as the default user unless --user is given
+    from workoutlog import sharding, tenancy
+    if username is None:
+        if sharding.get_router() is None:
+            return
+        username = DEFAULT_USERNAME
+    try:
+        tenancy.bind_user(username)
+    except LookupError as e:
+        raise click.ClickException(str(e))
+
+
+_user_option = click.option("--user", "username", default=None,
+    help="Username of the user to act as, the default user by default")
+
+
+def _create_user(username):
+    # Adds a user, on the shard with the fewest users if the app is sharded
+    from workoutlog import sharding
+    router = sharding.get_router()
+    user = User(username=username)
+    if router is not None:
+        user.shard = sharding.least_used_shard()
+    db.session.add(user)
+    db.session.commit()
+    if router is not None:
+        router.add_user(user.shard, user.id, username)
+    return user
+
+
+# Creates a user of a shared deployment
+@click.command("create-user")
+@click.argument("username")
+@with_appcontext
+def create_user_command(username):
+    if User.query.filter_by(username=username).first() is not None:
+        raise click.ClickException("User '{}' already exists".format(username))
+    user = _create_user(username)
+    click.echo("Created user '{}' with id {}".format(user.username, user.id))
+
+
+# Writes the whole training log as NDJSON to a file or stdout
+@click.command("export")
+@click.option("--output", "-o", type=click.File("wb"), default="-",
+    help="File to write the export to, stdout by default")
+@_user_option
+@with_appcontext
+def export_command(output, username):
+    from workoutlog.export import iter_export_lines
+    _bind_cli_user(username)
+    for line in iter_export_lines():
+        output.write(line)
+
+
+# Usernames of the users generated by gen-load --users
+LOAD_USERNAME = "load-{}"
+
+
+# Generates a synthetic training log for load testing. With --users the log
+# is spread across that many users, which are created unless they exist.
+@click.command("gen-load")
+@click.option("--years", type=float, default=None,
+    help="Length of the log of every user in years, 1 by default unless --sets is given")
+@click.option("--sets-per-workout", type=int, default=20,
+    help="Average number of sets in a workout")
+@click.option("--sets", "max_sets", type=int, default=None,
+    help="Stop after this many sets in total")
+@click.option("--seed", type=int, default=0, help="Seed of the random numbers")
+@click.option("--users", type=int, default=None,
+    help="Spread the log across users load-1 to load-N, each with its own seed")
+@_user_option
+@with_appcontext
+def gen_load_command(years, sets_per_workout, max_sets, seed, users, username):
+    from workoutlog import importer, loadgen
+    if users is None:
+        usernames = [username]
+    elif username is not None:
+        raise click.BadParameter("--users and --user can't be used together")
+    elif users < 1:
+        raise click.BadParameter("--users must be at least 1")
+    else:
+        usernames = [LOAD_USERNAME.format(i) for i in range(1, users + 1)]
+
+    workouts = sets = seconds = 0
+    for i, username in enumerate(usernames):
+        if users is not None and User.query.filter_by(username=username).first() is None:
+            _create_user(username)
+        _bind_cli_user(username)
+        user_sets = max_sets
+        if max_sets is not None:
+            # The first users get the remainder
+            user_sets = max_sets // len(usernames) + (i < max_sets % len(usernames))
+            if user_sets == 0:
+                continue
+        records = loadgen.generate_training_log(years, sets_per_workout, seed + i, user_sets)
+        stats = importer.import_records(enumerate(records, 1))
+        workouts += stats["records"]["workout"]
+        sets += stats["records"]["set"]
+        seconds += stats["seconds"]
+    click.echo("Generated {} workouts and {} sets{} in {} s".format(
+        workouts, sets, "" if users is None else " for {} users".format(users),
+        round(seconds, 3)
+    ))
+
+
+# Imports a training log from an NDJSON export or a CSV file of sets
+@click.command("import")
+@click.argument("input", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "input_format", type=click.Choice(["ndjson", "csv"]),
+    help="Format of the input, by default from the file extension")
+@click.option("--chunk-size", type=int, default=None,
+    help="Number of records to write in one transaction")
+@_user_option
+@with_appcontext
+def import_command(input, input_format, chunk_size, username):
+    from workoutlog import importer
+    _bind_cli_user(username)
+    if input_format is None:
+        input_format = "csv" if input.name.endswith(".csv") else "ndjson"
+    parse = importer.parse_csv if input_format == "csv" else importer.parse_ndjson
+    try:
+        stats = importer.import_records(
+            parse(input), chunk_size or importer.IMPORT_CHUNK_SIZE
+        )
+    except importer.ImportFormatError as e:
+        raise click.ClickException(str(e))
+    click.echo("Imported {} rows ({} new, {} records skipped) in {} s, {} rows/s".format(
+        stats["rows"], stats["inserted"], sum(stats["skipped"].values()),
+        stats["seconds"], stats["rows_per_second"]
+    ))
+
+
 # Deletes the database
 @click.command("delete-db")
 @with_appcontext
 def delete_db_command():
-    db.drop_all()
+    from workoutlog import sharding
+    for engine in sharding.database_engines():
+        db.Model.metadata.drop_all(engine)
 
 # Initializes the database
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
-    db.create_all()
+    from workoutlog import sharding
+    for engine in sharding.database_engines():
+        db.Model.metadata.create_all(engine)
+
+# Recomputes the workout summaries from the sets of every database
+@click.command("rebuild-summaries")
+@with_appcontext
+def rebuild_summaries_command():
+    from workoutlog import sharding
+    count = 0
+    for engine in sharding.database_engines():
+        with engine.begin() as connection:
+            rebuild_workout_summaries(connection)
+            bump_change_counters(connection, ["workout_summary"])
+            count += connection.execute(
+                select([func.count()]).select_from(WorkoutSummary.__table__)
+            ).scalar()
+    click.echo("Rebuilt the summaries of {} workouts".format(count))
@@ -0,0 +1,170 @@
+"""
+Request profiling. Every request records its wall time, the number and time
+of its SQL statements and the time spent serializing the response. The times
+are sent to the client in a Server-Timing header and added to per-endpoint
+counters that are served in the Prometheus text format from /metrics.
+
+With PROFILE_REQUESTS enabled in the config, a request with ?profile=1 runs
+under cProfile and returns the profile summary instead of its response.
+"""
+
+import cProfile
+import io
+import pstats
+import threading
+import time
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from workoutlog import db
+
+PROFILE_STATS_LIMIT = 40
+
+# Name, help text and attribute of RequestMetrics of every counter
+COUNTERS = (
+    ("workoutlog_requests_total", "Number of requests", "requests"),
+    ("workoutlog_request_seconds_total", "Wall time of requests", "seconds"),
+    ("workoutlog_sql_statements_total", "Number of SQL statements", "sql_statements"),
+    ("workoutlog_sql_seconds_total", "Time spent executing SQL statements", "sql_seconds"),
+    ("workoutlog_serialization_seconds_total", "Time spent serializing responses", "serialization_seconds")
+)
+
+
+class _EndpointMetrics(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+class RequestMetrics(object):
+    """
+    Counters of the requests of every endpoint and method since the app was
+    created.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, method, seconds, sql_statements, sql_seconds,
+               serialization_seconds):
+        with self._lock:
+            metrics = self._endpoints.get((endpoint, method))
+            if metrics is None:
+                metrics = self._endpoints[endpoint, method] = _EndpointMetrics()
+            metrics.requests += 1
+            metrics.seconds += seconds
+            metrics.sql_statements += sql_statements
+            metrics.sql_seconds += sql_seconds
+            metrics.serialization_seconds += serialization_seconds
+
+    def render(self):
+        """
+        Returns the counters in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            endpoints = sorted(
+                (key, vars(metrics).copy()) for key, metrics in self._endpoints.items()
+            )
+        lines = []
+        for name, help, attribute in COUNTERS:
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} counter".format(name))
+            for (endpoint, method), values in endpoints:
+                lines.append('{}{{endpoint="{}",method="{}"}} {}'.format(
+                    name, endpoint, method, values[attribute]
+                ))
+        return "\n".join(lines) + "\n"
+
+
+def record_serialization(seconds):
+    """
+    Adds time spent serializing a response to the profile of the request.
+    """
+
+    if has_request_context() and "profile_start" in g:
+        g.profile_serialization_seconds += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["profile_query_start"].pop()
+    if has_request_context() and "profile_start" in g:
+        g.profile_sql_statements += 1
+        g.profile_sql_seconds += time.perf_counter() - start
+
+
+def _add_cursor_listeners(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_request():
+    g.profile_start = time.perf_counter()
+    g.profile_sql_statements = 0
+    g.profile_sql_seconds = 0.0
+    g.profile_serialization_seconds = 0.0
+    if current_app.config["PROFILE_REQUESTS"] and request.args.get("profile") == "1":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    if "profiler" in g:
+        g.profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(g.profiler, stream=output)
+        stats.sort_stats("cumulative").print_stats(PROFILE_STATS_LIMIT)
+        response = Response(output.getvalue(), mimetype="text/plain")
+
+    seconds = time.perf_counter() - g.profile_start
+    endpoint = request.url_rule.endpoint if request.url_rule is not None else "none"
+    current_app.extensions["request_metrics"].record(
+        endpoint,
+        request.method,
+        seconds,
+        g.profile_sql_statements,
+        g.profile_sql_seconds,
+        g.profile_serialization_seconds
+    )
+
+    # Streamed responses are still being generated, so their total time
+    # isn't known yet
+    response.headers["Server-Timing"] = ", ".join((
+        "app;dur={:.2f}".format(seconds * 1000),
+        'db;dur={:.2f};desc="{} queries"'.format(
+            g.profile_sql_seconds * 1000, g.profile_sql_statements
+        ),
+        "serialize;dur={:.2f}".format(g.profile_serialization_seconds * 1000)
+    ))
+    return response
+
+
+def metrics():
+    text = current_app.extensions["request_metrics"].render()
+    if "response_cache" in current_app.extensions:
+        text += current_app.extensions["response_cache"].render()
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """
+    Adds the request hooks, the SQL statement listeners of the app's engines
+    and the /metrics route to an app.
+    """
+
+    app.extensions["request_metrics"] = RequestMetrics()
+    with app.app_context():
+        _add_cursor_listeners(db.engine)
+    if "shard_router" in app.extensions:
+        app.extensions["shard_router"].engine_hooks.append(_add_cursor_listeners)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -1,30 +1,34 @@
-import json
 from jsonschema import validate, ValidationError
 from flask import Response, request, url_for
 from flask_restful import Resource
+from sqlalchemy import and_, exists
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, raiseload, selectinload
 from workoutlog.models import Exercise, Workout, Set
+from workoutlog.models import exercise_workout_association, bump_change_counters
 from workoutlog import db
-from workoutlog.utils import WorkoutLogBuilder, create_error_response
+from workoutlog.utils import WorkoutLogBuilder, create_error_response, strfTimedelta
+from workoutlog.utils import conditional_get, create_mason_response, link_for
 from workoutlog.constants import *
 
 
 class ExerciseCollection(Resource):
 
+    @conditional_get("exercise", cache=True)
     def get(self): 
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("api.exercisecollection"))
+        body.add_control("self", link_for("api.exercisecollection"))
         body.add_control("profile", EXERCISE_PROFILE)
         body.add_control_add_exercise()
 
         body["items"] = []
-        for db_exercise in Exercise.query.all():
+        for db_exercise in Exercise.query.options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 exercise_name=db_exercise.exercise_name,
                 exercise_type=db_exercise.exercise_type
             )
-            item.add_control("self", url_for(
+            item.add_control("self", link_for(
                 "api.exerciseitem", 
                 exercise_name=db_exercise.exercise_name
                 )
@@ -35,7 +39,7 @@ class ExerciseCollection(Resource):
             item.add_control_get_weekly_programming_for_exercise(db_exercise.exercise_name)
             body["items"].append(item)
 
-        return Response(json.dumps(body, default=str, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
     def post(self):
         if not request.json:
@@ -86,6 +90,7 @@ class ExerciseCollection(Resource):
 
 class ExercisesWithinWorkout(Resource):
 
+    @conditional_get("workout", "exercise", "exercise_workout_association", "set")
     def get(self, workout_id):
         db_workout = Workout.query.filter_by(workout_id=workout_id).first()
         if db_workout is None:
@@ -96,25 +101,47 @@ class ExercisesWithinWorkout(Resource):
 
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("api.exerciseswithinworkout", workout_id=workout_id))
+        body.add_control("self", link_for("api.exerciseswithinworkout", workout_id=workout_id))
         body.add_control("profile", EXERCISE_PROFILE)
-        body.add_control("up", url_for("api.workoutitem", workout_id=workout_id))
+        body.add_control("up", link_for("api.workoutitem", workout_id=workout_id))
         body.add_control_add_exercise_to_workout(workout_id)
         
+        # With ?embed=sets the sets of every exercise are inlined to the items
+        # so that the client doesn't have to fetch them one exercise at a time.
+        embed_sets = request.args.get("embed") == "sets"
+
         body["items"] = []
-        for db_exercise in Exercise.query.filter(Exercise.workouts.contains(db_workout)).all():
+        # The exercises are joined through the association table, which is
+        # searched with its workout_id index
+        query = Exercise.query.join(
+            exercise_workout_association,
+            exercise_workout_association.c.exercise_id == Exercise.id
+            ).filter(
+            exercise_workout_association.c.workout_id == db_workout.workout_id
+        )
+        if embed_sets:
+            # The sets of this workout are joined to the same query. They fill
+            # Exercise.sets, which holds only them for the rest of the request.
+            query = query.outerjoin(Set, and_(
+                Set.exercise_id == Exercise.id,
+                Set.workout_id == db_workout.workout_id
+                )
+            ).options(contains_eager(Exercise.sets)).order_by(
+                Exercise.id, Set.order_in_workout
+            )
+        for db_exercise in query.options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 exercise_name=db_exercise.exercise_name,
                 exercise_type=db_exercise.exercise_type
             )
             item.add_control(
-                "self", url_for(
+                "self", link_for(
                     "api.exerciseitem",
                     workout_id=workout_id,
                     exercise_name=db_exercise.exercise_name)
                 )
             item.add_control("profile", EXERCISE_PROFILE)
-            item.add_control("workoutlog:sets-within-workout", url_for(
+            item.add_control("workoutlog:sets-within-workout", link_for(
                 "api.sets_workouts_path",
                 workout_id=workout_id,
                 exercise_name=db_exercise.exercise_name)
@@ -122,9 +149,36 @@ class ExercisesWithinWorkout(Resource):
             item.add_control_get_max_data_for_exercise(db_exercise.exercise_name)
             item.add_control_get_weekly_programming_for_exercise(db_exercise.exercise_name)
             item.add_control_delete_exercise_from_workout(workout_id,db_exercise.exercise_name)
+            if embed_sets:
+                item.add_control_add_set(workout_id, db_exercise.exercise_name)
+                item["sets"] = []
+                for db_set in db_exercise.sets:
+                    set_item = WorkoutLogBuilder(
+                        order_in_workout=db_set.order_in_workout,
+                        weight=db_set.weight,
+                        number_of_reps=db_set.number_of_reps,
+                        reps_in_reserve=db_set.reps_in_reserve,
+                        rate_of_perceived_exertion=db_set.rate_of_perceived_exertion,
+                        duration=strfTimedelta(db_set.duration, "{hours}h {minutes}min"),
+                        distance=db_set.distance
+                    )
+                    set_item.add_control("self", link_for(
+                        "api.set_workouts_path",
+                        workout_id=workout_id,
+                        exercise_name=db_exercise.exercise_name,
+                        order_in_workout=db_set.order_in_workout
+                        )
+                    )
+                    set_item.add_control("profile", SET_PROFILE)
+                    set_item.add_control_delete_set_workouts_path(
+                        workout_id=workout_id,
+                        exercise_name=db_exercise.exercise_name,
+                        order_in_workout=db_set.order_in_workout
+                    )
+                    item["sets"].append(set_item)
             body["items"].append(item)
 
-        return Response(json.dumps(body, default=str, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
     def post(self, workout_id):
         db_workout = Workout.query.filter_by(workout_id=workout_id).first()
@@ -166,29 +220,31 @@ class ExercisesWithinWorkout(Resource):
             except KeyError:
                 pass
             db.session.add(exercise)
-            try:
-                db_workout.exercises.append(exercise)
-            except IntegrityError:
+            db.session.flush()
+        else: # The exercise already exists and can be added to the collection
+            in_workout = db.session.query(exists().where(and_(
+                exercise_workout_association.c.workout_id == db_workout.workout_id,
+                exercise_workout_association.c.exercise_id == db_exercise.id
+            ))).scalar()
+            if in_workout:
                 return create_error_response(
                     409, "Already exists",
                     "Exercise with name '{}' already exists in workout '{}'".format(
                         request.json["exercise_name"], db_workout.workout_id
                     )
                 )
-            db.session.commit()
-        else: # The exercise already exists and can be added to the collection
-            for exercise in db_workout.exercises:
-                if exercise == db_exercise:
-                    return create_error_response(
-                        409, "Already exists",
-                        "Exercise with name '{}' already exists in workout '{}'".format(
-                            request.json["exercise_name"], db_workout.workout_id
-                        )
-                    )
-            else:
-                db_workout.exercises.append(db_exercise)
-                exercise = db_exercise # For passing to the Location header
-                db.session.commit()
+            exercise = db_exercise # For passing to the Location header
+
+        # The association row is inserted directly instead of appending to
+        # db_workout.exercises, which would load the whole collection first
+        db.session.execute(exercise_workout_association.insert().values(
+            workout_id=db_workout.workout_id,
+            exercise_id=exercise.id
+        ))
+        bump_change_counters(db.session.connection(), [
+            "workout", "exercise", "exercise_workout_association"
+        ])
+        db.session.commit()
 
         return Response(status=201, headers={
             "Location": url_for(
@@ -201,6 +257,7 @@ class ExercisesWithinWorkout(Resource):
 
 class ExerciseItem(Resource):
 
+    @conditional_get("exercise", "workout")
     def get(self, exercise_name, workout_id=None):
         db_workout = None
         if workout_id is not None:
@@ -225,20 +282,20 @@ class ExerciseItem(Resource):
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
 
         if db_workout is not None:
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.exerciseitem", 
                 workout_id=workout_id, 
                 exercise_name=exercise_name
                 )
             )
             body.add_control("profile", EXERCISE_PROFILE)
-            body.add_control("collection", url_for(
+            body.add_control("collection", link_for(
                 "api.exerciseswithinworkout", 
                 workout_id=workout_id
                 )
             )
             body.add_control(
-                "workoutlog:sets-within-workout", url_for(
+                "workoutlog:sets-within-workout", link_for(
                     "api.sets_workouts_path",
                     workout_id=workout_id,
                     exercise_name=exercise_name
@@ -249,20 +306,22 @@ class ExerciseItem(Resource):
                 exercise_name
                 )
         else:
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.exerciseitem",
                 exercise_name=exercise_name
                 )
             )
             body.add_control("profile", EXERCISE_PROFILE)
-            body.add_control("collection", url_for("api.exercisecollection"))
+            body.add_control("collection", link_for("api.exercisecollection"))
             body.add_control_get_workouts_by_exercise(exercise_name)
         body.add_control_get_max_data_for_exercise(exercise_name)
+        body.add_control_get_exercise_stats(exercise_name)
+        body.add_control_get_exercise_e1rm(exercise_name)
         body.add_control_get_weekly_programming_for_exercise(exercise_name)
         body.add_control_edit_exercise(exercise_name)
         body.add_control_delete_exercise(exercise_name)
 
-        return Response(json.dumps(body, default=str, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
     def put(self, exercise_name):
@@ -325,7 +384,18 @@ class ExerciseItem(Resource):
                     "No data found for workout session '{}'".format(workout_id)
                 )
     
-        db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
+        # Deleting the exercise altogether deletes its sets and max data and
+        # the rows of both association tables, so they are loaded up front
+        # with one query each
+        query = Exercise.query.filter_by(exercise_name=exercise_name)
+        if db_workout is None:
+            query = query.options(
+                selectinload(Exercise.workouts).raiseload("*"),
+                selectinload(Exercise.sets).raiseload("*"),
+                selectinload(Exercise.max_data).raiseload("*"),
+                selectinload(Exercise.weekly_programming).raiseload("*")
+            )
+        db_exercise = query.first()
         if db_exercise is None:
             return create_error_response(
                 404, "Not found",
@@ -333,9 +403,19 @@ class ExerciseItem(Resource):
             )
         
         if db_workout is not None: # Delete exercise from workout
-            for db_set in Set.query.filter_by(workout=db_workout, exercise=db_exercise).all():
+            # The sets are deleted through the session for the Set events
+            for db_set in Set.query.filter_by(
+                    workout_id=db_workout.workout_id,
+                    exercise_id=db_exercise.id
+                    ).options(raiseload("*")).all():
                 db.session.delete(db_set)
-            db_workout.exercises.remove(db_exercise)
+            db.session.execute(exercise_workout_association.delete().where(and_(
+                exercise_workout_association.c.workout_id == db_workout.workout_id,
+                exercise_workout_association.c.exercise_id == db_exercise.id
+            )))
+            bump_change_counters(db.session.connection(), [
+                "workout", "exercise", "exercise_workout_association"
+            ])
             db.session.commit()
         else: # Delete workout form database altogether
             db.session.delete(db_exercise)
@@ -0,0 +1,53 @@
+import io
+from flask import Response, request, stream_with_context
+from flask_restful import Resource
+from workoutlog import importer
+from workoutlog.export import iter_export_lines
+from workoutlog.utils import WorkoutLogBuilder, create_error_response
+from workoutlog.utils import create_mason_response, link_for
+from workoutlog.constants import *
+
+
+class TrainingLogExport(Resource):
+
+    # The export is streamed line by line while it's read from the database
+    def get(self):
+        return Response(
+            stream_with_context(iter_export_lines()),
+            mimetype="application/x-ndjson",
+            headers={
+                "Content-Disposition": "attachment; filename=workoutlog.ndjson"
+            }
+        )
+
+
+class TrainingLogImport(Resource):
+
+    # The request body is parsed while it's read, without loading it whole
+    def post(self):
+        if request.mimetype == "text/csv":
+            parse = importer.parse_csv
+        elif request.mimetype in ("application/x-ndjson", "application/json"):
+            parse = importer.parse_ndjson
+        else:
+            return create_error_response(
+                415, "Unsupported media type",
+                "Requests must be NDJSON (application/x-ndjson) or CSV (text/csv)"
+            )
+
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        try:
+            stats = importer.import_records(parse(lines))
+        except importer.ImportFormatError as e:
+            return create_error_response(400, "Invalid import", str(e))
+        except UnicodeDecodeError as e:
+            return create_error_response(400, "Invalid import",
+                "Imports must be UTF-8. " + str(e)
+            )
+
+        body = WorkoutLogBuilder(stats)
+        body.add_namespace("workoutlog", LINK_RELATIONS_URL)
+        body.add_control("self", link_for("api.traininglogimport"))
+        body.add_control("profile", IMPORT_PROFILE)
+        body.add_control_export()
+        return create_mason_response(body)
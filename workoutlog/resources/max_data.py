@@ -1,17 +1,20 @@
-import json
 from datetime import datetime
 from jsonschema import validate, ValidationError
 from flask import Response, request, url_for
 from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload
 from workoutlog.models import MaxData, Exercise
+from workoutlog.models import ORDER_ALLOCATION_ATTEMPTS, next_free_order
 from workoutlog import db
 from workoutlog.utils import WorkoutLogBuilder, create_error_response
+from workoutlog.utils import conditional_get, create_mason_response, link_for
 from workoutlog.constants import *
 
 
 class MaxDataForExercise(Resource):
 
+    @conditional_get("exercise", "max_data")
     def get(self, exercise_name):
         db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
         if db_exercise is None:
@@ -22,12 +25,12 @@ class MaxDataForExercise(Resource):
 
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for(
+        body.add_control("self", link_for(
             "api.maxdataforexercise",
             exercise_name=exercise_name
             )
         )
-        body.add_control("up", url_for(
+        body.add_control("up", link_for(
             "api.exerciseitem",
             exercise_name=exercise_name
             )
@@ -35,7 +38,9 @@ class MaxDataForExercise(Resource):
         body.add_control_add_max_data(exercise_name)
         
         body["items"] = []
-        for db_max_data in MaxData.query.filter_by(exercise=db_exercise).all():
+        for db_max_data in MaxData.query.filter_by(
+                exercise_id=db_exercise.id
+                ).options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 order_for_exercise=db_max_data.order_for_exercise,
                 date=db_max_data.date.strftime('%Y-%m-%d'),
@@ -43,7 +48,7 @@ class MaxDataForExercise(Resource):
                 estimated_max=db_max_data.estimated_max,
                 tested_max=db_max_data.tested_max
             )
-            item.add_control("self", url_for(
+            item.add_control("self", link_for(
                 "api.maxdataitem",
                 order_for_exercise=db_max_data.order_for_exercise,
                 exercise_name=exercise_name
@@ -52,7 +57,7 @@ class MaxDataForExercise(Resource):
             item.add_control("profile", MAX_DATA_PROFILE)
             body["items"].append(item)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
     def post(self, exercise_name):
         db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
@@ -75,58 +80,63 @@ class MaxDataForExercise(Resource):
                 "Invalid JSON document. Missing field or incorrect type.", str(e)
             )
 
-        # Use the order_for_exercise in the request if provided by the client
-        # Otherwise generate it automatically setting it to the first available
-        # number found starting from 1 and incrementing by 1
         try:
-            order_for_exercise = request.json["order_for_exercise"]
-        except KeyError:
-            order_for_exercise = 1
-            order_numbers = []
-            for db_max_data in MaxData.query.filter_by(exercise=db_exercise).all():
-                order_numbers.append(db_max_data.order_for_exercise)
-            found_available_number = False
-            while not found_available_number:
-                if order_for_exercise in order_numbers:
-                    order_for_exercise += 1
-                else:
-                    found_available_number = True
-        
-        try:
-            max_data = MaxData(
-                order_for_exercise=order_for_exercise,
-                date=datetime.strptime(request.json["date"], "%Y-%m-%d"),
-                exercise=db_exercise
-            )
+            date = datetime.strptime(request.json["date"], "%Y-%m-%d")
         except ValueError as e:
             return create_error_response(400, "Invalid date. " +
                 "Date must match format YYYY-MM-DD, for example 2021-8-21", str(e)
             )
 
-        # Iterate over nullable properties in the request and ignore
-        # the KeyError request.json[] from a missing key. This way the client
-        # doesn't have to send anything for columns it wants to keep the same.
-        for prop in request.json:
-            try:
-                if prop == "training_max":
-                    max_data.training_max = request.json[prop]
-                elif prop =="estimated_max":
-                    max_data.estimated_max = request.json[prop]
-                elif prop =="tested_max":
-                    max_data.tested_max = request.json[prop]
-            except KeyError:
-                pass
+        # Use the order_for_exercise in the request if provided by the client.
+        # Otherwise use the first available number starting from 1 and try
+        # again with a new number if a concurrent request takes it first.
+        given_order = request.json.get("order_for_exercise")
+        exercise_id = db_exercise.id
+        for attempt in range(ORDER_ALLOCATION_ATTEMPTS):
+            order_for_exercise = given_order
+            if order_for_exercise is None:
+                order_for_exercise = next_free_order(
+                    MaxData.order_for_exercise,
+                    exercise_id=exercise_id
+                )
 
-        try:
-            db.session.add(max_data)
-            db.session.commit()
-        except IntegrityError:
+            max_data = MaxData(
+                order_for_exercise=order_for_exercise,
+                date=date,
+                exercise_id=exercise_id
+            )
+
+            # Iterate over nullable properties in the request and ignore
+            # the KeyError request.json[] from a missing key. This way the client
+            # doesn't have to send anything for columns it wants to keep the same.
+            for prop in request.json:
+                try:
+                    if prop == "training_max":
+                        max_data.training_max = request.json[prop]
+                    elif prop =="estimated_max":
+                        max_data.estimated_max = request.json[prop]
+                    elif prop =="tested_max":
+                        max_data.tested_max = request.json[prop]
+                except KeyError:
+                    pass
+
+            try:
+                db.session.add(max_data)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if given_order is not None:
+                    return create_error_response(
+                        409, "Already exists",
+                        "Max data for exercise '{}' with order number '{}' "
+                        "already exists.".format(exercise_name, given_order)
+                    )
+        else:
             return create_error_response(
                 409, "Already exists",
-                "Max data for exercise '{}' with order number '{}' " + 
-                "already exists.".format(
-                    exercise_name, request.json["order_for_exercise"]
-                )
+                "No free order number found for max data of exercise '{}', "
+                "try again.".format(exercise_name)
             )
 
         return Response(status=201, headers={
@@ -139,6 +149,7 @@ class MaxDataForExercise(Resource):
 
 class MaxDataItem(Resource):
 
+    @conditional_get("exercise", "max_data")
     def get(self, exercise_name, order_for_exercise):
         db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
         if db_exercise is None:
@@ -165,14 +176,14 @@ class MaxDataItem(Resource):
             tested_max=db_max_data.tested_max
         )
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for(
+        body.add_control("self", link_for(
             "api.maxdataitem",
             order_for_exercise=order_for_exercise,
             exercise_name=exercise_name
             )
         )
         body.add_control("profile", MAX_DATA_PROFILE)
-        body.add_control("collection", url_for(
+        body.add_control("collection", link_for(
             "api.maxdataforexercise",
             exercise_name=exercise_name
             )
@@ -180,7 +191,7 @@ class MaxDataItem(Resource):
         body.add_control_edit_max_data(exercise_name, order_for_exercise)
         body.add_control_delete_max_data(exercise_name, order_for_exercise)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
     def put(self, exercise_name, order_for_exercise):
@@ -1,17 +1,21 @@
-import json
 from datetime import datetime, timedelta
 from jsonschema import validate, ValidationError
 from flask import Response, request, url_for
 from flask_restful import Resource
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload
 from workoutlog.models import Set, Exercise, Workout
+from workoutlog.models import ORDER_ALLOCATION_ATTEMPTS, next_free_order
 from workoutlog import db
 from workoutlog.utils import WorkoutLogBuilder, create_error_response, strfTimedelta
+from workoutlog.utils import conditional_get, create_mason_response, link_for
 from workoutlog.constants import *
 
 
 class SetsWithinWorkout(Resource):
 
+    @conditional_get("workout", "exercise", "set")
     def get(self, exercise_name, workout_id):
         db_workout = Workout.query.filter_by(workout_id=workout_id).first()
         if db_workout is None:
@@ -33,38 +37,43 @@ class SetsWithinWorkout(Resource):
     
         path = request.endpoint
         if path == "api.sets_workouts_path":
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.sets_workouts_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name
                 )
             )
             body.add_control("profile", SET_PROFILE)
-            body.add_control("up", url_for(
+            body.add_control("up", link_for(
                 "api.exerciseitem",
                 workout_id=workout_id,
                 exercise_name=exercise_name
                 )
             )
             body.add_control_add_set(workout_id, exercise_name)
+            body.add_control_add_sets(workout_id, exercise_name)
         elif path == "api.sets_exercises_path":
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.sets_exercises_path", 
                 workout_id=workout_id, 
                 exercise_name=exercise_name
                 )
             )
             body.add_control("profile", SET_PROFILE)
-            body.add_control("up", url_for(
+            body.add_control("up", link_for(
                 "api.workoutitem",
                 workout_id=workout_id, 
                 exercise_name=exercise_name
                 )
             )
             body.add_control_add_set(workout_id, exercise_name)
+            body.add_control_add_sets(workout_id, exercise_name)
         
         body["items"] = []
-        for db_set in Set.query.filter_by(workout=db_workout, exercise=db_exercise).all():
+        for db_set in Set.query.filter_by(
+                workout_id=db_workout.workout_id,
+                exercise_id=db_exercise.id
+                ).options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 order_in_workout=db_set.order_in_workout,
                 weight=db_set.weight,
@@ -75,7 +84,7 @@ class SetsWithinWorkout(Resource):
                 distance=db_set.distance
             )
             if path == "api.sets_workouts_path":
-                item.add_control("self", url_for(
+                item.add_control("self", link_for(
                     "api.set_workouts_path",
                     workout_id=workout_id, 
                     exercise_name=exercise_name, 
@@ -88,7 +97,7 @@ class SetsWithinWorkout(Resource):
                     order_in_workout=db_set.order_in_workout
                 )
             elif path == "api.sets_exercises_path":
-                item.add_control("self", url_for(
+                item.add_control("self", link_for(
                     "api.set_workouts_path",
                     workout_id=workout_id,
                     exercise_name=exercise_name,
@@ -103,7 +112,7 @@ class SetsWithinWorkout(Resource):
             item.add_control("profile", SET_PROFILE)
             body["items"].append(item)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
     def post(self, workout_id, exercise_name):
         db_workout = Workout.query.filter_by(workout_id=workout_id).first()
@@ -120,6 +129,10 @@ class SetsWithinWorkout(Resource):
                 "No exercise was found with the name '{}'".format(exercise_name)
             )
 
+        # A list of sets is logged at once, see _post_batch below
+        if isinstance(request.json, list):
+            return self._post_batch(db_workout, db_exercise)
+
         if not request.json:
             return create_error_response(
                 415, "Unsupported media type",
@@ -131,71 +144,52 @@ class SetsWithinWorkout(Resource):
         except ValidationError as e:
             return create_error_response(400, "Invalid JSON document", str(e))
         
-        # Use the order_in_workout in the request if provided by the client
-        # Otherwise generate it automatically setting it to the first available
-        # number found starting from 1 and incrementing by 1
-        try:
-            order_in_workout = request.json["order_in_workout"]
-        except KeyError:
-            order_in_workout = 1
-            order_numbers = []
-            for db_set in Set.query.filter_by(workout=db_workout, exercise=db_exercise).all():
-                order_numbers.append(db_set.order_in_workout)
-            found_available_number = False
-            while not found_available_number:
-                if order_in_workout in order_numbers:
-                    order_in_workout += 1
-                else:
-                    found_available_number = True
-
-        set = Set(
-            order_in_workout=order_in_workout,
-            exercise=db_exercise,
-            workout=db_workout
-        )
+        # Use the order_in_workout in the request if provided by the client.
+        # Otherwise use the first available number starting from 1 and try
+        # again with a new number if a concurrent request takes it first.
+        given_order = request.json.get("order_in_workout")
+        exercise_id = db_exercise.id
+        for attempt in range(ORDER_ALLOCATION_ATTEMPTS):
+            order_in_workout = given_order
+            if order_in_workout is None:
+                order_in_workout = next_free_order(
+                    Set.order_in_workout,
+                    exercise_id=exercise_id,
+                    workout_id=db_workout.workout_id
+                )
+
+            set = Set(
+                order_in_workout=order_in_workout,
+                exercise_id=exercise_id,
+                workout_id=db_workout.workout_id
+            )
 
-        # Iterate over nullable properties in the request and ignore
-        # the KeyError request.json[] from a missing key. This way the client
-        # doesn't have to send anything for columns it wants to keep the same.
-        for prop in request.json:
             try:
-                if prop == "weight":
-                    set.weight = request.json[prop]
-                elif prop == "number_of_reps":
-                    set.number_of_reps = request.json[prop]
-                elif prop == "reps_in_reserve":
-                    set.reps_in_reserve = request.json[prop]
-                elif prop == "rate_of_perceived_exertion":
-                    set.rate_of_perceived_exertion = request.json[prop]
-                elif prop == "duration":
-                    try:
-                        duration_in_time = datetime.strptime(
-                            request.json["duration"], "%H:%M"
-                        )
-                    except ValueError as e:
-                        return create_error_response(400, "Invalid duration. " +
-                            "Duration must match format HH:MM, for example 1:20", str(e)
+                _set_properties(set, request.json)
+            except ValueError as e:
+                return create_error_response(400, "Invalid duration. " +
+                    "Duration must match format HH:MM, for example 1:20", str(e)
+                )
+
+            try:
+                db.session.add(set)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if given_order is not None:
+                    return create_error_response(
+                        409, "Already exists",
+                        "Set with order '{}' in workout '{}' for exercise '{}' "
+                        "already exists.".format(
+                            given_order, workout_id, exercise_name
                         )
-                    duration_in_delta = timedelta(
-                        hours=duration_in_time.hour, 
-                        minutes=duration_in_time.minute
                     )
-                    set.duration = duration_in_delta
-                elif prop == "distance":
-                    set.distance = request.json[prop]
-            except KeyError:
-                pass
-
-        try:
-            db.session.add(set)
-            db.session.commit()
-        except IntegrityError:
+        else:
             return create_error_response(
                 409, "Already exists",
-                "Set with order '{}' in workout '{}' for exercise '{}' " +
-                "already exists.".format(
-                    request.json["order_in_workout"], workout_id, exercise_name
-                )
+                "No free order number found for the set in workout '{}' for "
+                "exercise '{}', try again.".format(workout_id, exercise_name)
             )
 
         return Response(status=201, headers={
@@ -205,9 +199,158 @@ class SetsWithinWorkout(Resource):
                 order_in_workout=set.order_in_workout)
         })
 
+    def _post_batch(self, db_workout, db_exercise):
+        """
+        Adds all sets of a list in one transaction. Every set is validated
+        first and the errors are reported per set by its index in the list.
+        Sets without an order_in_workout are numbered after the highest
+        order number of the exercise in the workout, and numbered again if a
+        concurrent request takes the numbers first.
+        """
+
+        errors = []
+        sets = []
+        for index, set_json in enumerate(request.json):
+            try:
+                validate(set_json, Set.get_schema())
+            except ValidationError as e:
+                errors.append("Set {}: {}".format(index, e.message))
+                continue
+            set = Set(
+                order_in_workout=set_json.get("order_in_workout"),
+                exercise=db_exercise,
+                workout=db_workout
+            )
+            try:
+                _set_properties(set, set_json)
+            except ValueError as e:
+                errors.append(
+                    "Set {}: invalid duration, duration must match format "
+                    "HH:MM, {}".format(index, e)
+                )
+            sets.append(set)
+        if not request.json:
+            errors.append("The list of sets is empty")
+        if errors:
+            # The sets were added to the session through their relationships
+            db.session.rollback()
+            return create_error_response(400, "Invalid JSON document", errors)
+
+        # Order numbers given by the client must be unique within the request
+        # and can't be taken by the existing sets
+        requested_orders = {}
+        for index, set in enumerate(sets):
+            if set.order_in_workout is None:
+                continue
+            if set.order_in_workout in requested_orders:
+                errors.append("Set {}: order '{}' is also used by set {}".format(
+                    index, set.order_in_workout, requested_orders[set.order_in_workout]
+                ))
+            else:
+                requested_orders[set.order_in_workout] = index
+
+        # Like for single sets in post, the order numbers of the sets without
+        # one are allocated again when a concurrent request takes them first
+        implicit_sets = [set for set in sets if set.order_in_workout is None]
+        for attempt in range(ORDER_ALLOCATION_ATTEMPTS):
+            with db.session.no_autoflush:
+                if requested_orders:
+                    taken_orders = db.session.query(Set.order_in_workout).filter(
+                        Set.workout_id == db_workout.workout_id,
+                        Set.exercise_id == db_exercise.id,
+                        Set.order_in_workout.in_(list(requested_orders))
+                    )
+                    for order_in_workout, in taken_orders:
+                        errors.append("Set {}: set with order '{}' already exists".format(
+                            requested_orders[order_in_workout], order_in_workout
+                        ))
+                max_order = db.session.query(func.max(Set.order_in_workout)).filter(
+                    Set.workout_id == db_workout.workout_id,
+                    Set.exercise_id == db_exercise.id
+                ).scalar()
+            if errors:
+                db.session.rollback()
+                return create_error_response(409, "Already exists", errors)
+
+            next_order = max([max_order or 0] + list(requested_orders)) + 1
+            for set in implicit_sets:
+                set.order_in_workout = next_order
+                next_order += 1
+
+            try:
+                db.session.add_all(sets)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if not implicit_sets:
+                    return create_error_response(
+                        409, "Already exists",
+                        "Another request added sets with the same order numbers"
+                    )
+        else:
+            return create_error_response(
+                409, "Already exists",
+                "No free order numbers found for the sets in workout '{}' for "
+                "exercise '{}', try again.".format(
+                    db_workout.workout_id, db_exercise.exercise_name
+                )
+            )
+
+        body = WorkoutLogBuilder()
+        body.add_namespace("workoutlog", LINK_RELATIONS_URL)
+        body.add_control("profile", SET_PROFILE)
+        body["items"] = []
+        for set in sets:
+            item = WorkoutLogBuilder(order_in_workout=set.order_in_workout)
+            item.add_control("self", link_for(
+                "api.set_workouts_path",
+                workout_id=db_workout.workout_id,
+                exercise_name=db_exercise.exercise_name,
+                order_in_workout=set.order_in_workout
+                )
+            )
+            body["items"].append(item)
+        return create_mason_response(body, 201)
+
+
+def _set_properties(set, set_json):
+    """
+    Sets the nullable properties of a set from a validated JSON document.
+    Raises ValueError if the duration isn't in format HH:MM.
+    """
+
+    # Iterate over nullable properties in the request and ignore
+    # the KeyError request.json[] from a missing key. This way the client
+    # doesn't have to send anything for columns it wants to keep the same.
+    for prop in set_json:
+        try:
+            if prop == "weight":
+                set.weight = set_json[prop]
+            elif prop == "number_of_reps":
+                set.number_of_reps = set_json[prop]
+            elif prop == "reps_in_reserve":
+                set.reps_in_reserve = set_json[prop]
+            elif prop == "rate_of_perceived_exertion":
+                set.rate_of_perceived_exertion = set_json[prop]
+            elif prop == "duration":
+                duration_in_time = datetime.strptime(
+                    set_json["duration"], "%H:%M"
+                )
+                duration_in_delta = timedelta(
+                    hours=duration_in_time.hour, 
+                    minutes=duration_in_time.minute
+                )
+                set.duration = duration_in_delta
+            elif prop == "distance":
+                set.distance = set_json[prop]
+        except KeyError:
+            pass
+
 
 class SetItem(Resource):
 
+    @conditional_get("workout", "exercise", "set")
     def get(self, workout_id, exercise_name, order_in_workout):
         db_workout = Workout.query.filter_by(workout_id=workout_id).first()
         if db_workout is None:
@@ -248,7 +391,7 @@ class SetItem(Resource):
 
         path = request.endpoint
         if path == "api.set_workouts_path":
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.set_workouts_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name,
@@ -256,7 +399,7 @@ class SetItem(Resource):
                 )
             )
             body.add_control("profile", SET_PROFILE)
-            body.add_control("collection", url_for(
+            body.add_control("collection", link_for(
                 "api.sets_workouts_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name
@@ -269,7 +412,7 @@ class SetItem(Resource):
                 workout_id, exercise_name, order_in_workout
             )
         elif path == "api.set_exercises_path":
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.set_exercises_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name,
@@ -277,7 +420,7 @@ class SetItem(Resource):
                 )
             )
             body.add_control("profile", SET_PROFILE)
-            body.add_control("collection", url_for(
+            body.add_control("collection", link_for(
                 "api.sets_exercises_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name
@@ -290,7 +433,7 @@ class SetItem(Resource):
                 workout_id, exercise_name, order_in_workout
             )
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
     def put(self, workout_id, exercise_name, order_in_workout):
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from flask import request
+from flask_restful import Resource
+from sqlalchemy import case, func
+from workoutlog.models import Set, Exercise, Workout
+from workoutlog import db, e1rm
+from workoutlog.utils import WorkoutLogBuilder, create_error_response
+from workoutlog.utils import conditional_get, create_mason_response, link_for
+from workoutlog.constants import *
+
+
+# Monday of the week of the workout as YYYY-MM-DD. SQLite's 'weekday 0'
+# moves the date forward to the next Sunday unless it already is one.
+WEEK_START = func.date(Workout.date_time, "weekday 0", "-6 days")
+
+# Epley formula for the estimated one rep max of a set. A single rep is
+# already a max, so it's used as is.
+ESTIMATED_1RM = case(
+    [(Set.number_of_reps == 1, Set.weight)],
+    else_=Set.weight * (1 + Set.number_of_reps / 30.0)
+)
+
+
+class ExerciseStats(Resource):
+
+    @conditional_get("exercise", "workout", "set")
+    def get(self, exercise_name):
+        db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
+        if db_exercise is None:
+            return create_error_response(
+                404, "Not found",
+                "No data found for exercise '{}'".format(exercise_name)
+            )
+
+        try:
+            date_range = _get_date_range()
+        except ValueError as e:
+            return create_error_response(400, "Invalid date. " +
+                "Date must match format YYYY-MM-DD, for example 2021-8-21", str(e)
+            )
+
+        # All weeks are aggregated in the database with a single query
+        query = db.session.query(
+            WEEK_START.label("week_start"),
+            func.sum(Set.weight * Set.number_of_reps).label("tonnage"),
+            func.sum(Set.number_of_reps).label("total_reps"),
+            func.count(Set.id).label("set_count"),
+            func.avg(Set.rate_of_perceived_exertion).label("average_rpe"),
+            func.max(ESTIMATED_1RM).label("best_estimated_1rm")
+        ).join(Workout, Set.workout_id == Workout.workout_id).filter(
+            Set.exercise_id == db_exercise.id
+        )
+        query = _filter_date_range(query, date_range)
+        query = query.group_by(WEEK_START).order_by(WEEK_START)
+
+        body = WorkoutLogBuilder(exercise_name=db_exercise.exercise_name)
+        body.add_namespace("workoutlog", LINK_RELATIONS_URL)
+        body.add_control("self", link_for(
+            "api.exercisestats",
+            exercise_name=exercise_name,
+            **{arg: request.args.get(arg) for arg in date_range}
+            )
+        )
+        body.add_control("profile", STATS_PROFILE)
+        body.add_control("up", link_for(
+            "api.exerciseitem",
+            exercise_name=exercise_name
+            )
+        )
+
+        body["items"] = []
+        for row in query:
+            body["items"].append(WorkoutLogBuilder(
+                week_start=row.week_start,
+                tonnage=_round(row.tonnage),
+                total_reps=row.total_reps,
+                set_count=row.set_count,
+                average_rpe=_round(row.average_rpe),
+                best_estimated_1rm=_round(row.best_estimated_1rm)
+            ))
+
+        return create_mason_response(body)
+
+
+class ExerciseE1RM(Resource):
+
+    @conditional_get("exercise", "workout", "set")
+    def get(self, exercise_name):
+        db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
+        if db_exercise is None:
+            return create_error_response(
+                404, "Not found",
+                "No data found for exercise '{}'".format(exercise_name)
+            )
+
+        formula = request.args.get("formula", "epley")
+        if formula not in e1rm.FORMULAS:
+            return create_error_response(400, "Invalid formula",
+                "Formula must be one of: {}".format(", ".join(e1rm.FORMULAS))
+            )
+
+        try:
+            date_range = _get_date_range()
+        except ValueError as e:
+            return create_error_response(400, "Invalid date. " +
+                "Date must match format YYYY-MM-DD, for example 2021-8-21", str(e)
+            )
+
+        # The sets are fetched as columns and estimated all at once
+        day = func.date(Workout.date_time)
+        query = db.session.query(
+            day,
+            Set.weight,
+            Set.number_of_reps,
+            Set.reps_in_reserve,
+            Set.rate_of_perceived_exertion
+        ).join(Workout, Set.workout_id == Workout.workout_id).filter(
+            Set.exercise_id == db_exercise.id,
+            Set.weight.isnot(None),
+            Set.number_of_reps.isnot(None)
+        )
+        query = _filter_date_range(query, date_range).order_by(day)
+
+        rows = query.all()
+        if rows:
+            days, weights, reps, reps_in_reserve, rpes = zip(*rows)
+        else:
+            days = weights = reps = reps_in_reserve = rpes = ()
+        estimates = e1rm.FORMULAS[formula](
+            weights, reps, e1rm.reps_in_reserve_of(reps_in_reserve, rpes)
+        )
+
+        body = WorkoutLogBuilder(
+            exercise_name=db_exercise.exercise_name,
+            formula=formula
+        )
+        body.add_namespace("workoutlog", LINK_RELATIONS_URL)
+        body.add_control("self", link_for(
+            "api.exercisee1rm",
+            exercise_name=exercise_name,
+            formula=request.args.get("formula"),
+            **{arg: request.args.get(arg) for arg in date_range}
+            )
+        )
+        body.add_control("profile", E1RM_PROFILE)
+        body.add_control("up", link_for(
+            "api.exerciseitem",
+            exercise_name=exercise_name
+            )
+        )
+
+        body["items"] = []
+        for date, estimated_max in e1rm.daily_best(days, estimates):
+            body["items"].append(WorkoutLogBuilder(
+                date=date,
+                estimated_max=_round(estimated_max)
+            ))
+
+        return create_mason_response(body)
+
+
+def _get_date_range():
+    """
+    Returns the optional from and to dates of the query string. Raises
+    ValueError if a date isn't in format YYYY-MM-DD.
+    """
+
+    date_range = {}
+    for arg in ("from", "to"):
+        if request.args.get(arg) is not None:
+            date_range[arg] = datetime.strptime(request.args[arg], "%Y-%m-%d")
+    return date_range
+
+
+def _filter_date_range(query, date_range):
+    # Both ends of the range are inclusive
+    if "from" in date_range:
+        query = query.filter(Workout.date_time >= date_range["from"])
+    if "to" in date_range:
+        query = query.filter(
+            Workout.date_time < date_range["to"] + timedelta(days=1)
+        )
+    return query
+
+
+def _round(value):
+    if value is None:
+        return None
+    return round(value, 2)
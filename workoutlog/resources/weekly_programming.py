@@ -1,25 +1,34 @@
-import json
 from datetime import datetime, timedelta
 from jsonschema import validate, ValidationError
 from flask import Response, request, url_for
 from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload
 from workoutlog.utils import strfTimedelta
 from workoutlog.models import WeeklyProgramming, Exercise
 from workoutlog import db
 from workoutlog.utils import WorkoutLogBuilder, create_error_response
+from workoutlog.utils import conditional_get, create_mason_response, link_for
 from workoutlog.constants import *
 
 
 class WeeklyProgrammingCollection(Resource):
 
+    @conditional_get("weekly_programming", cache=True)
     def get(self):
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("api.weeklyprogrammingcollection"))
+        body.add_control("self", link_for("api.weeklyprogrammingcollection"))
         body.add_control_add_weekly_programming()
+
+        # With ?schemas=collection the items refer to the schema of the
+        # add-weekly-programming control instead of repeating the same schema
+        schema_url = None
+        if request.args.get("schemas") == "collection":
+            schema_url = "#/@controls/workoutlog:add-weekly-programming/schema"
+
         body["items"] = []
-        for db_weekly_programming in WeeklyProgramming.query.all():
+        for db_weekly_programming in WeeklyProgramming.query.options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 week_number=db_weekly_programming.week_number,
                 exercise_type=db_weekly_programming.exercise_type,
@@ -33,7 +42,7 @@ class WeeklyProgrammingCollection(Resource):
                 average_heart_rate=db_weekly_programming.average_heart_rate,
                 notes=db_weekly_programming.notes
             )
-            item.add_control("self", url_for(
+            item.add_control("self", link_for(
                 "api.weeklyprogrammingitem",
                 week_number=db_weekly_programming.week_number,
                 exercise_type=db_weekly_programming.exercise_type
@@ -45,10 +54,11 @@ class WeeklyProgrammingCollection(Resource):
                 week_number=db_weekly_programming.week_number)
             item.add_control_edit_weekly_programming(
                 exercise_type=db_weekly_programming.exercise_type,
-                week_number=db_weekly_programming.week_number)
+                week_number=db_weekly_programming.week_number,
+                schema_url=schema_url)
             body["items"].append(item)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
     def post(self):
         if not request.json:
@@ -127,6 +137,7 @@ class WeeklyProgrammingCollection(Resource):
 
 class WeeklyProgrammingForExercise(Resource):
 
+    @conditional_get("exercise", "weekly_programming")
     def get(self, exercise_name):
         db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
         if db_exercise is None:
@@ -137,13 +148,13 @@ class WeeklyProgrammingForExercise(Resource):
 
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for(
+        body.add_control("self", link_for(
             "api.weeklyprogrammingforexercise",
             exercise_name=exercise_name
             )
         )
         body.add_control("profile", WEEKLY_PROGRAMMING_PROFILE)
-        body.add_control("up", url_for(
+        body.add_control("up", link_for(
             "api.exerciseitem",
             exercise_name=exercise_name
             )
@@ -151,7 +162,7 @@ class WeeklyProgrammingForExercise(Resource):
         body["items"] = []
         for db_weekly_programming in WeeklyProgramming.query.filter_by(
             exercise_type=db_exercise.exercise_type
-        ).all():
+        ).options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 week_number=db_weekly_programming.week_number,
                 exercise_type=db_weekly_programming.exercise_type,
@@ -165,7 +176,7 @@ class WeeklyProgrammingForExercise(Resource):
                 average_heart_rate=db_weekly_programming.average_heart_rate,
                 notes=db_weekly_programming.notes
             )
-            item.add_control("self", url_for(
+            item.add_control("self", link_for(
                 "api.weeklyprogrammingitem",
                 exercise_name=exercise_name,
                 exercise_type=db_weekly_programming.exercise_type,
@@ -175,11 +186,12 @@ class WeeklyProgrammingForExercise(Resource):
             item.add_control("profile", WEEKLY_PROGRAMMING_PROFILE)
             body["items"].append(item)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
 class WeeklyProgrammingItem(Resource):
 
+    @conditional_get("exercise", "weekly_programming")
     def get(self, week_number, exercise_type, exercise_name=None):
         db_exercise = None
         if exercise_name is not None:
@@ -215,7 +227,7 @@ class WeeklyProgrammingItem(Resource):
             notes=db_weekly_programming.notes
         )
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for(
+        body.add_control("self", link_for(
             "api.weeklyprogrammingitem",
             week_number=week_number,
             exercise_type=exercise_type
@@ -223,17 +235,17 @@ class WeeklyProgrammingItem(Resource):
         )
         body.add_control("profile", WEEKLY_PROGRAMMING_PROFILE)
         if db_exercise is not None:
-            body.add_control("up", url_for(
+            body.add_control("up", link_for(
                 "api.weeklyprogrammingforexercise",
                 exercise_name=exercise_name
                 )
             )
         else:
-            body.add_control("collection", url_for("api.weeklyprogrammingcollection"))
+            body.add_control("collection", link_for("api.weeklyprogrammingcollection"))
         body.add_control_edit_weekly_programming(exercise_type, week_number)
         body.add_control_delete_weekly_programming(exercise_type, week_number)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
     def put(self, exercise_type, week_number):
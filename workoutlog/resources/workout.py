@@ -1,27 +1,109 @@
 import json
 from datetime import datetime, timedelta
 from jsonschema import validate, ValidationError
-from flask import Response, request, url_for
+from flask import Response, current_app, request, url_for
 from flask_restful import Resource
-from sqlalchemy import desc
+from sqlalchemy import desc, tuple_
 from sqlalchemy.exc import IntegrityError
-from workoutlog.models import Exercise, Workout
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+from workoutlog.models import Exercise, Workout, exercise_workout_association
 from workoutlog import db
 from workoutlog.utils import WorkoutLogBuilder, create_error_response, strfTimedelta
+from workoutlog.utils import conditional_get, create_mason_response, link_for
+from workoutlog.utils import encode_workout_cursor, decode_workout_cursor
 from workoutlog.constants import *
 
 
 class WorkoutCollection(Resource):
 
+    @conditional_get("workout", "workout_summary", cache=True)
     def get(self):
+        limit = request.args.get("limit")
+        before = request.args.get("before")
+        after = request.args.get("after")
+        embed = request.args.get("embed")
+        schemas = request.args.get("schemas")
+
+        try:
+            page_size = int(limit or current_app.config["WORKOUT_PAGE_SIZE"])
+        except ValueError as e:
+            return create_error_response(400, "Invalid limit. " +
+                "Limit must be an integer", str(e)
+            )
+        if not 1 <= page_size <= current_app.config["WORKOUT_PAGE_SIZE_MAX"]:
+            return create_error_response(400, "Invalid limit. " +
+                "Limit must be between 1 and {}".format(
+                    current_app.config["WORKOUT_PAGE_SIZE_MAX"]
+                )
+            )
+
+        # Keyset pagination from the newest workout to the oldest. The cursors
+        # point to the first or the last workout of the neighbouring page, so
+        # the query only reads one page worth of rows from the date_time index
+        # no matter how long the training history is.
+        try:
+            if after is not None:
+                cursor = decode_workout_cursor(after)
+                query = Workout.query.filter(
+                    tuple_(Workout.date_time, Workout.workout_id) > cursor
+                    ).order_by(
+                    Workout.date_time, Workout.workout_id
+                    )
+            else:
+                query = Workout.query.order_by(
+                    desc(Workout.date_time), desc(Workout.workout_id)
+                    )
+                if before is not None:
+                    cursor = decode_workout_cursor(before)
+                    query = query.filter(
+                        tuple_(Workout.date_time, Workout.workout_id) < cursor
+                        )
+        except ValueError as e:
+            return create_error_response(400, "Invalid cursor", str(e))
+
+        # With ?embed=summary the summaries are joined to the same query
+        if embed == "summary":
+            query = query.options(joinedload(Workout.summary))
+        query = query.options(raiseload("*"))
+
+        # Fetch one extra row to find out whether there is another page
+        db_workouts = query.limit(page_size + 1).all()
+        has_more = len(db_workouts) > page_size
+        db_workouts = db_workouts[:page_size]
+        if after is not None:
+            db_workouts.reverse()
+
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for("api.workoutcollection"))
+        body.add_control("self", link_for(
+            "api.workoutcollection",
+            before=before,
+            after=after,
+            limit=limit,
+            embed=embed,
+            schemas=schemas
+            )
+        )
         body.add_control("profile", WORKOUT_PROFILE)
         body.add_control_add_workout()
-        
+        if db_workouts:
+            if has_more or after is not None:
+                body.add_control_next_workouts(
+                    encode_workout_cursor(db_workouts[-1]), limit, embed, schemas
+                )
+            if (has_more and after is not None) or before is not None:
+                body.add_control_prev_workouts(
+                    encode_workout_cursor(db_workouts[0]), limit, embed, schemas
+                )
+
+        # With ?schemas=collection the items refer to the schema of the
+        # add-workout control instead of repeating the same schema each
+        schema_url = None
+        if schemas == "collection":
+            schema_url = "#/@controls/workoutlog:add-workout/schema"
+
         body["items"] = []
-        for db_workout in Workout.query.order_by(desc(Workout.date_time)).all():
+        for db_workout in db_workouts:
             item = WorkoutLogBuilder(
                 workout_id=db_workout.workout_id,
                 date_time=db_workout.date_time.strftime('%Y-%m-%d %H:%M'),
@@ -31,18 +113,20 @@ class WorkoutCollection(Resource):
                 max_heart_rate=db_workout.max_heart_rate,
                 notes=db_workout.notes
             )
-            item.add_control("self", url_for(
+            item.add_control("self", link_for(
                 "api.workoutitem", 
                 workout_id=db_workout.workout_id
                 )
             )
             item.add_control("profile", WORKOUT_PROFILE)
             item.add_control_get_exercises_within_workout(db_workout.workout_id)
-            item.add_control_edit_workout(db_workout.workout_id)
+            item.add_control_edit_workout(db_workout.workout_id, schema_url)
             item.add_control_delete_workout(db_workout.workout_id)
+            if embed == "summary":
+                item["summary"] = _summary_json(db_workout.summary)
             body["items"].append(item)
 
-        return Response(json.dumps(body, indent=4, default=str), 200, mimetype=MASON)
+        return create_mason_response(body)
 
     def post(self):
         if not request.json:
@@ -116,6 +200,7 @@ class WorkoutCollection(Resource):
 
 class WorkoutsByExercise(Resource):
 
+    @conditional_get("exercise", "workout", "exercise_workout_association")
     def get(self, exercise_name):
         db_exercise = Exercise.query.filter_by(exercise_name=exercise_name).first()
         if db_exercise is None:
@@ -126,24 +211,27 @@ class WorkoutsByExercise(Resource):
 
         body = WorkoutLogBuilder()
         body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-        body.add_control("self", url_for(
+        body.add_control("self", link_for(
             "api.workoutsbyexercise",
             exercise_name=exercise_name
             )
         )
         body.add_control("profile", WORKOUT_PROFILE)
-        body.add_control("up", url_for(
+        body.add_control("up", link_for(
             "api.exerciseitem",
             exercise_name=exercise_name
             )
         )
         
         body["items"] = []
-        for db_workout in Workout.query.filter(
-                Workout.exercises.contains(db_exercise)
+        for db_workout in Workout.query.join(
+                exercise_workout_association,
+                exercise_workout_association.c.workout_id == Workout.workout_id
+                ).filter(
+                exercise_workout_association.c.exercise_id == db_exercise.id
                 ).order_by(
                 desc(Workout.date_time)
-                ).all():
+                ).options(raiseload("*")).all():
             item = WorkoutLogBuilder(
                 date_time=db_workout.date_time.strftime('%Y-%m-%d %H:%M'),
                 duration=strfTimedelta(db_workout.duration, "{hours}h {minutes}min"),
@@ -152,14 +240,14 @@ class WorkoutsByExercise(Resource):
                 max_heart_rate=db_workout.max_heart_rate,
                 notes=db_workout.notes
             )
-            item.add_control("self", url_for(
+            item.add_control("self", link_for(
                 "api.workoutitem", 
                 exercise_name=exercise_name, 
                 workout_id=db_workout.workout_id
                 )
             )
             item.add_control("profile", WORKOUT_PROFILE)
-            item.add_control("workoutlog:sets-within-workout", url_for(
+            item.add_control("workoutlog:sets-within-workout", link_for(
                 "api.sets_exercises_path", 
                 exercise_name=exercise_name, 
                 workout_id=db_workout.workout_id
@@ -169,11 +257,12 @@ class WorkoutsByExercise(Resource):
             item.add_control_delete_workout(db_workout.workout_id)
             body["items"].append(item)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
 class WorkoutItem(Resource):
 
+    @conditional_get("workout", "exercise")
     def get(self, workout_id, exercise_name=None):
         db_workout = Workout.query.filter_by(workout_id=workout_id).first()
         if db_workout is None:
@@ -201,19 +290,19 @@ class WorkoutItem(Resource):
                 max_heart_rate = db_workout.max_heart_rate
             )
             body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-            body.add_control("self", url_for(
+            body.add_control("self", link_for(
                 "api.workoutitem", 
                 workout_id=workout_id, 
                 exercise_name=exercise_name
                 )
             )
             body.add_control("profile", WORKOUT_PROFILE)
-            body.add_control("collection", url_for(
+            body.add_control("collection", link_for(
                 "api.workoutsbyexercise",
                 exercise_name=exercise_name
                 )
             )
-            body.add_control("sets-within-workout", url_for(
+            body.add_control("sets-within-workout", link_for(
                 "api.sets_exercises_path",
                 workout_id=workout_id,
                 exercise_name=db_exercise.exercise_name
@@ -232,14 +321,14 @@ class WorkoutItem(Resource):
                 max_heart_rate = db_workout.max_heart_rate
             )
             body.add_namespace("workoutlog", LINK_RELATIONS_URL)
-            body.add_control("self", url_for("api.workoutitem", workout_id=workout_id))
+            body.add_control("self", link_for("api.workoutitem", workout_id=workout_id))
             body.add_control("profile", WORKOUT_PROFILE)
-            body.add_control("collection", url_for("api.workoutcollection"))
+            body.add_control("collection", link_for("api.workoutcollection"))
             body.add_control_get_exercises_within_workout(workout_id=workout_id)
             body.add_control_edit_workout(workout_id)
             body.add_control_delete_workout(workout_id)
 
-        return Response(json.dumps(body, indent=4), 200, mimetype=MASON)
+        return create_mason_response(body)
 
 
     def put(self, workout_id):
@@ -271,23 +360,19 @@ class WorkoutItem(Resource):
                         date_time_string = datetime.strptime(
                             request.json["date_time"], "%Y-%m-%d %H:%M"
                         )
-                        for workout in Workout.query.all():
-                            if workout is not Workout.query.filter_by(
-                                workout_id=workout_id
-                            ).first():
-                                if workout.date_time == date_time_string:
-                                    return create_error_response(
-                                        409, "Already exists",
-                                        "Workout with date_time '{}' already exists".format(
-                                            request.json["date_time"]
-                                        )
-                                    )
-                        db_workout.date_time = date_time_string
                     except ValueError as e:
-                        return create_error_response(400, "Invalid datetime." +
+                        return create_error_response(400, "Invalid datetime. " +
                             "Datetime must match format YYYY-MM-DD HH:MM" + 
                             ", for example 2021-8-21 14:15", str(e)
                         )
+                    # Single lookup from the unique index of date_time
+                    date_time_taken = db.session.query(Workout.query.filter(
+                        Workout.date_time == date_time_string,
+                        Workout.workout_id != db_workout.workout_id
+                    ).exists()).scalar()
+                    if date_time_taken:
+                        return _date_time_conflict(request.json["date_time"])
+                    db_workout.date_time = date_time_string
 
                 elif prop =="duration":
                     try:
@@ -316,16 +401,25 @@ class WorkoutItem(Resource):
             except KeyError:
                 pass
 
-        # Integrity errors were already checked earlier
-        db.session.commit()
+        # The date_time may still be taken by a concurrent request
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return _date_time_conflict(request.json["date_time"])
 
         return Response(status=204, headers={
-            "Location": url_for("api.workoutitem", workout_id=workout.workout_id)
+            "Location": url_for("api.workoutitem", workout_id=db_workout.workout_id)
         })
         
 
     def delete(self, workout_id):
-        db_workout = Workout.query.filter_by(workout_id=workout_id).first()
+        # The sets and the association rows are deleted with the workout, so
+        # they are loaded up front with one query each
+        db_workout = Workout.query.filter_by(workout_id=workout_id).options(
+            selectinload(Workout.sets).raiseload("*"),
+            selectinload(Workout.exercises).raiseload("*")
+        ).first()
         if db_workout is None:
             return create_error_response(
                 404, "Not found",
@@ -335,4 +429,29 @@ class WorkoutItem(Resource):
         db.session.delete(db_workout)
         db.session.commit()
 
-        return Response(status=204)
\ No newline at end of file
+        return Response(status=204)
+
+
+def _date_time_conflict(date_time):
+    return create_error_response(
+        409, "Already exists",
+        "Workout with date_time '{}' already exists".format(date_time)
+    )
+
+
+def _summary_json(db_summary):
+    summary = {
+        "set_count": 0,
+        "tonnage": 0,
+        "total_distance": 0,
+        "total_duration_seconds": 0,
+        "exercise_count": 0
+    }
+    exercises = []
+    # Workouts without sets don't have a summary row
+    if db_summary is not None:
+        for key in summary:
+            summary[key] = getattr(db_summary, key)
+        exercises = json.loads(db_summary.exercise_names)
+    summary["exercises"] = exercises
+    return summary
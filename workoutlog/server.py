@@ -0,0 +1,332 @@
+"""
+Production server of the app, installed as the workoutlog command:
+
+    workoutlog serve --workers 4 --threads 8
+
+The master process opens the listening socket and forks the workers, which
+all accept connections from it and run the requests in a pool of threads.
+With --preload the app is created once in the master before forking, so the
+workers start faster and share its memory until they write to it. Without it
+every worker creates its own app. SQLite connections must not cross a fork,
+so every worker disposes the engines it inherited before using them.
+
+Before accepting connections every worker warms up by sending a GET to every
+route of the app through the test client, with URLs filled in from the
+training log of the default user. The first real requests then don't pay
+for the lazy imports, the mapper configuration and the first connections.
+The warm-up isn't counted in /metrics.
+
+A worker that exits is replaced, unless it failed before serving. SIGTERM or
+SIGINT stops the workers, which finish the requests they are running. On
+platforms without fork, like Windows, the app is served by a single process.
+"""
+
+import logging
+import os
+import re
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import click
+from werkzeug.serving import BaseWSGIServer
+
+# Exit status of a worker that failed before serving, which stops the server
+WORKER_BOOT_ERROR = 3
+
+# URL values of the warm-up requests when the training log has no rows for
+# them. The views still run, they just respond 404.
+WARM_UP_VALUES = {
+    "workout_id": "1",
+    "exercise_name": "warm-up",
+    "order_in_workout": "1",
+    "order_for_exercise": "1",
+    "exercise_type": "warm-up",
+    "week_number": "1",
+    "profile": "workout"
+}
+
+_URL_VARIABLE = re.compile(r"<(?:[^>:]+:)?([^>]+)>")
+
+logger = logging.getLogger(__name__)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI server that runs the requests in a bounded pool of threads. The
+    connections that wait for a thread queue up in the pool.
+    : param int threads: number of threads that run requests
+    : param int fd: file descriptor of a listening socket to accept from
+    : param bool multiprocess: whether other processes serve the same app
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None, multiprocess=False):
+        BaseWSGIServer.__init__(self, host, port, app, fd=fd)
+        self.multiprocess = multiprocess
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="workoutlog-serve")
+        if fd is not None:
+            # The workers share the socket, so the ones that lose the race for
+            # a connection must not block in accept
+            self.socket.setblocking(False)
+
+    def get_request(self):
+        request, client_address = self.socket.accept()
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        BaseWSGIServer.server_close(self)
+        # Lets the requests that are running finish
+        self.executor.shutdown(wait=True)
+
+
+def _warm_up_values(app):
+    from workoutlog import db, tenancy
+    from sqlalchemy.exc import SQLAlchemyError
+    from workoutlog.models import Exercise, Set, WeeklyProgramming
+
+    values = dict(WARM_UP_VALUES)
+    with app.app_context():
+        try:
+            tenancy.bind_user(tenancy.DEFAULT_USERNAME)
+            first_set = db.session.query(
+                Set.workout_id, Exercise.exercise_name, Set.order_in_workout
+            ).join(Exercise).order_by(Set.id).first()
+            if first_set is not None:
+                values["workout_id"] = first_set.workout_id
+                values["exercise_name"] = first_set.exercise_name
+                values["order_in_workout"] = first_set.order_in_workout
+            programming = db.session.query(
+                WeeklyProgramming.exercise_type, WeeklyProgramming.week_number
+            ).order_by(WeeklyProgramming.id).first()
+            if programming is not None:
+                values["exercise_type"] = programming.exercise_type
+                values["week_number"] = programming.week_number
+        except (LookupError, SQLAlchemyError) as e:
+            # E.g. a database that isn't initialized yet
+            logger.warning("Warming up without the training log: %s", e)
+        finally:
+            db.session.remove()
+    return values
+
+
+def warm_up(app):
+    """
+    Sends a GET to every route of an app through the test client, except the
+    static files. Only the first chunk of streamed responses, like the export,
+    is read. Returns the URL and the status code of every request.
+    """
+
+    from workoutlog.profiling import RequestMetrics
+
+    from workoutlog.tenancy import DEFAULT_USERNAME
+
+    values = _warm_up_values(app)
+    client = app.test_client()
+    # Acts as the default user also when the user header is required
+    headers = {app.config["USER_HEADER"]: DEFAULT_USERNAME}
+    responses = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if "GET" not in rule.methods or rule.endpoint == "static":
+            continue
+        url = _URL_VARIABLE.sub(
+            lambda match: quote(str(values[match.group(1)]), safe=""), rule.rule
+        )
+        response = client.get(url, headers=headers, buffered=False)
+        try:
+            for chunk in response.response:
+                break
+        finally:
+            response.close()
+        responses.append((url, response.status_code))
+
+    app.extensions["request_metrics"] = RequestMetrics()
+    return responses
+
+
+def _dispose_engines(app):
+    from workoutlog import db
+
+    with app.app_context():
+        engines = [db.get_engine(app)]
+        router = app.extensions.get("shard_router")
+        if router is not None:
+            engines.extend(router.engine(shard) for shard in router.open_shards)
+        for engine in engines:
+            engine.dispose()
+
+
+def _boot_worker(app, create_app, warm):
+    # Returns the app of a worker, warmed up
+    if app is None:
+        app = create_app()
+    else:
+        _dispose_engines(app)
+    if warm:
+        start = time.perf_counter()
+        responses = warm_up(app)
+        click.echo("Worker {} warmed up {} routes in {:.2f} s".format(
+            os.getpid(), len(responses), time.perf_counter() - start
+        ))
+    return app
+
+
+def _serve_worker(app, listener, threads, multiprocess):
+    host, port = listener.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads,
+        fd=listener.fileno(), multiprocess=multiprocess
+    )
+
+    def stop(signum, frame):
+        # shutdown waits for serve_forever, which runs in this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        # Waits for the running requests before the worker exits. Werkzeug's
+        # serve_forever closes the server as well, which is harmless.
+        server.server_close()
+
+
+def _fork_worker(app, create_app, listener, threads, warm):
+    # The signals are blocked until the worker has dropped the handlers of
+    # the master
+    stop_signals = {signal.SIGTERM, signal.SIGINT}
+    signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+    pid = os.fork()
+    if pid != 0:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+        return pid
+
+    status = WORKER_BOOT_ERROR
+    try:
+        for signum in stop_signals:
+            signal.signal(signum, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+        app = _boot_worker(app, create_app, warm)
+        status = 1
+        _serve_worker(app, listener, threads, True)
+        status = 0
+    except BaseException:
+        logger.exception("Worker %s failed", os.getpid())
+    finally:
+        os._exit(status)
+
+
+def serve(create_app, host="127.0.0.1", port=5000, workers=1, threads=8,
+        preload=False, warm=True, listener=None):
+    """
+    Serves an app with preforked workers until SIGTERM or SIGINT. Raises
+    RuntimeError if a worker fails to start.
+    : param create_app: function that creates the app
+    : param int workers: number of worker processes
+    : param int threads: number of threads per worker
+    : param bool preload: whether to create the app before forking
+    : param bool warm: whether the workers warm up before serving
+    : param socket.socket listener: listening socket to use instead of
+        binding host and port
+    """
+
+    if listener is None:
+        listener = socket.create_server((host, port), backlog=1024)
+    app = create_app() if preload else None
+    host, port = listener.getsockname()[:2]
+
+    if workers == 1 or not hasattr(os, "fork"):
+        app = _boot_worker(app, create_app, warm)
+        click.echo("Listening on http://{}:{} with {} threads".format(host, port, threads))
+        _serve_worker(app, listener, threads, False)
+        return
+
+    pids = set()
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                # Exited but not waited for yet
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    click.echo("Listening on http://{}:{} with {} workers of {} threads".format(
+        host, port, workers, threads
+    ))
+    failed = False
+    while len(pids) < workers and not stopping:
+        pids.add(_fork_worker(app, create_app, listener, threads, warm))
+    while pids:
+        pid, status = os.wait()
+        pids.discard(pid)
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == WORKER_BOOT_ERROR:
+            if not failed:
+                failed = True
+                stop(signal.SIGTERM, None)
+        elif not stopping:
+            click.echo("Worker {} {}, replacing it".format(pid,
+                "was killed by signal {}".format(os.WTERMSIG(status))
+                if os.WIFSIGNALED(status)
+                else "exited with status {}".format(os.WEXITSTATUS(status))
+            ))
+            pids.add(_fork_worker(app, create_app, listener, threads, warm))
+    listener.close()
+    if failed:
+        raise RuntimeError("A worker failed to start")
+
+
+@click.group()
+def cli():
+    """
+    Commands of the Workout Log API.
+    """
+
+
+# Serves the app of the instance config with preforked workers
+@cli.command("serve")
+@click.option("--host", default="127.0.0.1", show_default=True, help="Address to listen on")
+@click.option("--port", default=5000, show_default=True, help="Port to listen on")
+@click.option("--workers", type=int, default=None,
+    help="Number of worker processes, the number of CPUs by default"
+)
+@click.option("--threads", default=8, show_default=True, help="Number of threads per worker")
+@click.option("--preload", is_flag=True, help="Create the app before forking the workers")
+@click.option("--warm-up/--no-warm-up", default=True, show_default=True,
+    help="Send a GET to every route in every worker before serving"
+)
+def serve_command(host, port, workers, threads, preload, warm_up):
+    from workoutlog import create_app
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1 or threads < 1:
+        raise click.BadParameter("--workers and --threads must be at least 1")
+    try:
+        serve(create_app, host, port, workers, threads, preload, warm_up)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+if __name__ == "__main__":
+    cli()
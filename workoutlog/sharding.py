@@ -0,0 +1,395 @@
+"""
+Sharding of the users' data over several SQLite files. SQLite allows one
+writer per file, so with SHARD_DATABASE_URIS set the workouts, exercises,
+sets, max data and weekly programming of every user live in one of the
+shard files, and the writes of users on different shards don't wait for
+each other.
+
+The main database, SQLALCHEMY_DATABASE_URI, is the directory: it has the
+users and the shard of every user. create-user assigns new users to the
+shard with the fewest users, and a user without an assigned shard, like the
+default user, is on the shard given by the CRC-32 of their username. Every
+shard has a copy of the rows of its users in its user table for the foreign
+keys.
+
+Statements are routed per app context. Binding a user, see
+workoutlog.tenancy, also binds the shard of the user, after which
+db.session and db.engine use the engine of that shard, except for the
+directory tables that always use the main database. Nothing is routed
+before a user is bound. The engines of the shards are opened on demand and
+at most SHARD_ENGINE_POOL_SIZE of them are kept open, the least recently
+used one is disposed when another one is needed.
+
+rebalance-shards moves users from the shards with the most sets to the ones
+with the fewest. A user is moved by exporting their training log from one
+shard and importing it to the other, so the ids of their rows change.
+"""
+
+import collections
+import io
+import tempfile
+import threading
+import zlib
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import with_appcontext
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import func, orm, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm.session import Session as SessionBase
+
+# Tables that are only used in the main database
+DIRECTORY_TABLES = {"user"}
+
+
+class ShardRouter(object):
+    """
+    The shards of an app and an LRU cache of their engines.
+    : param list uris: database URIs of the shards
+    : param int pool_size: maximum number of open shard engines
+    """
+
+    def __init__(self, app, uris, pool_size):
+        self.app = app
+        self.uris = list(uris)
+        self.pool_size = pool_size
+        # Functions called with every new engine, e.g. to add listeners
+        self.engine_hooks = []
+        self._engines = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shard_count(self):
+        return len(self.uris)
+
+    @property
+    def directory_engine(self):
+        return SQLAlchemy.get_engine(self.app.extensions["sqlalchemy"].db, self.app)
+
+    @property
+    def open_shards(self):
+        """
+        The shards with an open engine, least recently used first.
+        """
+
+        with self._lock:
+            return list(self._engines)
+
+    def engine(self, shard):
+        """
+        Returns the engine of a shard, opening it if needed.
+        : param int shard: index of the shard
+        """
+
+        with self._lock:
+            engine = self._engines.get(shard)
+            if engine is not None:
+                self._engines.move_to_end(shard)
+                return engine
+            engine = self._engines[shard] = self._create_engine(self.uris[shard])
+            if len(self._engines) > self.pool_size:
+                # Sessions that still use the engine keep their connections
+                self._engines.popitem(last=False)[1].dispose()
+            return engine
+
+    def _create_engine(self, uri):
+        db = self.app.extensions["sqlalchemy"].db
+        options = db.apply_pool_defaults(self.app, {})
+        sa_url, options = db.apply_driver_hacks(self.app, make_url(uri), options)
+        options.update(self.app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+        engine = db.create_engine(sa_url, options)
+        for hook in self.engine_hooks:
+            hook(engine)
+        return engine
+
+    def engines(self):
+        """
+        Yields the engine of every shard.
+        """
+
+        for shard in range(self.shard_count):
+            yield self.engine(shard)
+
+    def shard_of(self, username, shard):
+        """
+        Returns the shard of a user.
+        : param str username: username of the user
+        : param int shard: assigned shard of the user or None
+        """
+
+        if shard is not None and shard < self.shard_count:
+            return shard
+        return zlib.crc32(username.encode("utf-8")) % self.shard_count
+
+    def add_user(self, shard, user_id, username):
+        """
+        Copies the row of a user to the user table of a shard.
+        """
+
+        from workoutlog.models import User
+        with self.engine(shard).begin() as connection:
+            connection.execute(User.__table__.insert().prefix_with("OR IGNORE"),
+                id=user_id, username=username
+            )
+
+
+class _ShardSession(SignallingSession):
+    """
+    Session that sends the statements of the directory tables to the main
+    database and the rest to the shard bound to the app context.
+    """
+
+    def __init__(self, db, autocommit=False, autoflush=True, **options):
+        app = db.get_app()
+        router = app.extensions.get("shard_router")
+        if router is None:
+            SignallingSession.__init__(self, db, autocommit, autoflush, **options)
+            return
+        # The engines of the shards are chosen per statement
+        self.app = app
+        options.pop("bind", None)
+        options.pop("binds", None)
+        SessionBase.__init__(self, autocommit=autocommit, autoflush=autoflush,
+            bind=router.directory_engine, binds={}, **options
+        )
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get("shard_router")
+        if router is None:
+            return SignallingSession.get_bind(self, mapper, clause)
+        if mapper is not None and mapper.persist_selectable.name in DIRECTORY_TABLES:
+            return router.directory_engine
+        return _bound_engine(router)
+
+
+class ShardedSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy extension whose default engine is the engine of the shard
+    bound to the app context.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=_ShardSession, db=self, **options)
+
+    def get_engine(self, app=None, bind=None):
+        app = self.get_app(app)
+        router = app.extensions.get("shard_router")
+        if router is not None and bind is None:
+            return _bound_engine(router)
+        return SQLAlchemy.get_engine(self, app, bind)
+
+
+def _bound_engine(router):
+    if has_app_context() and g.get("shard") is not None:
+        return router.engine(g.shard)
+    return router.directory_engine
+
+
+def bind_shard(shard):
+    """
+    Routes the statements of the current app context to a shard.
+    : param int shard: index of the shard
+    """
+
+    g.shard = shard
+
+
+def get_router():
+    """
+    Returns the shard router of the current app, or None if the app isn't
+    sharded.
+    """
+
+    return current_app.extensions.get("shard_router")
+
+
+def database_engines():
+    """
+    Returns the engines of the main database and the shards of the current
+    app.
+    """
+
+    from workoutlog import db
+    router = get_router()
+    if router is None:
+        return [db.engine]
+    return [router.directory_engine] + list(router.engines())
+
+
+def least_used_shard():
+    """
+    Returns the shard with the fewest users, for placing a new user.
+    """
+
+    from workoutlog import db
+    from workoutlog.models import User
+
+    router = get_router()
+    users = [0] * router.shard_count
+    for username, shard in db.session.query(User.username, User.shard):
+        users[router.shard_of(username, shard)] += 1
+    return users.index(min(users))
+
+
+def _delete_user_rows(connection, user_id):
+    from workoutlog.models import (
+        Exercise, MaxData, Set, WeeklyProgramming, Workout, WorkoutSummary,
+        bump_change_counters, exercise_programming_association,
+        exercise_workout_association
+    )
+    workouts = select([Workout.workout_id]).where(Workout.user_id == user_id)
+    programming = select([WeeklyProgramming.id]).where(WeeklyProgramming.user_id == user_id)
+    for table, condition in (
+            (Set.__table__, Set.workout_id.in_(workouts)),
+            (WorkoutSummary.__table__, WorkoutSummary.workout_id.in_(workouts)),
+            (exercise_workout_association,
+                exercise_workout_association.c.workout_id.in_(workouts)),
+            (exercise_programming_association,
+                exercise_programming_association.c.weekly_programming_id.in_(programming)),
+            (MaxData.__table__, MaxData.user_id == user_id),
+            (WeeklyProgramming.__table__, WeeklyProgramming.user_id == user_id),
+            (Workout.__table__, Workout.user_id == user_id),
+            (Exercise.__table__, Exercise.user_id == user_id)
+            ):
+        connection.execute(table.delete().where(condition))
+    bump_change_counters(connection, [
+        "set", "workout_summary", "exercise_workout_association",
+        "exercise_programming_association", "max_data", "weekly_programming",
+        "workout", "exercise"
+    ])
+
+
+def move_user(user_id, target):
+    """
+    Moves the training log of a user to another shard and assigns the user
+    to it. The user must not write while being moved. An interrupted move
+    can be run again.
+    : param int user_id: id of the user
+    : param int target: index of the shard to move to
+    """
+
+    from workoutlog import db, export, importer
+    from workoutlog.models import User
+
+    router = get_router()
+    username, shard = db.session.query(User.username, User.shard).filter_by(id=user_id).one()
+    source = router.shard_of(username, shard)
+    if source == target:
+        return
+
+    g.user_id = user_id
+    router.add_user(target, user_id, username)
+    with tempfile.TemporaryFile() as f:
+        bind_shard(source)
+        for line in export.iter_export_lines():
+            f.write(line)
+        db.session.commit()
+
+        # Rows left on the target by an earlier move are replaced
+        f.seek(0)
+        bind_shard(target)
+        with router.engine(target).begin() as connection:
+            _delete_user_rows(connection, user_id)
+        importer.import_records(importer.parse_ndjson(io.TextIOWrapper(f, encoding="utf-8")))
+
+    db.session.query(User).filter_by(id=user_id).update({"shard": target})
+    db.session.commit()
+    with router.engine(source).begin() as connection:
+        _delete_user_rows(connection, user_id)
+
+
+def plan_rebalance(placements, shard_count):
+    """
+    Returns the moves that even out the loads of the shards, as (user, source,
+    target) tuples. While some user of the most loaded shard is lighter than
+    the difference between it and the least loaded shard, the heaviest such
+    user is moved, so every move makes the loads more even.
+    : param dict placements: (shard, load) of every user
+    : param int shard_count: number of shards
+    """
+
+    shards = [0] * shard_count
+    users = [set() for shard in range(shard_count)]
+    for user, (shard, load) in placements.items():
+        shards[shard] += load
+        users[shard].add(user)
+
+    moves = []
+    while True:
+        heaviest = max(range(shard_count), key=lambda shard: shards[shard])
+        lightest = min(range(shard_count), key=lambda shard: shards[shard])
+        gap = shards[heaviest] - shards[lightest]
+        candidates = [
+            user for user in users[heaviest] if 0 < placements[user][1] < gap
+        ]
+        if not candidates:
+            return moves
+        user = max(candidates, key=lambda user: (placements[user][1], user))
+        load = placements[user][1]
+        shards[heaviest] -= load
+        shards[lightest] += load
+        users[heaviest].remove(user)
+        users[lightest].add(user)
+        moves.append((user, heaviest, lightest))
+
+
+def shard_loads():
+    """
+    Returns the (shard, number of sets) of every user.
+    """
+
+    from workoutlog import db
+    from workoutlog.models import Set, User, Workout
+
+    router = get_router()
+    placements = {
+        user_id: router.shard_of(username, shard)
+        for user_id, username, shard in db.session.query(User.id, User.username, User.shard)
+    }
+    loads = {user_id: (shard, 0) for user_id, shard in placements.items()}
+    for shard, engine in enumerate(router.engines()):
+        for user_id, sets in engine.execute(
+                select([Workout.user_id, func.count()]).select_from(
+                    Set.__table__.join(Workout.__table__)
+                ).group_by(Workout.user_id)
+                ):
+            if placements.get(user_id) == shard:
+                loads[user_id] = (shard, sets)
+    return loads
+
+
+def init_app(app):
+    """
+    Adds a shard router to an app that has SHARD_DATABASE_URIS.
+    """
+
+    uris = app.config["SHARD_DATABASE_URIS"]
+    if uris:
+        app.extensions["shard_router"] = ShardRouter(
+            app, uris, app.config["SHARD_ENGINE_POOL_SIZE"]
+        )
+
+
+# Moves users between the shards until their numbers of sets are even
+@click.command("rebalance-shards")
+@click.option("--dry-run", is_flag=True, help="Only print the moves")
+@with_appcontext
+def rebalance_shards_command(dry_run):
+    from workoutlog import db
+    from workoutlog.models import User
+
+    router = get_router()
+    if router is None:
+        raise click.ClickException("SHARD_DATABASE_URIS is not set")
+    loads = shard_loads()
+    moves = plan_rebalance(loads, router.shard_count)
+    for user_id, source, target in moves:
+        username = db.session.query(User.username).filter_by(id=user_id).scalar()
+        click.echo("{} user '{}' ({} sets) from shard {} to shard {}".format(
+            "Would move" if dry_run else "Moving",
+            username, loads[user_id][1], source, target
+        ))
+        if not dry_run:
+            move_user(user_id, target)
+    if not moves:
+        click.echo("The shards are balanced")
@@ -337,6 +337,22 @@ function renderWorkouts(body) {
         $(".workouts_table tbody").append(workoutRow(item));
     });
 
+    // Links to the newer and older pages of workouts
+    let paging = "";
+    if (body["@controls"].prev) {
+        paging += "<a class='btn btn-dark mr-2' href='" +
+            body["@controls"].prev.href + "' onClick='followLink(event, " +
+            "this, renderWorkouts)'>Newer</a>";
+    }
+    if (body["@controls"].next) {
+        paging += "<a class='btn btn-dark' href='" +
+            body["@controls"].next.href + "' onClick='followLink(event, " +
+            "this, renderWorkouts)'>Older</a>";
+    }
+    if (paging !== "") {
+        content.append("<div class='text-center'>" + paging + "</div>");
+    }
+
     // Workout form
     content.append("<hr>");
     content.append("<h2>Add New Workout</h2>");
@@ -360,8 +376,10 @@ function renderWorkout(body) {
     renderTableForWorkouts();
     $(".workouts_table tbody").append(workoutRow(body, "switch_actions"));
 
+    // The sets are embedded to the exercises so that the whole workout can
+    // be rendered from a single request
     getResource(
-        body["@controls"]["workoutlog:exercises-within-workout"].href,
+        body["@controls"]["workoutlog:exercises-within-workout"].href + "?embed=sets",
         renderExercisesWithinWorkout
     );
 }
@@ -377,42 +395,31 @@ function renderExercisesWithinWorkout(body) {
             body["@controls"]["workoutlog:add-exercise-to-workout"]
         );
     } else { // There are exercises already
-        let promises = [];
         body.items.forEach(function (exercise_item) {
-            let request = $.ajax({
-                url: exercise_item["@controls"]["workoutlog:sets-within-workout"].href,
-                success: function(result) {
-                    let exercise_name = exercise_item.exercise_name;
-                    let delete_link = exercise_item["@controls"]["workoutlog:delete-from-workout"].href;
-                    content.append(
-                            "<h2 id='" + exercise_name.split(' ').join('_') +
-                            "_title'>" + exercise_name  +
-                                "<a class='btn btn-danger' " + 
-                                "href='" + delete_link + "' onClick='followLink " + 
-                                "(event, this, deleteExerciseFromWorkout)'>" +
-                                "Delete</a>" +
-                            "</h2>"
-                    );
-                    renderTableForSets(exercise_name);
-                    result.items.forEach(function (set_item) {
-                        $(".sets_table tbody").last().append(setRow(set_item));
-                    });
-                    renderAddSetForm(result);
-                },
-                error: renderError
-            });
-            promises.push(request);
-        });
-        
-        // Render add exercise form after all exercises have been rendered
-        $.when.apply(null, promises).done(function() {
+            let exercise_name = exercise_item.exercise_name;
+            let delete_link = exercise_item["@controls"]["workoutlog:delete-from-workout"].href;
             content.append(
-                "<h3 id='add_exercise_title'>Add Exercise to Workout</h3>"
-            );
-            renderAddExerciseForm(
-                body["@controls"]["workoutlog:add-exercise-to-workout"]
+                    "<h2 id='" + exercise_name.split(' ').join('_') +
+                    "_title'>" + exercise_name  +
+                        "<a class='btn btn-danger' " + 
+                        "href='" + delete_link + "' onClick='followLink " + 
+                        "(event, this, deleteExerciseFromWorkout)'>" +
+                        "Delete</a>" +
+                    "</h2>"
             );
-        })
+            renderTableForSets(exercise_name);
+            exercise_item.sets.forEach(function (set_item) {
+                $(".sets_table tbody").last().append(setRow(set_item));
+            });
+            renderEmbeddedSetForm(exercise_item);
+        });
+
+        content.append(
+            "<h3 id='add_exercise_title'>Add Exercise to Workout</h3>"
+        );
+        renderAddExerciseForm(
+            body["@controls"]["workoutlog:add-exercise-to-workout"]
+        );
     }
 }
 
@@ -563,6 +570,18 @@ function renderAddSetForm(body) {
     });
 }
 
+function renderEmbeddedSetForm(exercise_item) {
+    // The add set control is embedded to the exercise item so the form can
+    // be rendered without fetching the exercise again
+    let ctrl = exercise_item["@controls"]["workoutlog:add-set"];
+
+    renderHtmlForSetForm(exercise_item);
+    let form = $("#" + exercise_item.exercise_name.split(' ').join('_') + "_form");
+    form.attr("action", ctrl.href);
+    form.attr("method", ctrl.method);
+    form.submit(submitSet);
+}
+
 function renderHtmlForSetForm(body) {
     // .split() is used because HTML doesn't allow spaces
     $("#" + body.exercise_name.split(' ').join('_') + "_table").after(
@@ -0,0 +1,90 @@
+"""
+Users of a shared deployment. Every workout, exercise, max data and weekly
+programming row belongs to a user, and the sets, summaries and associations
+belong to the user of their workout and exercise.
+
+The user of a request is chosen with the header named by USER_HEADER in the
+config. Requests without it act as the default user, which owns all data of
+databases from before there were users, or are rejected with 403 if
+REQUIRE_USER_HEADER is set. The API trusts the header, so it only isolates
+users when an authenticating reverse proxy sets it and strips it from the
+requests of clients. CLI commands act as the default
+user unless they bind another one. With sharding, binding a user also binds
+their shard, see workoutlog.sharding.
+
+Every ORM query of a model with a user_id column is filtered to the bound
+user when it's compiled, so the resources don't have to remember to do it.
+Core statements, like the ones of the importer, filter by
+current_user_id() themselves.
+"""
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Query
+
+DEFAULT_USER_ID = 1
+DEFAULT_USERNAME = "default"
+
+
+def current_user_id():
+    """
+    Returns the id of the user bound to the current request or command.
+    """
+
+    if has_app_context() and "user_id" in g:
+        return g.user_id
+    return DEFAULT_USER_ID
+
+
+def bind_user(username):
+    """
+    Makes the user with the given username the user of the current app
+    context. Raises LookupError if there is no such user.
+    : param str username: username of the user
+    """
+
+    from workoutlog import db, sharding
+    from workoutlog.models import User
+
+    user = db.session.query(User.id, User.shard).filter_by(username=username).first()
+    if user is None:
+        raise LookupError("No user found with the username '{}'".format(username))
+    g.user_id = user.id
+    router = sharding.get_router()
+    if router is not None:
+        sharding.bind_shard(router.shard_of(username, user.shard))
+
+
+@event.listens_for(Query, "before_compile", retval=True)
+def _filter_by_user(query):
+    for description in query.column_descriptions:
+        entity = description["entity"]
+        if entity is not None and hasattr(entity, "user_id"):
+            query = query.enable_assertions(False).filter(
+                entity.user_id == current_user_id()
+            )
+    return query
+
+
+def _bind_request_user():
+    from workoutlog.utils import create_error_response
+
+    header = current_app.config["USER_HEADER"]
+    username = request.headers.get(header)
+    if username is None:
+        if current_app.config["REQUIRE_USER_HEADER"] and request.path.startswith("/api/"):
+            return create_error_response(403, "Forbidden",
+                "Requests must name their user in the {} header".format(header)
+            )
+        # The default user is only looked up for its shard
+        if "shard_router" not in current_app.extensions:
+            return
+        username = DEFAULT_USERNAME
+    try:
+        bind_user(username)
+    except LookupError as e:
+        return create_error_response(404, "Not found", str(e))
+
+
+def init_app(app):
+    app.before_request(_bind_request_user)
@@ -1,7 +1,75 @@
 import json
-from flask import Response, request, url_for
+import datetime
+import functools
+import hashlib
+import time
+from flask import Response, current_app, g, request, url_for
+from werkzeug.http import is_resource_modified
+from workoutlog.cache import cache_key, get_cache
 from workoutlog.constants import *
 from workoutlog.models import *
+from workoutlog.profiling import record_serialization
+from workoutlog.tenancy import current_user_id
+
+# orjson is an optional dependency that serializes several times faster than
+# the standard library json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class LinkTemplates(object):
+    """
+    URL templates for the routes of the API. The templates are built once
+    per application from its URL map, and links are then created with plain
+    string formatting instead of going through url_for and the URL map for
+    every control of every item. The links are identical to the ones url_for
+    creates because the values are quoted with the same converter.
+    : param Map url_map: URL map of the application
+    """
+
+    def __init__(self, url_map):
+        # All API routes use the default converter for their arguments
+        self._to_url = url_map.converters["default"](url_map).to_url
+        adapter = url_map.bind("localhost")
+        self._templates = {}
+        for rule in url_map.iter_rules():
+            if not rule.endpoint.startswith("api."):
+                continue
+            placeholders = {arg: "__{}__".format(arg) for arg in rule.arguments}
+            # The URL map picks the rule for the given arguments the same way
+            # url_for does
+            template = adapter.build(rule.endpoint, placeholders)
+            template = template.replace("{", "{{").replace("}", "}}")
+            for arg, placeholder in placeholders.items():
+                template = template.replace(placeholder, "{" + arg + "}")
+            self._templates[(rule.endpoint, frozenset(rule.arguments))] = template
+
+    def build(self, endpoint, **values):
+        """
+        Creates a link to an endpoint. Falls back to url_for for arguments
+        that don't match a template, for example query string arguments.
+        : param str endpoint: name of the endpoint
+        """
+
+        values = {key: value for key, value in values.items() if value is not None}
+        template = self._templates.get((endpoint, frozenset(values)))
+        if template is None:
+            return url_for(endpoint, **values)
+        return request.script_root + template.format(
+            **{key: self._to_url(value) for key, value in values.items()}
+        )
+
+
+def link_for(endpoint, **values):
+    """
+    Creates a link to an endpoint with the link templates of the current
+    application. Works like url_for for the API routes.
+    : param str endpoint: name of the endpoint
+    """
+
+    return current_app.extensions["link_templates"].build(endpoint, **values)
 
 
 # MasonBuilder from course material
@@ -18,16 +86,17 @@ class MasonBuilder(dict):
         """
         Adds an error element to the object. Should only be used for the root
         object, and only in error scenarios.
-        Note: Mason allows more than one string in the @messages property (it's
-        in fact an array). However we are being lazy and supporting just one
-        message.
+        Mason allows more than one string in the @messages property, so the
+        details can also be a list of messages, e.g. one per invalid item.
         : param str title: Short title for the error
-        : param str details: Longer human-readable description
+        : param str|list details: Longer human-readable description
         """
 
+        if not isinstance(details, list):
+            details = [details]
         self["@error"] = {
             "@message": title,
-            "@messages": [details],
+            "@messages": details,
         }
 
     def add_namespace(self, ns, uri):
@@ -71,7 +140,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_get_workouts(self):
         self.add_control(
             "workoutlog:workouts-all",
-            url_for("api.workoutcollection"),
+            link_for("api.workoutcollection"),
             method="GET",
             title="Get all workouts in the database"
         )
@@ -79,7 +148,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_get_exercises(self):
         self.add_control(
             "workoutlog:exercises-all",
-            url_for("api.exercisecollection"),
+            link_for("api.exercisecollection"),
             method="GET",
             title="Get all exercises in the database"
         )
@@ -87,15 +156,54 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_get_weekly_programming_all(self):
         self.add_control(
             "workoutlog:weekly-programming-all",
-            url_for("api.weeklyprogrammingcollection"),
+            link_for("api.weeklyprogrammingcollection"),
             method="GET",
             title="Get all weekly programming data in the database"
         )
 
+    def add_control_next_workouts(self, cursor, limit=None, embed=None, schemas=None):
+        self.add_control(
+            "next",
+            link_for("api.workoutcollection",
+                before=cursor, limit=limit, embed=embed, schemas=schemas
+            ),
+            method="GET",
+            title="Get the next page of older workouts"
+        )
+
+    def add_control_prev_workouts(self, cursor, limit=None, embed=None, schemas=None):
+        self.add_control(
+            "prev",
+            link_for("api.workoutcollection",
+                after=cursor, limit=limit, embed=embed, schemas=schemas
+            ),
+            method="GET",
+            title="Get the previous page of newer workouts"
+        )
+
+    def add_control_export(self):
+        self.add_control(
+            "workoutlog:export",
+            link_for("api.traininglogexport"),
+            method="GET",
+            encoding="ndjson",
+            title="Export the whole training log as newline delimited JSON"
+        )
+
+    def add_control_import(self):
+        self.add_control(
+            "workoutlog:import",
+            link_for("api.traininglogimport"),
+            method="POST",
+            encoding="ndjson",
+            title="Import a training log as NDJSON like the export or as " +
+                "CSV with one set per row (Content-Type: text/csv)"
+        )
+
     def add_control_get_exercises_within_workout(self, workout_id):
         self.add_control(
             "workoutlog:exercises-within-workout",
-            url_for("api.exerciseswithinworkout", workout_id=workout_id),
+            link_for("api.exerciseswithinworkout", workout_id=workout_id),
             method="GET",
             title="Get all exercises done within this workout"
         )
@@ -103,7 +211,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_get_workouts_by_exercise(self, exercise_name):
         self.add_control(
             "workoutlog:workouts-by-exercise",
-            url_for("api.workoutsbyexercise", exercise_name=exercise_name),
+            link_for("api.workoutsbyexercise", exercise_name=exercise_name),
             method="GET",
             title="Get all workouts in which this exercise has been done"
         )
@@ -111,15 +219,31 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_get_max_data_for_exercise(self, exercise_name):
         self.add_control(
             "workoutlog:max-data-for-exercise",
-            url_for("api.maxdataforexercise", exercise_name=exercise_name),
+            link_for("api.maxdataforexercise", exercise_name=exercise_name),
             method="GET",
             title="Get all max data for this exercise"
         )
 
+    def add_control_get_exercise_stats(self, exercise_name):
+        self.add_control(
+            "workoutlog:exercise-stats",
+            link_for("api.exercisestats", exercise_name=exercise_name),
+            method="GET",
+            title="Get weekly training statistics for this exercise"
+        )
+
+    def add_control_get_exercise_e1rm(self, exercise_name):
+        self.add_control(
+            "workoutlog:exercise-e1rm",
+            link_for("api.exercisee1rm", exercise_name=exercise_name),
+            method="GET",
+            title="Get the best estimated one rep max of each day for this exercise"
+        )
+
     def add_control_get_weekly_programming_for_exercise(self, exercise_name):
         self.add_control(
             "workoutlog:weekly-programming-for-exercise",
-            url_for("api.weeklyprogrammingforexercise", exercise_name=exercise_name),
+            link_for("api.weeklyprogrammingforexercise", exercise_name=exercise_name),
             method="GET",
             title="Get all weekly programming data for this exercise"
         )
@@ -130,37 +254,37 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_add_workout(self):
         self.add_control(
             "workoutlog:add-workout",
-            url_for("api.workoutcollection"),
+            link_for("api.workoutcollection"),
             method="POST",
             encoding="json",
             title="Add a new workout",
-            schema=Workout.get_schema()
+            schema=WORKOUT_SCHEMA
         )
     
     def add_control_add_exercise(self):
         self.add_control(
             "workoutlog:add-exercise",
-            url_for("api.exercisecollection"),
+            link_for("api.exercisecollection"),
             method="POST",
             encoding="json",
             title="Add a new exercise",
-            schema=Exercise.get_schema()
+            schema=EXERCISE_SCHEMA
         )
     
     def add_control_add_exercise_to_workout(self, workout_id):
         self.add_control(
             "workoutlog:add-exercise-to-workout",
-            url_for("api.exerciseswithinworkout", workout_id=workout_id),
+            link_for("api.exerciseswithinworkout", workout_id=workout_id),
             method="POST",
             encoding="json",
             title="Add a new exercise to this workout",
-            schema=Exercise.get_schema()
+            schema=EXERCISE_SCHEMA
         )
     
     def add_control_add_set(self, workout_id, exercise_name):
         self.add_control(
             "workoutlog:add-set",
-            url_for(
+            link_for(
                 "api.sets_workouts_path",
                 workout_id=workout_id, 
                 exercise_name=exercise_name
@@ -168,56 +292,70 @@ class WorkoutLogBuilder(MasonBuilder):
             method="POST",
             encoding="json",
             title="Add a new set",
-            schema=Set.get_schema()
+            schema=SET_SCHEMA
+        )
+    
+    def add_control_add_sets(self, workout_id, exercise_name):
+        self.add_control(
+            "workoutlog:add-sets",
+            link_for(
+                "api.sets_workouts_path",
+                workout_id=workout_id,
+                exercise_name=exercise_name
+            ),
+            method="POST",
+            encoding="json",
+            title="Add several new sets at once",
+            schema=SET_BATCH_SCHEMA
         )
     
     def add_control_add_max_data(self, exercise_name):
         self.add_control(
             "workoutlog:add-max-data",
-            url_for("api.maxdataforexercise", exercise_name=exercise_name),
+            link_for("api.maxdataforexercise", exercise_name=exercise_name),
             method="POST",
             encoding="json",
             title="Add a new max data entry",
-            schema=MaxData.get_schema()
+            schema=MAX_DATA_SCHEMA
         )
     
     def add_control_add_weekly_programming(self):
         self.add_control(
             "workoutlog:add-weekly-programming",
-            url_for("api.weeklyprogrammingcollection"),
+            link_for("api.weeklyprogrammingcollection"),
             method="POST",
             encoding="json",
             title="Add a new weekly programming data entry",
-            schema=WeeklyProgramming.get_schema()
+            schema=WEEKLY_PROGRAMMING_SCHEMA
         )
 
 
     ### PUT convenience functions ###
 
-    def add_control_edit_workout(self, workout_id):
+    def add_control_edit_workout(self, workout_id, schema_url=None):
         self.add_control(
             "edit",
-            url_for("api.workoutitem", workout_id=workout_id),
+            link_for("api.workoutitem", workout_id=workout_id),
             method="PUT",
             encoding="json",
             title="Edit this workout",
-            schema=Workout.get_schema()
+            **_schema_or_url(WORKOUT_SCHEMA, schema_url)
         )
         
     def add_control_edit_exercise(self, exercise_name):
         self.add_control(
             "edit",
-            url_for("api.exerciseitem", exercise_name=exercise_name),
+            link_for("api.exerciseitem", exercise_name=exercise_name),
             method="PUT",
             encoding="json",
             title="Edit this exercise",
-            schema=Exercise.get_schema()
+            schema=EXERCISE_SCHEMA
         )
         
     def add_control_edit_set_workouts_path(self, workout_id, exercise_name, order_in_workout):
         self.add_control(
             "edit",
-            url_for("api.set_workouts_path",
+            link_for("api.set_workouts_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name,
                 order_in_workout=order_in_workout
@@ -225,46 +363,46 @@ class WorkoutLogBuilder(MasonBuilder):
             method="PUT",
             encoding="json",
             title="Edit this set",
-            schema=Set.get_schema()
+            schema=SET_SCHEMA
         )
 
     def add_control_edit_set_exercises_path(self, workout_id, exercise_name, order_in_workout):
         self.add_control(
             "edit",
-            url_for("api.set_exercises_path",
+            link_for("api.set_exercises_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name,
                 order_in_workout=order_in_workout),
             method="PUT",
             encoding="json",
             title="Edit this set",
-            schema=Set.get_schema()
+            schema=SET_SCHEMA
         )
         
     def add_control_edit_max_data(self, exercise_name, order_for_exercise):
         self.add_control(
             "edit",
-            url_for("api.maxdataitem",
+            link_for("api.maxdataitem",
                 exercise_name=exercise_name,
                 order_for_exercise=order_for_exercise
                 ),
             method="PUT",
             encoding="json",
             title="Edit this max data entry",
-            schema=MaxData.get_schema()
+            schema=MAX_DATA_SCHEMA
         )
         
-    def add_control_edit_weekly_programming(self, exercise_type, week_number):
+    def add_control_edit_weekly_programming(self, exercise_type, week_number, schema_url=None):
         self.add_control(
             "edit",
-            url_for("api.weeklyprogrammingitem",
+            link_for("api.weeklyprogrammingitem",
                 exercise_type=exercise_type,
                 week_number=week_number
                 ),
             method="PUT",
             encoding="json",
             title="Edit this weekly programming entry",
-            schema=WeeklyProgramming.get_schema()
+            **_schema_or_url(WEEKLY_PROGRAMMING_SCHEMA, schema_url)
         )
     
 
@@ -273,7 +411,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_workout(self, workout_id):
         self.add_control(
             "workoutlog:delete",
-            url_for("api.workoutitem", workout_id=workout_id),
+            link_for("api.workoutitem", workout_id=workout_id),
             method="DELETE",
             title="Delete this workout"
         )
@@ -281,7 +419,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_exercise(self, exercise_name):
         self.add_control(
             "workoutlog:delete",
-            url_for("api.exerciseitem", exercise_name=exercise_name),
+            link_for("api.exerciseitem", exercise_name=exercise_name),
             method="DELETE",
             title="Delete this exercise"
         )
@@ -289,7 +427,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_exercise_from_workout(self, workout_id, exercise_name):
         self.add_control(
             "workoutlog:delete-from-workout",
-            url_for("api.exerciseitem", workout_id=workout_id, exercise_name=exercise_name),
+            link_for("api.exerciseitem", workout_id=workout_id, exercise_name=exercise_name),
             method="DELETE",
             title="Remove this exercise from this workout"
         )
@@ -297,7 +435,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_set_workouts_path(self, workout_id, exercise_name, order_in_workout):
         self.add_control(
             "workoutlog:delete",
-            url_for("api.set_workouts_path",
+            link_for("api.set_workouts_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name,
                 order_in_workout=order_in_workout),
@@ -308,7 +446,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_set_exercises_path(self, workout_id, exercise_name, order_in_workout):
         self.add_control(
             "workoutlog:delete",
-            url_for("api.set_exercises_path",
+            link_for("api.set_exercises_path",
                 workout_id=workout_id,
                 exercise_name=exercise_name,
                 order_in_workout=order_in_workout),
@@ -319,7 +457,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_max_data(self, exercise_name, order_for_exercise):
         self.add_control(
             "workoutlog:delete",
-            url_for("api.maxdataitem",
+            link_for("api.maxdataitem",
                 exercise_name=exercise_name,
                 order_for_exercise=order_for_exercise),
             method="DELETE",
@@ -329,7 +467,7 @@ class WorkoutLogBuilder(MasonBuilder):
     def add_control_delete_weekly_programming(self, exercise_type, week_number):
         self.add_control(
             "workoutlog:delete",
-            url_for(
+            link_for(
                 "api.weeklyprogrammingitem",
                 exercise_type=exercise_type,
                 week_number=week_number
@@ -339,6 +477,18 @@ class WorkoutLogBuilder(MasonBuilder):
         )
 
 
+def _schema_or_url(schema, schema_url):
+    """
+    Returns the schema property for a control. Collections can share one
+    schema between their items by giving a schemaUrl that points to the
+    schema of a collection level control instead.
+    """
+
+    if schema_url is not None:
+        return {"schemaUrl": schema_url}
+    return {"schema": schema}
+
+
 def create_error_response(status_code, title, message=None):
     """
     Creates an error message in Mason format
@@ -348,7 +498,111 @@ def create_error_response(status_code, title, message=None):
     body = MasonBuilder(resource_url=resource_url)
     body.add_error(title, message)
     body.add_control("profile", href=ERROR_PROFILE)
-    return Response(json.dumps(body, indent=4), status_code, mimetype=MASON)
+    return create_mason_response(body, status_code)
+
+
+def dump_json(obj, pretty=False):
+    """
+    Serializes an object to JSON bytes. The output is compact unless pretty
+    is set, and orjson is used for it when it's installed.
+    """
+
+    if pretty:
+        return json.dumps(obj, indent=4, default=str).encode("utf-8")
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def create_mason_response(body, status_code=200, headers=None):
+    """
+    Creates a Mason response from a response body. The body is serialized to
+    compact JSON unless the client asks for indented output with ?pretty=1.
+    """
+
+    pretty = request.args.get("pretty") == "1"
+    start = time.perf_counter()
+    data = dump_json(body, pretty)
+    record_serialization(time.perf_counter() - start)
+    return Response(data, status_code, headers=headers, mimetype=MASON)
+
+
+def conditional_get(*table_names, cache=False):
+    """
+    Decorator for GET methods that adds ETag and Last-Modified headers to the
+    response and answers conditional requests with 304 Not Modified. The ETag
+    is derived from the request URL, the user, the shard and the change
+    counters of the tables the resource is built from, so it can be checked
+    with a single primary key lookup before the handler loads any rows. The
+    shards count their changes separately, so their counters can match.
+    : param str table_names: names of the tables the resource depends on
+    : param bool cache: whether to keep the responses in the response cache,
+        see workoutlog.cache
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            counters = []
+            if table_names:
+                counters = ChangeCounter.query.filter(
+                    ChangeCounter.table_name.in_(table_names)
+                ).order_by(ChangeCounter.table_name).all()
+
+            fingerprint = "{};user={};shard={}".format(
+                request.full_path, current_user_id(), g.get("shard")
+            )
+            for counter in counters:
+                fingerprint += ";{}={}".format(counter.table_name, counter.version)
+            etag = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+            last_modified = max(
+                (counter.updated_at for counter in counters), default=None
+            )
+
+            response_cache = get_cache() if cache else None
+            if not is_resource_modified(
+                    request.environ, etag=etag, last_modified=last_modified
+                    ):
+                response = Response(status=304)
+            elif response_cache is not None:
+                key = cache_key(request.script_root + request.full_path)
+                data = response_cache.get(key, etag)
+                if data is not None:
+                    response = Response(data, mimetype=MASON)
+                else:
+                    response = func(*args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    response_cache.put(key, etag, table_names, response.get_data())
+            else:
+                response = func(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.vary.add(current_app.config["USER_HEADER"])
+            return response
+        return wrapper
+    return decorator
+
+
+def encode_workout_cursor(db_workout):
+    """
+    Creates an opaque pagination cursor for a workout. The cursor contains the
+    keys the workouts are ordered by: date_time and workout_id.
+    """
+
+    return "{}_{}".format(db_workout.date_time.isoformat(), db_workout.workout_id)
+
+
+def decode_workout_cursor(cursor):
+    """
+    Turns a pagination cursor created with encode_workout_cursor back into
+    a (date_time, workout_id) tuple. Raises ValueError for invalid cursors.
+    """
+
+    date_time, workout_id = cursor.rsplit("_", 1)
+    return datetime.datetime.fromisoformat(date_time), int(workout_id)
 
 
 def strfTimedelta(timedelta, frmt):